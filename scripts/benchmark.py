@@ -0,0 +1,568 @@
+"""
+Benchmark each pipeline stage on synthetic data, recording wall time, CPU time, peak RSS and rows/s as JSON.
+
+Usage:
+    python benchmark.py --rows 1000000
+    python benchmark.py --rows 50000000 --stages stream_counts
+    python benchmark.py --rows 1000000 --compare ../outputs/benchmarks/<earlier run>.json
+
+Each stage runs in a fresh process, so one stage's allocations cannot inflate the next stage's
+peak memory. The inputs a stage needs (loaded CSVs, points, LSOA index) are prepared in that
+process before the clock starts, and only the stage itself is measured.
+"""
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import cpu_seconds, peak_rss_mb
+from synthetic_data import LSOA_SHP, SyntheticDataset, generate_dataset
+
+SCRIPTS = Path(__file__).resolve().parent
+# a stage whose wall time or peak memory grows by more than this factor is reported as a regression
+REGRESSION_FACTOR = 1.2
+
+
+def _stop_search_module():
+    # the file name is not a valid module name, so it is loaded by path
+    spec = importlib.util.spec_from_file_location("clean_s_and_s_agg", SCRIPTS / "clean_s&s_agg.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def _memory_mb(field: str) -> float | None:
+    """
+    A memory figure of this process from /proc/self/status (e.g. VmRSS, VmHWM) in MB, None where it is not available.
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1e3
+    except OSError:
+        return None
+
+    return None
+
+
+def _reset_peak_rss() -> bool:
+    """
+    Reset the kernel's peak RSS mark for this process (Linux 4.0+), so the peak covers only what runs next.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+def _lsoa_index(dataset: SyntheticDataset, workdir: Path):
+    from lsoa_index import LsoaIndex
+
+    return LsoaIndex.load(dataset.lsoa_zip, LSOA_SHP, workdir / "lsoa_index")
+
+
+def _stop_search_df(dataset: SyntheticDataset):
+    return _stop_search_module().load_stop_search(dataset.stop_search_dir, dataset.start, dataset.end, forces=dataset.forces)
+
+
+def _stop_search_points(dataset: SyntheticDataset):
+    return _stop_search_module().convert_to_geo_data(_stop_search_df(dataset))
+
+
+def _lfr_gdf(dataset: SyntheticDataset):
+    import geopandas as gpd
+
+    return gpd.read_parquet(dataset.lfr_records)
+
+
+# the original sjoin + groupby aggregation, kept as the baseline the LSOA index is measured against
+def _sjoin_lsoa(points, boundaries):
+    import geopandas as gpd
+
+    return gpd.sjoin(points, boundaries, how="left", predicate="within")
+
+
+def _groupby_counts(joined, boundaries, year: int):
+    counts = joined.groupby("LSOA11CD").size().reset_index(name=f"stop_search_count_{year}")
+
+    return boundaries.merge(counts, on="LSOA11CD", how="left").fillna({f"stop_search_count_{year}": 0})
+
+
+# Each stage prepares its inputs and returns a callable that runs the measured work and
+# returns the number of rows (or other units, see STAGES) it processed.
+
+def stage_read_csv(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    return lambda: len(_stop_search_df(dataset))
+
+
+def stage_convert_to_geo(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    ss = _stop_search_module()
+    df = _stop_search_df(dataset)
+
+    def run() -> int:
+        ss.convert_to_geo_data(df)
+        return len(df)
+
+    return run
+
+
+def stage_lsoa_index_load(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from lsoa_index import LsoaIndex
+
+    # a cold load: parse and reproject the shapefile, then write the cache
+    cache_dir = workdir / "lsoa_index_cold"
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return lambda: len(LsoaIndex.load(dataset.lsoa_zip, LSOA_SHP, cache_dir).codes)
+
+
+def stage_lsoa_grid_build(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from lsoa_index import LsoaIndex
+
+    # no cache folder, so the grid is always built
+    index = LsoaIndex(_lsoa_index(dataset, workdir).boundaries)
+
+    def run() -> int:
+        index.build_grid()
+        return len(index.codes)
+
+    return run
+
+
+def stage_sjoin(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    points = _stop_search_points(dataset)
+    boundaries = _lsoa_index(dataset, workdir).boundaries
+
+    def run() -> int:
+        _sjoin_lsoa(points, boundaries)
+        return len(points)
+
+    return run
+
+
+def stage_assign_exact(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    points = _stop_search_points(dataset)
+    index = _lsoa_index(dataset, workdir)
+
+    return lambda: len(index.assign_ids(points.geometry, "exact"))
+
+
+def stage_assign_grid(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    points = _stop_search_points(dataset)
+    index = _lsoa_index(dataset, workdir)
+    index.build_grid()
+
+    return lambda: len(index.assign_ids(points.geometry, "grid"))
+
+
+def stage_count_groupby(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    boundaries = _lsoa_index(dataset, workdir).boundaries
+    joined = _sjoin_lsoa(_stop_search_points(dataset), boundaries)
+
+    def run() -> int:
+        _groupby_counts(joined, boundaries, 2025)
+        return len(joined)
+
+    return run
+
+
+def stage_count_bincount(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from lsoa_counts import LsoaCounts
+
+    points = _stop_search_points(dataset)
+    index = _lsoa_index(dataset, workdir)
+    ids = index.assign_ids(points.geometry, "exact")
+    months = points["Date"].dt.strftime("%Y-%m")
+
+    def run() -> int:
+        counts = LsoaCounts(index.codes)
+        counts.add("stop_search_count", ids)
+        counts.add("stop_search_count", ids, by=[months])
+        return len(ids)
+
+    return run
+
+
+def stage_stream_counts(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    ss = _stop_search_module()
+    index = _lsoa_index(dataset, workdir)
+    index.build_grid()
+
+    def run() -> int:
+        ss.stream_lsoa_counts(dataset.stop_search_dir, dataset.start, dataset.end, index, forces=dataset.forces)
+        return dataset.n_rows
+
+    return run
+
+
+def stage_lfr_extract(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from clean_lfr import load_lfr
+
+    return lambda: len(load_lfr(dataset.lfr_pdf, cache_path=None))
+
+
+def stage_proximity(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from proximity import proximity_counts
+
+    lfr_gdf = _lfr_gdf(dataset)
+    points = _stop_search_points(dataset)
+
+    def run() -> int:
+        proximity_counts(lfr_gdf, {"stop_search": points.geometry})
+        return len(points)
+
+    return run
+
+
+def stage_spatiotemporal(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from spatiotemporal import SpatioTemporalIndex, deployment_intervals, spatiotemporal_counts
+
+    lfr_gdf = deployment_intervals(_lfr_gdf(dataset))
+    points = _stop_search_points(dataset)
+
+    def run() -> int:
+        index = SpatioTemporalIndex.from_points(points.geometry, points["Date"])
+        spatiotemporal_counts(lfr_gdf, index)
+        return len(points)
+
+    return run
+
+
+def stage_kernel_density(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from density_grid import KDE_BANDWIDTHS_M, KDE_CELL_SIZE_M, RasterGrid, bin_square, bng_bounds, kernel_density
+    from points import LONDON_BOUNDS
+    from proximity import distinct_bng_locations
+
+    points = _stop_search_points(dataset)
+    grid = RasterGrid.covering(bng_bounds(LONDON_BOUNDS), KDE_CELL_SIZE_M)
+
+    def run() -> int:
+        xy, weights = distinct_bng_locations(points.geometry)
+        counts = bin_square(xy, weights, grid)
+        for bandwidth in KDE_BANDWIDTHS_M:
+            kernel_density(counts, grid, bandwidth)
+        return len(points)
+
+    return run
+
+
+def stage_lfr_share_tables(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from stats_analysis import key_stats_from_tables, lfr_share_tables
+
+    complete_df = pd.read_parquet(dataset.lsoa_table)
+
+    def run() -> int:
+        key_stats_from_tables(*lfr_share_tables(complete_df))
+        return len(complete_df)
+
+    return run
+
+
+def stage_placement_significance(dataset: SyntheticDataset, workdir: Path, n_draws: int = 2_000) -> Callable[[], int]:
+    from lfr_significance import placement_significance
+    from stats_analysis import lfr_share_tables, placement_scores
+
+    complete_df = pd.read_parquet(dataset.lsoa_table)
+    scores = placement_scores(complete_df, lfr_share_tables(complete_df)[0])
+    lfr_counts = complete_df["lfr_count"].to_numpy()
+
+    def run() -> int:
+        placement_significance(scores, lfr_counts, complete_df["USUALRES"].to_numpy(), n_draws=n_draws)
+        return n_draws
+
+    return run
+
+
+def stage_spatial_weights(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from spatial_autocorrelation import build_weights
+
+    boundaries = _lsoa_index(dataset, workdir).boundaries
+
+    return lambda: build_weights(boundaries).shape[0]
+
+
+def stage_local_morans(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from spatial_autocorrelation import build_weights, local_morans
+
+    weights = build_weights(_lsoa_index(dataset, workdir).boundaries)
+    values = pd.read_parquet(dataset.lsoa_table)["stop_search_count_2025"].to_numpy()
+
+    return lambda: len(local_morans(values, weights))
+
+
+def stage_lsoa_crosswalk(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from lsoa_crosswalk import LsoaCrosswalk
+
+    table = pd.read_parquet(dataset.lsoa_table)
+    codes = table["LSOA11CD"].to_numpy()
+
+    # every tenth LSOA split in two, the rest carried over unchanged
+    split = codes[::10]
+    lookup = pd.concat([
+        pd.DataFrame({"LSOA11CD": codes, "LSOA21CD": codes}),
+        pd.DataFrame({"LSOA11CD": split, "LSOA21CD": [f"{code}b" for code in split]}),
+    ], ignore_index=True)
+    weights = np.random.default_rng(dataset.seed).uniform(size=len(lookup))
+
+    def run() -> int:
+        crosswalk = LsoaCrosswalk.from_lookup(lookup, codes, weights=weights)
+        crosswalk.apply_frame(table)
+        return len(codes)
+
+    return run
+
+
+def stage_vector_tiles(dataset: SyntheticDataset, workdir: Path) -> Callable[[], int]:
+    from vector_tiles import LFR_PROPERTIES, LSOA_PROPERTIES, VectorLayer, export_tiles
+
+    boundaries = _lsoa_index(dataset, workdir).boundaries
+    lsoa_gdf = boundaries[["LSOA11CD", "geometry"]].merge(pd.read_parquet(dataset.lsoa_table), on="LSOA11CD")
+    layers = [
+        VectorLayer.from_gdf("lsoa", lsoa_gdf, LSOA_PROPERTIES, id_column="LSOA11CD"),
+        VectorLayer.from_gdf("lfr", _lfr_gdf(dataset), LFR_PROPERTIES, simplify=False),
+    ]
+    out_path = workdir / "tiles.mbtiles"
+
+    def run() -> int:
+        # a full build: simplification and every tile
+        out_path.unlink(missing_ok=True)
+        export_tiles(layers, out_path)
+        return len(lsoa_gdf)
+
+    return run
+
+
+# stage name -> (setup, what its rows are)
+STAGES = {
+    "read_csv": (stage_read_csv, "stop & search rows"),
+    "convert_to_geo": (stage_convert_to_geo, "stop & search rows"),
+    "lsoa_index_load": (stage_lsoa_index_load, "LSOAs"),
+    "lsoa_grid_build": (stage_lsoa_grid_build, "LSOAs"),
+    "sjoin": (stage_sjoin, "located rows"),
+    "assign_exact": (stage_assign_exact, "located rows"),
+    "assign_grid": (stage_assign_grid, "located rows"),
+    "count_groupby": (stage_count_groupby, "located rows"),
+    "count_bincount": (stage_count_bincount, "located rows"),
+    "stream_counts": (stage_stream_counts, "stop & search rows"),
+    "lfr_extract": (stage_lfr_extract, "deployments"),
+    "proximity": (stage_proximity, "located rows"),
+    "spatiotemporal": (stage_spatiotemporal, "located rows"),
+    "kernel_density": (stage_kernel_density, "located rows"),
+    "lfr_share_tables": (stage_lfr_share_tables, "LSOAs"),
+    "placement_significance": (stage_placement_significance, "draws"),
+    "spatial_weights": (stage_spatial_weights, "LSOAs"),
+    "local_morans": (stage_local_morans, "LSOAs"),
+    "lsoa_crosswalk": (stage_lsoa_crosswalk, "LSOAs"),
+    "vector_tiles": (stage_vector_tiles, "LSOAs"),
+}
+
+
+def _measure_stage(name: str, dataset: SyntheticDataset, workdir: Path) -> dict:
+    """
+    Prepare and run one stage in the current process. Runs in a fresh worker process.
+    """
+    setup, unit = STAGES[name]
+    run = setup(dataset, workdir)
+
+    rss_before = _memory_mb("VmRSS")
+    peak_reset = _reset_peak_rss()
+
+    cpu_started = cpu_seconds()
+    started = time.perf_counter()
+    rows = run()
+    wall = time.perf_counter() - started
+    cpu = cpu_seconds() - cpu_started
+
+    if peak_reset:
+        peak = _memory_mb("VmHWM")
+    else:
+        # without a resettable peak, the lifetime peak also covers preparing the inputs
+        peak = peak_rss_mb()
+
+    return {
+        "stage": name,
+        "unit": unit,
+        "rows": int(rows),
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "rows_per_s": rows / wall if wall > 0 else None,
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": peak,
+        "peak_covers_setup": not peak_reset,
+    }
+
+
+def run_stage(name: str, dataset: SyntheticDataset, workdir: Path, repeat: int = 1) -> dict:
+    """
+    Benchmark one stage `repeat` times, each in a fresh process, keeping the fastest run.
+
+    Args:
+        name (str): Stage name, a key of STAGES
+        dataset (SyntheticDataset): Inputs to run on
+        workdir (Path): Folder for caches the stages write
+        repeat (int): Number of runs
+
+    Returns:
+        dict: Wall and CPU seconds, rows, rows/s and peak RSS of the fastest run, and the wall time of every run
+    """
+    runs = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            runs.append(executor.submit(_measure_stage, name, dataset, workdir).result())
+
+    fastest = min(runs, key=lambda measured: measured["wall_s"])
+    fastest["wall_s_runs"] = [measured["wall_s"] for measured in runs]
+    fastest["peak_rss_mb"] = max((measured["peak_rss_mb"] for measured in runs if measured["peak_rss_mb"] is not None), default=None)
+
+    return fastest
+
+
+def git_revision() -> tuple[str | None, bool]:
+    """
+    The current commit and whether the working tree has uncommitted changes, (None, False) outside a git checkout.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPTS, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=SCRIPTS, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+    return commit, bool(dirty)
+
+
+def run_benchmarks(dataset: SyntheticDataset, stages: list[str], workdir: Path, repeat: int = 1, label: str | None = None) -> dict:
+    """
+    Benchmark a list of stages on a synthetic dataset.
+
+    Args:
+        dataset (SyntheticDataset): Inputs to run on
+        stages (list[str]): Stage names, in the order to run them
+        workdir (Path): Folder for caches the stages write
+        repeat (int): Runs per stage, the fastest is kept
+        label (str | None): Name for this run, defaults to the git commit
+
+    Returns:
+        dict: Run metadata (commit, machine, dataset) and one result per stage
+    """
+    unknown = [name for name in stages if name not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown benchmark stages: {', '.join(unknown)}")
+
+    # built once up front so every stage loads the same cached index
+    _lsoa_index(dataset, workdir).build_grid()
+
+    commit, dirty = git_revision()
+    results = []
+
+    for name in stages:
+        result = run_stage(name, dataset, workdir, repeat)
+        results.append(result)
+
+        peak = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "n/a"
+        print(f"{name:<24} {result['wall_s']:>9.3f}s  {result['rows_per_s'] or 0:>14,.0f} {result['unit']}/s  peak RSS {peak}")
+
+    return {
+        "label": label or commit or "unlabelled",
+        "commit": commit,
+        "dirty": dirty,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": {module: _version(module) for module in ("numpy", "pandas", "geopandas", "shapely", "pyproj", "pyarrow", "scipy", "fitz")},
+        "dataset": dataset.params(),
+        "repeat": repeat,
+        "stages": results,
+    }
+
+
+def _version(module: str) -> str | None:
+    try:
+        imported = importlib.import_module(module)
+    except ImportError:
+        return None
+
+    return getattr(imported, "__version__", None) or getattr(imported, "VersionBind", None)
+
+
+def compare_runs(baseline: dict, current: dict, factor: float = REGRESSION_FACTOR) -> pd.DataFrame:
+    """
+    Compare two benchmark runs stage by stage.
+
+    Args:
+        baseline (dict): Earlier run, as written by `run_benchmarks`
+        current (dict): Later run
+        factor (float): Ratio of wall time or peak RSS above which a stage is flagged
+
+    Returns:
+        pd.DataFrame: Wall time and peak RSS of both runs, their ratios, and a regression flag, per stage in both runs
+    """
+    before = pd.DataFrame(baseline["stages"]).set_index("stage")[["wall_s", "peak_rss_mb"]]
+    after = pd.DataFrame(current["stages"]).set_index("stage")[["wall_s", "peak_rss_mb"]]
+    joined = before.join(after, how="inner", lsuffix="_before", rsuffix="_after")
+
+    joined["wall_ratio"] = joined["wall_s_after"] / joined["wall_s_before"]
+    joined["peak_rss_ratio"] = joined["peak_rss_mb_after"] / joined["peak_rss_mb_before"]
+    joined["regression"] = (joined["wall_ratio"] > factor) | (joined["peak_rss_ratio"] > factor)
+
+    return joined.reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data")
+    parser.add_argument("--rows", type=int, default=100_000, help="Stop & search records in the synthetic dataset (10k to 50M)")
+    parser.add_argument("--lsoas", type=int, default=4835)
+    parser.add_argument("--deployments", type=int, default=250)
+    parser.add_argument("--start", default="2025-01")
+    parser.add_argument("--end", default="2025-11")
+    parser.add_argument("--forces", nargs="+", default=["metropolitan"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES), metavar="STAGE",
+                        help=f"Stages to run (default all): {', '.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage, the fastest is kept")
+    parser.add_argument("--label", default=None, help="Name for this run, defaults to the git commit")
+    parser.add_argument("--data-dir", type=Path, default=Path("../data/synthetic"), help="Where synthetic datasets are generated and kept")
+    parser.add_argument("--out-dir", type=Path, default=Path("../outputs/benchmarks"))
+    parser.add_argument("--compare", type=Path, default=None, help="An earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    dataset_dir = args.data_dir / f"{args.rows}_lsoa{args.lsoas}_seed{args.seed}"
+    dataset = generate_dataset(dataset_dir, args.rows, args.lsoas, args.deployments, args.start, args.end, tuple(args.forces), args.seed)
+
+    report = run_benchmarks(dataset, args.stages, dataset_dir / "work", args.repeat, args.label)
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    out_path = args.out_dir / f"{report['label']}_{args.rows}.json"
+    out_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Wrote {out_path}")
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        if baseline["dataset"] != report["dataset"]:
+            print(f"Warning: {args.compare} was run on a different dataset, so the ratios are not like for like")
+
+        comparison = compare_runs(baseline, report)
+        print(comparison.round(3).to_string(index=False))
+
+        if comparison["regression"].any():
+            print(f"Regressions (over {REGRESSION_FACTOR}x): {', '.join(comparison.loc[comparison['regression'], 'stage'])}")
+            sys.exit(1)
@@ -1,34 +1,100 @@
 """
 Extract and clean IMD data from XLSX files 
 """
+import re
 from pathlib import Path
 import pandas as pd
+import pyarrow.parquet as pq
 
-def load_imd_xlsx(imd_path: Path, sheet: str) -> pd.DataFrame:
+from manifest import file_hash
+
+IMD_DECILE = "Index of Multiple Deprivation (IMD) Decile"
+
+
+def compact_imd_column(values: pd.Series) -> pd.Series:
+    """
+    Store deciles as int8, ranks as int32 and scores as float32.
+
+    Deciles and ranks with gaps use the nullable Int8 and Int32 dtypes instead.
+
+    Args:
+        values (Series): One IMD column
+
+    Returns:
+        pd.Series: The column in its compact dtype
+    """
+    nullable = values.isna().any()
+    if re.search(r"\bDecile\b", str(values.name)):
+        return values.astype("Int8" if nullable else "int8")
+    if re.search(r"\bRank\b", str(values.name)):
+        return values.astype("Int32" if nullable else "int32")
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype("float32")
+
+    return values
+
+
+def load_imd_columns(
+    imd_path: Path,
+    sheet: str,
+    columns: list[str],
+    cache_dir: Path,
+    lsoa_codes: list[str] | None = None,
+) -> pd.DataFrame:
     """
-    Load IMD data from an xlsx file using Pandas
+    Load selected IMD columns keyed by LSOA11CD, parsing the workbook sheet at most once per workbook version.
+
+    The first call parses the whole sheet and stores every column, compacted, in one parquet
+    artifact in `cache_dir`, keyed by the workbook's content hash. Later requests for other
+    domains (e.g. income or crime deciles) are read from the parquet, not from the workbook.
 
     Args:
         imd_path (Path): Path to the raw IMD xlsx
-        sheet (str): sheet of data to be extracted 
+        sheet (str): sheet of data to be extracted
+        columns (list[str]): IMD columns to load
+        cache_dir (Path): Folder holding the cached artifacts
+        lsoa_codes (list[str] | None): Only return these LSOAs (e.g. London), None for all of England
 
     Returns:
-        pd.DataFrame: Extracted IMD table
+        pd.DataFrame: LSOA11CD plus the requested columns
+
+    Raises:
+        ValueError: If a requested column is not in the sheet
     """
+    sheet_name = re.sub(r"\W+", "_", sheet)
+    artifact_path = cache_dir / f"{file_hash(imd_path)[:16]}_{sheet_name}_all_columns.parquet"
 
-    deprivation_df = pd.read_excel(imd_path, sheet)
-    deprivation_df = deprivation_df.rename(columns={'LSOA code (2011)': 'LSOA11CD'})
+    if not artifact_path.exists():
+        # openpyxl parses the whole sheet whatever the usecols, so every column is kept from the one parse
+        parsed = pd.read_excel(imd_path, sheet).rename(columns={"LSOA code (2011)": "LSOA11CD"})
+        parsed = parsed.assign(**{c: compact_imd_column(parsed[c]) for c in parsed.columns if c != "LSOA11CD"})
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # artifacts from earlier versions of the workbook, or holding only some columns, are no longer needed
+        for pattern in (f"*_{sheet_name}.parquet", f"*_{sheet_name}_all_columns.parquet"):
+            for stale in cache_dir.glob(pattern):
+                stale.unlink()
+        parsed.to_parquet(artifact_path, index=False)
+
+    available = pq.read_schema(artifact_path).names
+    unknown = [c for c in columns if c not in available]
+    if unknown:
+        raise ValueError(f"Columns not in IMD sheet {sheet}: {', '.join(unknown)}")
+
+    filters = [("LSOA11CD", "in", list(lsoa_codes))] if lsoa_codes is not None else None
+
+    return pd.read_parquet(artifact_path, columns=["LSOA11CD", *columns], filters=filters)
 
-    return deprivation_df
 
 if __name__ == "__main__":
     
-    in_path = Path("'../data/raw/File_1_-_IMD2019_Index_of_Multiple_Deprivation.xlsx'")
-    out_path = Path("../data/processed/imd_2019.csv")
+    in_path = Path("../data/raw/File_1_-_IMD2019_Index_of_Multiple_Deprivation.xlsx")
+    out_path = Path("../data/processed/imd_2019.parquet")
+    cache_dir = Path("../data/processed/imd_cache")
 
 
-    imd_df = load_imd_xlsx(in_path, 'IMD2019')
-    imd_df.to_csv(out_path)
+    imd_df = load_imd_columns(in_path, 'IMD2019', [IMD_DECILE], cache_dir)
+    imd_df.to_parquet(out_path, index=False)
 
 
-    
\ No newline at end of file
+    
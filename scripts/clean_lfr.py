@@ -5,43 +5,124 @@ Extract and clean Live Facial Recognition deployment data from PDF files.
 import fitz  
 import pandas as pd
 import geopandas as gpd
+import hashlib
+import json
 import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from shapely.geometry import Point
+from typing import Callable, Iterator
 from geopy.geocoders import Nominatim
 
+from geocoding import AsyncNominatimGeocoder, GazetteerGeocoder, GeocodeCache, normalise_locations
+from instrumentation import count, instrumented, recording, span
+from points import points_from_coordinates
 
 
-def load_lfr(pdf_path: Path) -> pd.DataFrame:
+
+def _page_hash(doc: fitz.Document, page_number: int) -> str:
     """
-    Load LFR deployment data from a PDF file using PyMuPDF.
+    Hash a page's content streams so unchanged pages can be recognised in a re-published PDF.
+    """
+    page = doc[page_number]
+    digest = hashlib.sha256(repr(tuple(page.rect)).encode())
 
-    Args:
-        pdf_path (Path): Path to the raw LFR PDF
+    xrefs = list(page.get_contents()) + [xobject[0] for xobject in page.get_xobjects()]
+    for xref in xrefs:
+        digest.update(doc.xref_stream(xref) or b"")
 
-    Returns:
-        pd.DataFrame: Extracted LFR deployment table
+    return digest.hexdigest()
+
+
+def _extract_page_table(pdf_path: Path, page_number: int) -> list[list] | None:
     """
-    doc = fitz.open(pdf_path)
-    all_rows = []
+    Extract the first table on a single page. Runs in a worker process, so the PDF is opened here.
+    """
+    with fitz.open(pdf_path) as doc:
+        tabs = doc[page_number].find_tables()
 
-    for i, page in enumerate(doc):
-        tabs = page.find_tables()
-        
         if tabs.tables:
-            raw_data = tabs[0].extract()
-            
-            if i == 0:
-                all_rows.extend(raw_data[2:])
+            return tabs[0].extract()
+
+    return None
+
+
+def iter_lfr_rows(pdf_path: Path, cache_path: Path | None = None, workers: int | None = None) -> Iterator[list]:
+    """
+    Stream raw table rows from the LFR PDF in page order.
+
+    Pages are hashed and looked up in a per-page cache, so only new or changed pages
+    go through `find_tables`, which is spread across a process pool.
+
+    Args:
+        pdf_path (Path): Path to the raw LFR PDF
+        cache_path (Path | None): Path to the per-page table cache, None to disable caching
+        workers (int | None): Number of worker processes, defaults to the CPU count
+
+    Yields:
+        list: One raw table row
+    """
+    cache = {}
+    if cache_path is not None and cache_path.exists():
+        stored = json.loads(cache_path.read_text(encoding="utf-8"))
+        # table detection can change between PyMuPDF releases
+        if stored.get("pymupdf") == fitz.VersionBind:
+            cache = stored["pages"]
+
+    with fitz.open(pdf_path) as doc:
+        hashes = [_page_hash(doc, i) for i in range(doc.page_count)]
+
+    pending = [i for i, page_hash in enumerate(hashes) if page_hash not in cache]
+    print(f"{len(hashes) - len(pending)} of {len(hashes)} pages cached; extracting {len(pending)}")
+    count("lfr_pdf.pages_cached", len(hashes) - len(pending))
+    count("lfr_pdf.pages_extracted", len(pending))
+
+    tables = {}
+    executor = ProcessPoolExecutor(max_workers=workers) if len(pending) > 1 and workers != 1 else None
+
+    try:
+        futures = {}
+        if executor is not None:
+            futures = {i: executor.submit(_extract_page_table, pdf_path, i) for i in pending}
+
+        for i, page_hash in enumerate(hashes):
+            if page_hash in cache:
+                raw_data = cache[page_hash]
+            elif executor is not None:
+                raw_data = futures[i].result()
             else:
-                all_rows.extend(raw_data[:])
-        else:
-            print(f"Page {i} is empty or has no table; skipping...")
+                raw_data = _extract_page_table(pdf_path, i)
+            tables[page_hash] = raw_data
+
+            if raw_data is None:
+                print(f"Page {i} is empty or has no table; skipping...")
+                continue
 
-    records_lfr = pd.DataFrame(all_rows)
+            # the first page carries a two-row header
+            yield from raw_data[2:] if i == 0 else raw_data
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
-    doc.close()
+        if cache_path is not None:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # only keep pages from the current document so the cache does not grow across releases
+            pages = {page_hash: tables.get(page_hash, cache.get(page_hash)) for page_hash in hashes if page_hash in tables or page_hash in cache}
+            cache_path.write_text(json.dumps({"pymupdf": fitz.VersionBind, "pages": pages}), encoding="utf-8")
+
+
+@instrumented
+def load_lfr(pdf_path: Path, cache_path: Path | None = Path("../data/processed/lfr_page_cache.json"), workers: int | None = None) -> pd.DataFrame:
+    """
+    Load LFR deployment data from a PDF file using PyMuPDF.
+
+    Args:
+        pdf_path (Path): Path to the raw LFR PDF
+        cache_path (Path | None): Path to the per-page table cache, None to disable caching
+        workers (int | None): Number of worker processes used for table extraction
 
+    Returns:
+        pd.DataFrame: Extracted LFR deployment table
+    """
     headers = [
     'Deployment Location',
     'Date',
@@ -60,6 +141,8 @@ def load_lfr(pdf_path: Path) -> pd.DataFrame:
     'No action',
     'Faces seen (estimate)']
 
+    records_lfr = pd.DataFrame(iter_lfr_rows(pdf_path, cache_path, workers), columns=headers)
+
     records_lfr = records_lfr.dropna(how='any')
 
     records_lfr.reset_index(drop=True, inplace=True)
@@ -68,98 +151,128 @@ def load_lfr(pdf_path: Path) -> pd.DataFrame:
     return pd.DataFrame(records_lfr)
 
 
-def create_geometry(geo_lfr_df: pd.DataFrame) -> gpd.GeoDataFrame:
+@instrumented
+def geocode_nominatim(geolocator: Nominatim, addresses: list[str]) -> dict[str, tuple[float, float] | None]:
+    """
+    Geocode addresses one at a time with Nominatim, respecting its one request per second limit.
+
+    Args:
+        geolocator (Nominatim): geopy Nominatim geocoder
+        addresses (list[str]): Normalised location names
+
+    Returns:
+        dict: latitude and longitude per address (None if no match); addresses that errored are left out
+    """
+    found = {}
+
+    for address in addresses:
+        count("nominatim.requests")
+        try:
+            location = geolocator.geocode(f"{address}, London, UK")
+        except Exception as e:
+            print(f"Error geocoding '{address}': {e}")
+            count("nominatim.errors")
+            continue
+        finally:
+            time.sleep(1)
+            count("nominatim.sleep_s", 1)
+
+        found[address] = (location.latitude, location.longitude) if location else None
+
+    return found
+
+
+@instrumented
+def create_geometry(
+    geo_lfr_df: pd.DataFrame,
+    cache_path: Path = Path("../data/processed/geocode_cache.json"),
+    gazetteer_path: Path | None = None,
+    use_network: bool = True,
+    network_geocoder: Callable[[list[str]], dict] | None = None,
+) -> gpd.GeoDataFrame:
     """
     Convert LFR DataFrame to GeodataFrame
 
     Args:
         geo_lfr_df (DataFrame): DataFrame of LFR deployments
+        cache_path (Path): Path to the persistent geocode cache and override table
+        gazetteer_path (Path | None): Optional local gazetteer CSV used before any network lookups
+        use_network (bool): Fall back to Nominatim for names the gazetteer cannot resolve
+        network_geocoder (Callable | None): Batch network geocoder, defaults to serial Nominatim lookups
 
     Returns:
         gpd.GeoDataFrame: Geodatatframe containing geocoded LFR locations
     """
 
-    geo_lfr_df["Deployment Location"] = (
-        geo_lfr_df["Deployment Location"]
-        .str.replace("’", "'", regex=False)
-        .str.replace("–", "-", regex=False)
-        .str.replace(r"\bSt\b", "Street", regex=True)
-        .str.replace(r"\bRd\b", "Road", regex=True)
-        .str.replace(r"\bSq\b", "Square", regex=True)
-        .str.replace(r"\bStn\b", "Station", regex=True)
-        .str.replace("B'Way", "Broadway", regex=False)
-        .str.replace("Junc", "Junction", regex=False)
-        .str.strip()
-    )
+    geo_lfr_df["Deployment Location"] = normalise_locations(geo_lfr_df["Deployment Location"])
 
+    gazetteer = GazetteerGeocoder(gazetteer_path) if gazetteer_path is not None else None
     geolocator = Nominatim(user_agent="lfr_deployment")
+    cache = GeocodeCache(cache_path)
 
-    latitudes = []
-    longitudes = []
-    errors = []
+    def lookup(addresses: list[str]) -> dict[str, tuple[float, float] | None]:
+        found = gazetteer.geocode_batch(addresses) if gazetteer is not None else {}
+        count("gazetteer.matches", len(found))
+        unresolved = [address for address in addresses if address not in found]
 
-    for i, address in enumerate(geo_lfr_df["Deployment Location"]):
-        try:
-            query = f"{address}, London, UK"
-            location = geolocator.geocode(query)
-        except Exception as e:
-            print(f"Error at row {i}: {e}")
-            errors.append(i)
-            location = None
-
-        if location:
-            latitudes.append(location.latitude)
-            longitudes.append(location.longitude)
-        else:
-            latitudes.append(None)
-            longitudes.append(None)
-            print(f"Row {i}: '{address}' could not be geocoded")
-
-        time.sleep(1)
-
-    geo_lfr_df["latitude"] = latitudes
-    geo_lfr_df["longitude"] = longitudes
-
-    geo_lfr_df["Deployment Location"] = (
-    geo_lfr_df["Deployment Location"]
-    .str.replace("Junctiontion", "Junction", regex=False)
-    .str.replace("B'way", "Broadway", regex=False)
-    )
-
-    # manually assing the missing rows 
-    # https://www.gps-coordinates.net/
-
-    geo_lfr_df.loc[26, ["latitude", "longitude"]] = [51.506255, -0.220575]
-    geo_lfr_df.loc[39, ["latitude", "longitude"]] = [51.51498, -0.300407]
-    geo_lfr_df.loc[87, ["latitude", "longitude"]] = [51.427739, -0.16829]
-    geo_lfr_df.loc[94, ["latitude", "longitude"]] = [51.51498, -0.300407]
-    geo_lfr_df.loc[98, ["latitude", "longitude"]] = [51.511903, -0.014372]
-    geo_lfr_df.loc[102, ["latitude", "longitude"]] = [51.531707, -0.124766]
-    geo_lfr_df.loc[103, ["latitude", "longitude"]] = [51.506295, -0.231435]
-    geo_lfr_df.loc[119, ["latitude", "longitude"]] = [51.509759, -0.13355]
-    geo_lfr_df.loc[130, ["latitude", "longitude"]] = [51.544337, -0.00632]
-    geo_lfr_df.loc[171, ["latitude", "longitude"]] = [51.543793, 0.049819]
-    geo_lfr_df.loc[198, ["latitude", "longitude"]] = [51.509759, -0.13355]
-    geo_lfr_df.loc[207, ["latitude", "longitude"]] = [51.507459, -0.222272]
-    geo_lfr_df.loc[227, ["latitude", "longitude"]] = [51.545284, -0.074968]
-
-    lfr_gdf = gpd.GeoDataFrame(
-        geo_lfr_df,
-        geometry=[Point(xy) for xy in zip(lfr_df.longitude, lfr_df.latitude)],
-        crs="EPSG:4326"
-    )
+        if use_network and unresolved:
+            if network_geocoder is not None:
+                with span("network_geocoder", rows_in=len(unresolved)):
+                    found.update(network_geocoder(unresolved))
+            else:
+                found.update(geocode_nominatim(geolocator, unresolved))
 
-    return lfr_gdf
+        return found
 
+    # each distinct address is geocoded once, repeated sites reuse the result
+    coordinates = cache.resolve_batch(geo_lfr_df["Deployment Location"], lookup)
 
-if __name__ == "__main__":
-    in_path = Path("../data/raw/live-facial-recognition---deployment-record-2025-to-date.pdf")
-    out_path = Path("../data/processed/lfr_deployments.gpkg")
+    for address, coords in coordinates.items():
+        if coords is None:
+            print(f"'{address}' could not be geocoded")
+
+    # an override that matches no deployment is a correction that is silently not applied
+    for key in cache.unused_overrides():
+        print(f"Warning: manual override '{key}' matches no deployment location")
 
+    cache.save()
+    cache.report()
+    count("geocode_cache.hits", cache.hits)
+    count("geocode_cache.override_hits", cache.override_hits)
+    count("geocode_cache.misses", cache.misses)
+    count("geocode_cache.unresolved", cache.unresolved)
 
-    lfr_df = load_lfr(in_path)
-    lfr_gdf = create_geometry(lfr_df)
+    geo_lfr_df["latitude"] = geo_lfr_df["Deployment Location"].map(lambda a: coordinates[a][0] if coordinates[a] else None)
+    geo_lfr_df["longitude"] = geo_lfr_df["Deployment Location"].map(lambda a: coordinates[a][1] if coordinates[a] else None)
 
-    lfr_gdf.to_file(out_path, driver="GPKG")
+    # deployments that could not be geocoded are kept and flagged rather than dropped
+    lfr_gdf = points_from_coordinates(geo_lfr_df, "longitude", "latitude", drop=False)
+
+    return lfr_gdf
+
+
+if __name__ == "__main__":
+    in_path = Path("../data/raw/live-facial-recognition---deployment-record-2025-to-date.pdf")
+    out_path = Path("../data/processed/lfr_deployments.parquet")
+    qgis_out_path = Path("../data/processed/lfr_deployments.gpkg")
+    gazetteer_path = Path("../data/raw/london_gazetteer.csv")
+    failures_path = Path("../data/processed/geocode_failures.json")
+
+
+    with recording("clean_lfr"):
+        lfr_df = load_lfr(in_path)
+
+        network_geocoder = AsyncNominatimGeocoder(requests_per_second=1.0)
+        lfr_gdf = create_geometry(
+            lfr_df,
+            gazetteer_path=gazetteer_path if gazetteer_path.exists() else None,
+            network_geocoder=network_geocoder,
+        )
+        network_geocoder.report(failures_path)
+
+        with span("write_parquet", rows_in=len(lfr_gdf)):
+            lfr_gdf.to_parquet(out_path, index=False, write_covering_bbox=True)
+        with span("write_gpkg", rows_in=len(lfr_gdf)):
+            lfr_gdf.to_file(qgis_out_path, driver="GPKG")
 
     
\ No newline at end of file
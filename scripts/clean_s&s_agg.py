@@ -2,84 +2,396 @@
 Extract Jan-Nov 2023, and Jan-Nov 2025 Stop & Search statisics, concatenate and convert to GeoDataFrame.
 """
 
+import argparse
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point
 
-def load_stop_search(folder_path: Path, year: int) -> pd.DataFrame:
+from geo_store import write_partitioned_geoparquet
+from instrumentation import annotate, count, instrumented, peak_rss_mb, recording, span
+from lsoa_counts import LsoaCounts, count_lsoa_ids
+from lsoa_index import LsoaIndex
+from manifest import FileManifest, file_hash
+from points import GREAT_BRITAIN_BOUNDS, LONDON_BOUNDS, points_from_coordinates
+
+# police.uk force names as they appear in the CSV file names
+MET_FORCES = ("metropolitan",)
+
+STOP_SEARCH_DTYPES = {
+    "Type": "category",
+    "Part of a policing operation": "category",
+    "Latitude": "float32",
+    "Longitude": "float32",
+    "Gender": "category",
+    "Age range": "category",
+    "Self-defined ethnicity": "category",
+    "Officer-defined ethnicity": "category",
+    "Legislation": "category",
+    "Object of search": "category",
+    "Outcome": "category",
+    "Outcome linked to object of search": "category",
+    "Removal of more than just outer clothing": "category",
+}
+
+STOP_SEARCH_COLUMNS = [
+    "Type",
+    "Date",
+    "Latitude",
+    "Longitude",
+    "Gender",
+    "Age range",
+    "Officer-defined ethnicity",
+    "Object of search",
+    "Outcome",
+]
+
+
+def stop_search_file_parts(csv_path: Path) -> tuple[str, str] | None:
+    """
+    The month and force of a police.uk stop & search CSV, from its name (YYYY-MM-<force>-stop-and-search.csv).
+
+    Returns:
+        tuple[str, str] | None: (YYYY-MM, force), None if the name does not match
+    """
+    parts = re.fullmatch(r"(\d{4}-\d{2})-(.+)-stop-and-search\.csv", csv_path.name)
+
+    return (parts.group(1), parts.group(2)) if parts else None
+
+
+def find_stop_search_files(
+    folder_path: Path,
+    start: str,
+    end: str,
+    forces: tuple[str, ...] | None = MET_FORCES,
+    recursive: bool = False,
+) -> list[Path]:
+    """
+    Find the monthly stop & search CSVs between two months (inclusive) for a list of forces.
+
+    Args:
+        folder_path (Path): Path to the folder containing CSVs
+        start (str): First month to include, as YYYY-MM
+        end (str): Last month to include, as YYYY-MM
+        forces (tuple[str, ...] | None): Force names as they appear in the file names (e.g. "metropolitan",
+            "city-of-london"), None for every force
+        recursive (bool): Also search subfolders, as in the police.uk bulk download (one folder per month)
+
+    Returns:
+        list[Path]: Matching CSVs in month order, then force order
+    """
+    pattern = "*-stop-and-search.csv"
+    candidates = folder_path.rglob(pattern) if recursive else folder_path.glob(pattern)
+    csv_files = []
+
+    for file in candidates:
+        parts = stop_search_file_parts(file)
+        if parts is None:
+            continue
+
+        month, force = parts
+        if start <= month <= end and (forces is None or force in forces):
+            csv_files.append((month, force, file))
+
+    return [file for _, _, file in sorted(csv_files)]
+
+
+@instrumented
+def read_stop_search_csv(csv_path: Path, columns: list[str] | None = STOP_SEARCH_COLUMNS) -> pd.DataFrame:
+    """
+    Read a single monthly stop & search CSV with an explicit schema.
+
+    Args:
+        csv_path (Path): Path to the CSV
+        columns (list[str] | None): Columns to read, None for all
+
+    Returns:
+        pd.DataFrame: Typed stop & search records for the month
+    """
+    df = pd.read_csv(csv_path, usecols=columns, dtype=STOP_SEARCH_DTYPES)
+
+    if "Date" in df.columns:
+        df["Date"] = pd.to_datetime(df["Date"], utc=True, format="ISO8601")
+
+    return df
+
+
+@instrumented
+def load_stop_search(
+    folder_path: Path,
+    start: str,
+    end: str,
+    columns: list[str] | None = STOP_SEARCH_COLUMNS,
+    workers: int | None = None,
+    forces: tuple[str, ...] | None = MET_FORCES,
+) -> pd.DataFrame:
     """
     Load and concatenate stop & search data from multiple CSVs using Pandas.
 
     Args:
         folder_path (Path): Path to the folder containing CSVs 
-        year (int): flag to indicate year
+        start (str): First month to include, as YYYY-MM
+        end (str): Last month to include, as YYYY-MM
+        columns (list[str] | None): Columns to read, None for all
+        workers (int | None): Number of threads used to read files in parallel
+        forces (tuple[str, ...] | None): Forces to load, None for every force
 
     Returns:
         pd.DataFrame: Concatenated Stop and Search data
     """
-    if year == 2025:
-        csv_files = sorted(folder_path.glob("2025-*-metropolitan-stop-and-search.csv"))
-        dataframes = []
+    csv_files = find_stop_search_files(folder_path, start, end, forces)
+    if not csv_files:
+        raise FileNotFoundError(f"No stop & search CSVs for {start} to {end} in {folder_path}")
 
-        for file in csv_files:
-            df = pd.read_csv(file)
-            dataframes.append(df)
+    started = time.perf_counter()
 
-        stop_and_search_2025 = pd.concat(dataframes, ignore_index=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        dataframes = list(executor.map(lambda file: read_stop_search_csv(file, columns), csv_files))
 
-        return stop_and_search_2025
-        
-    elif year == 2023:
-        csv_files = sorted(folder_path.glob("2023-*-metropolitan-stop-and-search.csv"))
-        dataframes = []
+    # align categories across months so the concatenated columns stay categorical
+    for column in dataframes[0].select_dtypes("category").columns:
+        categories = pd.api.types.union_categoricals([df[column] for df in dataframes]).categories
+        for df in dataframes:
+            df[column] = df[column].cat.set_categories(categories)
 
-        for file in csv_files:
-            df = pd.read_csv(file)
-            dataframes.append(df)
+    stop_and_search = pd.concat(dataframes, ignore_index=True)
 
-        stop_and_search_2023 = pd.concat(dataframes, ignore_index=True)
+    elapsed = time.perf_counter() - started
+    annotate(rows_out=len(stop_and_search), files=len(csv_files))
+    frame_mb = stop_and_search.memory_usage(deep=True).sum() / 1e6
+    # the high-water mark of the whole process so far, not of this load; resetting it here would
+    # also reset the peaks the run report and enclosing spans record
+    peak = peak_rss_mb()
+
+    print(
+        f"Loaded {len(stop_and_search)} stop & search rows from {len(csv_files)} files in {elapsed:.2f}s "
+        f"({len(stop_and_search) / elapsed:,.0f} rows/s, {frame_mb:.1f} MB in memory"
+        + (f", process peak RSS so far {peak:.0f} MB)" if peak is not None else ")")
+    )
 
-        return stop_and_search_2023
+    return stop_and_search
         
 
 
-def convert_to_geo_data(stop_and_search_df: pd.DataFrame) -> gpd.GeoDataFrame:
+@instrumented
+def convert_to_geo_data(stop_and_search_df: pd.DataFrame, bounds: tuple[float, float, float, float] | None = LONDON_BOUNDS) -> gpd.GeoDataFrame:
     """
-    Convert DataFrames to GeoDataFrames.
+    Convert DataFrames to GeoDataFrames, dropping records without a usable location.
 
     Args:
         stop_and_search_df (DataFrame): Dataframe to be converted 
+        bounds (tuple | None): (min lon, min lat, max lon, max lat) accepted, None to accept any
 
     Returns:
         gpd.DataFrame: Geodataframe produced from conversion 
     """
-    gdf = gpd.GeoDataFrame(
-        stop_and_search_df,
-        geometry=[Point(xy) for xy in zip(stop_and_search_df.Longitude, stop_and_search_df.Latitude)],
-        crs="EPSG:4326"
-    )
+    gdf = points_from_coordinates(stop_and_search_df, "Longitude", "Latitude", bounds=bounds)
 
     return gdf
 
 
-if __name__ == "__main__":
+@instrumented
+def count_stop_search_file(
+    csv_path: Path,
+    lsoa_index: LsoaIndex,
+    chunk_size: int = 250_000,
+    bounds: tuple[float, float, float, float] | None = LONDON_BOUNDS,
+    mode: str = "grid",
+) -> tuple[np.ndarray, int, int]:
+    """
+    Count one CSV's records per LSOA, reading, converting and assigning `chunk_size` rows at a time.
+
+    Args:
+        csv_path (Path): Path to the CSV
+        lsoa_index (LsoaIndex): Index over the LSOA polygons
+        chunk_size (int): Rows held in memory at once
+        bounds (tuple | None): (min lon, min lat, max lon, max lat) accepted, None to accept any
+        mode (str): "exact" or "grid" LSOA lookup, see `LsoaIndex.assign_ids`
 
-    folder_path_2025 = Path("../data/raw")
-    folder_path_2023 = Path("../data/raw/stop_search_jan_nov_2023")
+    Returns:
+        tuple[np.ndarray, int, int]: Counts in LSOA id order, rows read, rows without a usable location
+    """
+    counts = np.zeros(len(lsoa_index.codes), dtype=np.int64)
+    rows = dropped = 0
+
+    coordinate_dtypes = {column: STOP_SEARCH_DTYPES[column] for column in ("Latitude", "Longitude")}
+    for chunk in pd.read_csv(csv_path, usecols=["Latitude", "Longitude"], dtype=coordinate_dtypes, chunksize=chunk_size):
+        points = points_from_coordinates(chunk, "Longitude", "Latitude", bounds=bounds, verbose=False)
+        counts += count_lsoa_ids(lsoa_index.assign_ids(points.geometry, mode), len(lsoa_index.codes))
+
+        rows += len(chunk)
+        dropped += len(chunk) - len(points)
+
+    annotate(rows_in=rows, rows_out=rows - dropped, file=csv_path.name)
+
+    return counts, rows, dropped
+
+
+@instrumented
+def stream_lsoa_counts(
+    folder_path: Path,
+    start: str,
+    end: str,
+    lsoa_index: LsoaIndex,
+    forces: tuple[str, ...] | None = MET_FORCES,
+    chunk_size: int = 250_000,
+    bounds: tuple[float, float, float, float] | None = LONDON_BOUNDS,
+    mode: str = "grid",
+    by_force: bool = False,
+    recursive: bool = False,
+    workers: int | None = 1,
+) -> dict[str, np.ndarray]:
+    """
+    Count stop & search records per LSOA and month without ever holding more than a few chunks of rows.
+
+    Gives the same counts as `load_stop_search` followed by `convert_to_geo_data` and an LSOA
+    assignment, but peak memory depends on `chunk_size` x `workers` and the number of LSOAs,
+    not on the number of rows, so all forces over several years can be counted on one machine.
+
+    Args:
+        folder_path (Path): Path to the folder containing CSVs
+        start (str): First month to include, as YYYY-MM
+        end (str): Last month to include, as YYYY-MM
+        lsoa_index (LsoaIndex): Index over the LSOA polygons
+        forces (tuple[str, ...] | None): Forces to count, None for every force
+        chunk_size (int): Rows held in memory at once per worker
+        bounds (tuple | None): (min lon, min lat, max lon, max lat) accepted, None to accept any
+        mode (str): "exact" or "grid" LSOA lookup, see `LsoaIndex.assign_ids`
+        by_force (bool): Keep forces apart (keys `{force}_{YYYY-MM}`) rather than summing them per month
+        recursive (bool): Also search subfolders
+        workers (int | None): Number of files counted at once
+
+    Returns:
+        dict[str, np.ndarray]: Counts in LSOA id order per YYYY-MM month (or force and month)
+    """
+    csv_files = find_stop_search_files(folder_path, start, end, forces, recursive)
+    if not csv_files:
+        raise FileNotFoundError(f"No stop & search CSVs for {start} to {end} in {folder_path}")
+
+    started = time.perf_counter()
+    counts = {}
+    rows = dropped = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda file: count_stop_search_file(file, lsoa_index, chunk_size, bounds, mode), csv_files)
+
+        for file, (file_counts, file_rows, file_dropped) in zip(csv_files, results):
+            month, force = stop_search_file_parts(file)
+            key = f"{force}_{month}" if by_force else month
+            counts[key] = counts[key] + file_counts if key in counts else file_counts
+            rows += file_rows
+            dropped += file_dropped
+
+    elapsed = time.perf_counter() - started
+    peak = peak_rss_mb()
+    annotate(rows_in=rows, rows_out=rows - dropped, files=len(csv_files))
+
+    print(
+        f"Streamed {rows} stop & search rows from {len(csv_files)} files in {elapsed:.2f}s "
+        f"({rows / elapsed:,.0f} rows/s, {dropped} without a usable location"
+        + (f", process peak RSS so far {peak:.0f} MB)" if peak is not None else ")")
+    )
+
+    return counts
+
+
+@instrumented
+def ingest_new_months(folder_path: Path, out_path: Path, start: str, end: str, manifest_path: Path) -> list[str]:
+    """
+    Convert and store only the monthly CSVs that are new or have changed since the last run.
+
+    Each month's partition under `out_path` is replaced on its own, so a newly published
+    month costs one file's worth of work.
+
+    Args:
+        folder_path (Path): Path to the folder containing CSVs
+        out_path (Path): Root of the partitioned GeoParquet dataset
+        start (str): First month to include, as YYYY-MM
+        end (str): Last month to include, as YYYY-MM
+        manifest_path (Path): Manifest of the raw CSV hashes already ingested
+
+    Returns:
+        list[str]: Months that were (re)ingested
+    """
+    manifest = FileManifest(manifest_path)
+    ingested = []
+
+    for file in find_stop_search_files(folder_path, start, end):
+        month = file.name[:7]
+        digest = file_hash(file)
+        partition = out_path / f"year={month[:4]}" / f"month={month[5:]}" / "part-0.parquet"
+
+        # a deleted partition is rewritten even though its CSV has not changed
+        if not manifest.changed(month, digest) and partition.exists():
+            count("stop_search.months_unchanged")
+            continue
+
+        geo_month = convert_to_geo_data(read_stop_search_csv(file))
+        # partitioned on the file's month, so rows from the previous month in UTC stay with their file
+        write_partitioned_geoparquet(geo_month, out_path, month=month)
+
+        manifest.record(month, digest)
+        manifest.save()
+        ingested.append(month)
+        count("stop_search.months_ingested")
+
+    print(f"Ingested {len(ingested)} new or changed months for {start} to {end}: {', '.join(ingested) or 'none'}")
+
+    return ingested
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stream-counts", type=Path, help="stream the CSVs into per-LSOA monthly counts written to this parquet, instead of ingesting")
+    parser.add_argument("--folder", type=Path, default=Path("../data/raw"), help="folder of monthly CSVs to stream (searched recursively)")
+    parser.add_argument("--start", default="2025-01", help="first month to stream, YYYY-MM")
+    parser.add_argument("--end", default="2025-11", help="last month to stream, YYYY-MM")
+    parser.add_argument("--forces", nargs="*", default=list(MET_FORCES), help="forces to stream (no names: every force)")
+    parser.add_argument("--lsoa-zip", type=Path, default=Path("../data/raw/statistical-gis-boundaries-london.zip"))
+    parser.add_argument("--lsoa-shp", default="statistical-gis-boundaries-london/ESRI/LSOA_2011_London_gen_MHW.shp")
+    parser.add_argument("--lsoa-cache", type=Path, default=Path("../data/processed/lsoa_index"))
+    parser.add_argument("--grid-cell-size", type=float, default=0.0005, help="LSOA lookup grid cell size in degrees")
+    parser.add_argument("--chunk-size", type=int, default=250_000, help="rows held in memory at once per worker")
+    parser.add_argument("--workers", type=int, default=1, help="files streamed at once")
+    args = parser.parse_args()
 
-    out_path_2025 = Path("../data/processed/lsoa_data_2025.gpkg")
-    out_path_2023 = Path("../data/processed/lsoa_data_2023.gpkg")
+    with recording("clean_stop_search"):
+        if args.stream_counts is not None:
+            forces = tuple(args.forces) or None
+            lsoa_index = LsoaIndex.load(args.lsoa_zip, args.lsoa_shp, args.lsoa_cache)
+            lsoa_index.build_grid(args.grid_cell_size)
 
+            monthly_counts = stream_lsoa_counts(
+                args.folder,
+                args.start,
+                args.end,
+                lsoa_index,
+                forces=forces,
+                chunk_size=args.chunk_size,
+                bounds=LONDON_BOUNDS if forces == MET_FORCES else GREAT_BRITAIN_BOUNDS,
+                by_force=forces != MET_FORCES,
+                recursive=True,
+                workers=args.workers,
+            )
 
-    stop_search_2025 = load_stop_search(folder_path_2025, 2025)
-    stop_and_search_2023 = load_stop_search(folder_path_2025, 2023)
+            lsoa_counts = LsoaCounts(lsoa_index.codes)
+            for key, counts in sorted(monthly_counts.items()):
+                lsoa_counts.add_counts(key, counts)
+            with span("write_parquet", rows_in=len(lsoa_counts.codes)):
+                lsoa_counts.to_frame().to_parquet(args.stream_counts, index=False)
+            sys.exit(0)
 
-    geo_search_2025 = convert_to_geo_data(stop_search_2025)
-    geo_stop_and_search_2023 = convert_to_geo_data(stop_and_search_2023)
+        folder_path_2025 = Path("../data/raw")
+        folder_path_2023 = Path("../data/raw/stop_search_jan_nov_2023")
 
+        out_path = Path("../data/processed/stop_search")
+        manifest_path = Path("../data/processed/stop_search_manifest.json")
 
-    geo_search_2025.to_file(out_path_2025, driver="GPKG")
-    geo_stop_and_search_2023.to_file(out_path_2023, driver="GPKG")
 
-    
+        # only months whose CSV is new or has changed are re-read and re-written
+        ingest_new_months(folder_path_2025, out_path, "2025-01", "2025-11", manifest_path)
+        ingest_new_months(folder_path_2023, out_path, "2023-01", "2023-11", manifest_path)
@@ -0,0 +1,337 @@
+"""
+Aggregate point layers onto regular square and hex grids in British National Grid, and build kernel
+density surfaces by FFT convolution, as an alternative to LSOA polygon counts.
+
+Rasters are written as GeoTIFF (for QGIS) and NPY (for Python), each with a JSON metadata sidecar.
+"""
+
+import json
+import struct
+import zlib
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.signal import fftconvolve
+
+from geo_store import read_partitioned_geoparquet
+from points import LONDON_BOUNDS
+from proximity import BRITISH_NATIONAL_GRID, distinct_bng_locations
+
+SQUARE_CELL_SIZES_M = (100, 250, 500)
+HEX_SIZES_M = (250, 500, 1000)
+KDE_CELL_SIZE_M = 50
+KDE_BANDWIDTHS_M = (250, 500)
+
+
+@dataclass
+class RasterGrid:
+    """
+    A north-up grid of square cells in a projected CRS, anchored at its south-west corner.
+
+    Arrays on the grid have shape (ny, nx) with row 0 along the northern edge, as in GeoTIFF.
+    """
+
+    x0: float
+    y0: float
+    cell_size: float
+    nx: int
+    ny: int
+    epsg: int = 27700
+
+    @classmethod
+    def covering(cls, bounds: tuple[float, float, float, float], cell_size: float, epsg: int = 27700) -> "RasterGrid":
+        """
+        The grid of `cell_size` cells, aligned to multiples of the cell size, covering (minx, miny, maxx, maxy).
+        """
+        minx, miny, maxx, maxy = bounds
+        x0 = np.floor(minx / cell_size) * cell_size
+        y0 = np.floor(miny / cell_size) * cell_size
+        nx = int(np.ceil((maxx - x0) / cell_size))
+        ny = int(np.ceil((maxy - y0) / cell_size))
+
+        return cls(float(x0), float(y0), float(cell_size), nx, ny, epsg)
+
+    def cell_index(self, xy: np.ndarray) -> np.ndarray:
+        """
+        Flat (row-major, north-up) cell index per point, -1 for points off the grid.
+        """
+        with np.errstate(invalid="ignore"):
+            col = np.floor((xy[:, 0] - self.x0) / self.cell_size)
+            row = self.ny - 1 - np.floor((xy[:, 1] - self.y0) / self.cell_size)
+        on_grid = (col >= 0) & (col < self.nx) & (row >= 0) & (row < self.ny)
+
+        return np.where(on_grid, row * self.nx + col, -1).astype(np.int64)
+
+
+def bng_bounds(bounds: tuple[float, float, float, float]) -> tuple[float, float, float, float]:
+    """
+    Bounding box in British National Grid of a (min lon, min lat, max lon, max lat) box.
+    """
+    box = gpd.GeoSeries([shapely.box(*bounds)], crs="EPSG:4326").segmentize(0.01)
+
+    return tuple(box.to_crs(BRITISH_NATIONAL_GRID).total_bounds)
+
+
+def bin_square(xy: np.ndarray, weights: np.ndarray, grid: RasterGrid) -> np.ndarray:
+    """
+    Count points per grid cell with one bincount.
+
+    Args:
+        xy (np.ndarray): (n, 2) point locations in the grid's CRS
+        weights (np.ndarray): Number of points at each location
+        grid (RasterGrid): Grid to count on
+
+    Returns:
+        np.ndarray: (ny, nx) float64 counts
+    """
+    cells = grid.cell_index(xy)
+    on_grid = cells >= 0
+    counts = np.bincount(cells[on_grid], weights=weights[on_grid], minlength=grid.nx * grid.ny)
+
+    return counts.reshape(grid.ny, grid.nx)
+
+
+def kernel_density(counts: np.ndarray, grid: RasterGrid, bandwidth: float, truncate: float = 4.0) -> np.ndarray:
+    """
+    Gaussian kernel density surface from gridded counts, by FFT convolution with the kernel.
+
+    The cost depends on the grid size, not on the number of points, so it is the same for a
+    thousand points as for ten million.
+
+    Args:
+        counts (np.ndarray): (ny, nx) counts from `bin_square`
+        grid (RasterGrid): Grid the counts are on
+        bandwidth (float): Kernel standard deviation in the grid's units (metres)
+        truncate (float): Kernel radius in bandwidths
+
+    Returns:
+        np.ndarray: (ny, nx) float32 density in points per square kilometre
+    """
+    radius = int(np.ceil(truncate * bandwidth / grid.cell_size))
+    offsets = np.arange(-radius, radius + 1) * grid.cell_size
+    profile = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    kernel = np.outer(profile, profile)
+    kernel /= kernel.sum()
+
+    smoothed = fftconvolve(counts, kernel, mode="same")
+    # FFT round-off leaves tiny negative values where there are no points
+    smoothed = np.clip(smoothed, 0, None)
+    cell_area_km2 = (grid.cell_size / 1000) ** 2
+
+    return (smoothed / cell_area_km2).astype("float32")
+
+
+def bin_hex(xy: np.ndarray, weights: np.ndarray, size: float) -> pd.DataFrame:
+    """
+    Count points per pointy-top hexagon of circumradius `size`, in axial (q, r) coordinates.
+
+    Args:
+        xy (np.ndarray): (n, 2) point locations in a projected CRS
+        weights (np.ndarray): Number of points at each location
+        size (float): Hexagon circumradius (centre to vertex) in metres
+
+    Returns:
+        pd.DataFrame: q, r and count for every hexagon holding at least one point
+    """
+    usable = ~np.isnan(xy).any(axis=1)
+    x, y = xy[usable, 0] / size, xy[usable, 1] / size
+
+    # fractional cube coordinates, rounded to the nearest hexagon centre
+    q = np.sqrt(3) / 3 * x - y / 3
+    r = 2 / 3 * y
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    rq = np.where((dq > dr) & (dq > ds), -rr - rs, rq)
+    rr = np.where(~((dq > dr) & (dq > ds)) & (dr > ds), -rq - rs, rr)
+
+    cells, inverse = np.unique(rq + 1j * rr, return_inverse=True)
+    counts = np.bincount(inverse, weights=weights[usable], minlength=len(cells))
+
+    return pd.DataFrame({"q": cells.real.astype(np.int64), "r": cells.imag.astype(np.int64), "count": counts})
+
+
+def hex_polygons(q: np.ndarray, r: np.ndarray, size: float) -> np.ndarray:
+    """
+    Polygons of pointy-top hexagons from axial coordinates.
+
+    Args:
+        q (np.ndarray): Axial q per hexagon
+        r (np.ndarray): Axial r per hexagon
+        size (float): Hexagon circumradius in metres
+
+    Returns:
+        np.ndarray: Shapely polygons
+    """
+    centre_x = size * (np.sqrt(3) * q + np.sqrt(3) / 2 * r)
+    centre_y = size * 1.5 * r
+    angles = np.radians(30 + 60 * np.arange(7))
+
+    rings = np.stack([
+        centre_x[:, None] + size * np.cos(angles),
+        centre_y[:, None] + size * np.sin(angles),
+    ], axis=-1)
+
+    return shapely.polygons(rings)
+
+
+def write_geotiff(path: Path, array: np.ndarray, grid: RasterGrid, rows_per_strip: int = 16) -> None:
+    """
+    Write a single-band, deflate-compressed GeoTIFF that QGIS/GDAL can open directly.
+
+    Args:
+        path (Path): Output path
+        array (np.ndarray): (ny, nx) float32, float64, int32 or uint32 values, row 0 along the northern edge
+        grid (RasterGrid): Grid the array is on
+        rows_per_strip (int): Rows compressed together
+    """
+    sample_format = {"f": 3, "i": 2, "u": 1}[array.dtype.kind]
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+    strips = [zlib.compress(array[row:row + rows_per_strip].tobytes()) for row in range(0, grid.ny, rows_per_strip)]
+
+    # header, then the strips, then the out-of-line tag values, then the IFD
+    data = bytearray(b"II*\x00\x00\x00\x00\x00")
+    strip_offsets = []
+    for strip in strips:
+        strip_offsets.append(len(data))
+        data += strip
+
+    geokeys = [1, 1, 0, 3, 1024, 0, 1, 1, 1025, 0, 1, 1, 3072, 0, 1, grid.epsg]
+    top = grid.y0 + grid.ny * grid.cell_size
+    entries = [
+        (256, 4, [grid.nx]),
+        (257, 4, [grid.ny]),
+        (258, 3, [array.dtype.itemsize * 8]),
+        (259, 3, [8]),
+        (262, 3, [1]),
+        (273, 4, strip_offsets),
+        (277, 3, [1]),
+        (278, 4, [rows_per_strip]),
+        (279, 4, [len(strip) for strip in strips]),
+        (284, 3, [1]),
+        (339, 3, [sample_format]),
+        (33550, 12, [grid.cell_size, grid.cell_size, 0.0]),
+        (33922, 12, [0.0, 0.0, 0.0, grid.x0, top, 0.0]),
+        (34735, 3, geokeys),
+    ]
+    formats = {3: "H", 4: "I", 12: "d"}
+
+    ifd = [struct.pack("<H", len(entries))]
+    for tag, field_type, values in entries:
+        packed = struct.pack(f"<{len(values)}{formats[field_type]}", *values)
+        if len(packed) <= 4:
+            ifd.append(struct.pack("<HHI", tag, field_type, len(values)) + packed.ljust(4, b"\x00"))
+        else:
+            if len(data) % 2:
+                data += b"\x00"
+            ifd.append(struct.pack("<HHII", tag, field_type, len(values), len(data)))
+            data += packed
+    ifd.append(struct.pack("<I", 0))
+
+    if len(data) % 2:
+        data += b"\x00"
+    struct.pack_into("<I", data, 4, len(data))
+    data += b"".join(ifd)
+
+    path.write_bytes(bytes(data))
+
+
+def write_raster(stem: Path, array: np.ndarray, grid: RasterGrid, metadata: dict) -> None:
+    """
+    Write a raster as `{stem}.tif` and `{stem}.npy`, with a `{stem}.json` sidecar describing the grid.
+
+    Args:
+        stem (Path): Output path without suffix
+        array (np.ndarray): (ny, nx) values, row 0 along the northern edge
+        grid (RasterGrid): Grid the array is on
+        metadata (dict): Extra fields for the sidecar (layer, units, bandwidth...)
+    """
+    stem.parent.mkdir(parents=True, exist_ok=True)
+    write_geotiff(stem.with_suffix(".tif"), array, grid)
+    np.save(stem.with_suffix(".npy"), array)
+
+    sidecar = {**metadata, "grid": asdict(grid), "crs": f"EPSG:{grid.epsg}", "row_order": "north_to_south", "dtype": str(array.dtype)}
+    stem.with_suffix(".json").write_text(json.dumps(sidecar, indent=2), encoding="utf-8")
+
+
+def grid_layers(
+    layers: dict[str, gpd.GeoSeries],
+    out_dir: Path,
+    bounds: tuple[float, float, float, float] = LONDON_BOUNDS,
+    square_sizes: tuple[float, ...] = SQUARE_CELL_SIZES_M,
+    hex_sizes: tuple[float, ...] = HEX_SIZES_M,
+    kde_cell_size: float = KDE_CELL_SIZE_M,
+    kde_bandwidths: tuple[float, ...] = KDE_BANDWIDTHS_M,
+) -> list[Path]:
+    """
+    Write square-grid counts, hexbin counts and kernel density surfaces for each point layer.
+
+    Every layer shares the same grids, so rasters of different layers can be compared cell by cell.
+
+    Args:
+        layers (dict[str, GeoSeries]): Point layers by name
+        out_dir (Path): Output folder
+        bounds (tuple): (min lon, min lat, max lon, max lat) extent of the grids
+        square_sizes (tuple[float, ...]): Square cell sizes in metres
+        hex_sizes (tuple[float, ...]): Hexagon circumradii in metres
+        kde_cell_size (float): Cell size of the density rasters in metres
+        kde_bandwidths (tuple[float, ...]): Kernel bandwidths in metres
+
+    Returns:
+        list[Path]: Files written
+    """
+    extent = bng_bounds(bounds)
+    located = {name: distinct_bng_locations(points) for name, points in layers.items()}
+    written = []
+
+    for cell_size in square_sizes:
+        grid = RasterGrid.covering(extent, cell_size)
+        for name, (xy, weights) in located.items():
+            stem = out_dir / f"{name}_grid_{cell_size:g}m"
+            counts = bin_square(xy, weights, grid).astype("uint32")
+            write_raster(stem, counts, grid, {"layer": name, "kind": "count", "units": "points per cell"})
+            written.append(stem.with_suffix(".tif"))
+
+    kde_grid = RasterGrid.covering(extent, kde_cell_size)
+    for name, (xy, weights) in located.items():
+        counts = bin_square(xy, weights, kde_grid)
+        for bandwidth in kde_bandwidths:
+            stem = out_dir / f"{name}_kde_{bandwidth:g}m"
+            density = kernel_density(counts, kde_grid, bandwidth)
+            metadata = {"layer": name, "kind": "kernel_density", "units": "points per km2", "kernel": "gaussian", "bandwidth_m": bandwidth}
+            write_raster(stem, density, kde_grid, metadata)
+            written.append(stem.with_suffix(".tif"))
+
+    # hexes are vectors, one table per size with a count column per layer
+    for size in hex_sizes:
+        hexes = None
+        for name, (xy, weights) in located.items():
+            counts = bin_hex(xy, weights, size).rename(columns={"count": f"{name}_count"})
+            hexes = counts if hexes is None else hexes.merge(counts, on=["q", "r"], how="outer")
+
+        hexes = hexes.fillna(0)
+        path = out_dir / f"hexbins_{size:g}m.gpkg"
+        gpd.GeoDataFrame(hexes, geometry=hex_polygons(hexes["q"].to_numpy(), hexes["r"].to_numpy(), size), crs=BRITISH_NATIONAL_GRID).to_file(path, driver="GPKG")
+        written.append(path)
+
+    return written
+
+
+if __name__ == "__main__":
+    in_path_stop_search = Path("../data/processed/stop_search")
+    in_path_lfr = Path("../data/processed/lfr_deployments.parquet")
+
+    out_dir = Path("../data/processed/density")
+
+
+    layers = {
+        f"stop_search_{year}": read_partitioned_geoparquet(in_path_stop_search, columns=[], years=[year]).geometry
+        for year in (2025, 2023)
+    }
+    layers["lfr"] = gpd.read_parquet(in_path_lfr).geometry
+
+    grid_layers(layers, out_dir)
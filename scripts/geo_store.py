@@ -0,0 +1,89 @@
+"""
+Read and write the processed point layers as GeoParquet, partitioned by year and month.
+"""
+
+import shutil
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+
+from instrumentation import instrumented
+
+
+@instrumented
+def write_partitioned_geoparquet(gdf: gpd.GeoDataFrame, root: Path, date_column: str = "Date", month: str | None = None) -> list[Path]:
+    """
+    Write a point layer as GeoParquet partitions under root/year=YYYY/month=MM/.
+
+    Each month present in the data replaces its existing partition; other months are left untouched.
+    Pass `month` when the rows come from one monthly file: police.uk files include records from the
+    last hour of the previous month in UTC, and these must not replace that month's partition.
+
+    Args:
+        gdf (GeoDataFrame): Points with a datetime column to partition on
+        root (Path): Root folder of the partitioned dataset
+        date_column (str): Name of the datetime column
+        month (str | None): Write every row to this month's partition (YYYY-MM) instead of partitioning on `date_column`
+
+    Returns:
+        list[Path]: Partition files written
+    """
+    if month is not None:
+        year, month_number = (int(part) for part in month.split("-"))
+        parts = [((year, month_number), gdf)]
+    else:
+        dates = gdf[date_column].dt
+        parts = gdf.groupby([dates.year.rename("year"), dates.month.rename("month")], observed=True)
+
+    written = []
+    for (year, month_number), part in parts:
+        partition = root / f"year={year}" / f"month={month_number:02d}"
+        shutil.rmtree(partition, ignore_errors=True)
+        partition.mkdir(parents=True)
+
+        path = partition / "part-0.parquet"
+        # the bbox covering column lets readers skip row groups outside a bounding box
+        part.to_parquet(path, index=False, write_covering_bbox=True)
+        written.append(path)
+
+    return written
+
+
+def read_partitioned_geoparquet(
+    root: Path,
+    columns: list[str] | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+    years: list[int] | None = None,
+    months: list[int] | None = None,
+) -> gpd.GeoDataFrame:
+    """
+    Read a partitioned GeoParquet dataset, only touching the requested partitions and columns.
+
+    Args:
+        root (Path): Root folder of the partitioned dataset
+        columns (list[str] | None): Columns to read, None for all (geometry is always read)
+        bbox (tuple | None): (minx, miny, maxx, maxy) filter in the layer's CRS
+        years (list[int] | None): Years to read, None for all
+        months (list[int] | None): Months to read, None for all
+
+    Returns:
+        gpd.GeoDataFrame: Matching points
+    """
+    filters = []
+    if years is not None:
+        filters.append(("year", "in", list(years)))
+    if months is not None:
+        filters.append(("month", "in", list(months)))
+
+    if columns is not None and "geometry" not in columns:
+        columns = [*columns, "geometry"]
+
+    gdf = gpd.read_parquet(root, columns=columns, bbox=bbox, filters=filters or None)
+
+    # hive partition keys come back as categoricals
+    for key in ("year", "month"):
+        if key in gdf.columns:
+            gdf[key] = pd.to_numeric(gdf[key].astype(str)).astype("int16")
+
+    return gdf
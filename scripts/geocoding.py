@@ -0,0 +1,421 @@
+"""
+Geocode deployment locations through a persistent on-disk cache, manual overrides, an offline
+gazetteer and a concurrent, rate-limited network geocoder.
+"""
+
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from geopy.adapters import AioHTTPAdapter
+from geopy.exc import GeocoderRateLimited, GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable
+from geopy.geocoders import Nominatim
+from scipy import sparse
+
+from instrumentation import count
+
+Coordinates = tuple[float, float]
+BatchLookup = Callable[[list[str]], dict[str, Optional[Coordinates]]]
+
+# Locations Nominatim could not resolve, assigned manually
+# https://www.gps-coordinates.net/
+MANUAL_OVERRIDES = {
+    "westfield, shepherds bush": (51.506255, -0.220575),
+    "ealing broadway": (51.51498, -0.300407),
+    "tooting broadway": (51.427739, -0.16829),
+    "poplar - vesey path": (51.511903, -0.014372),
+    "kings cross station": (51.531707, -0.124766),
+    "uxbridge road, shepherds bush": (51.506295, -0.231435),
+    "piccadilly, hard rock": (51.509759, -0.13355),
+    "stratford, westfields": (51.544337, -0.00632),
+    "east ham, high road north": (51.543793, 0.049819),
+    "westfield, white city": (51.507459, -0.222272),
+    "dalston junction": (51.545284, -0.074968),
+}
+
+
+def normalise_locations(locations: pd.Series) -> pd.Series:
+    """
+    Expand the abbreviations used in the deployment records so locations can be geocoded.
+
+    Args:
+        locations (Series): Raw deployment location names
+
+    Returns:
+        pd.Series: Location names with punctuation and abbreviations standardised
+    """
+    return (
+        locations
+        .str.replace("’", "'", regex=False)
+        .str.replace("–", "-", regex=False)
+        .str.replace(r"\bSt\b", "Street", regex=True)
+        .str.replace(r"\bRd\b", "Road", regex=True)
+        .str.replace(r"\bSq\b", "Square", regex=True)
+        .str.replace(r"\bStn\b", "Station", regex=True)
+        .str.replace(r"B'[Ww]ay", "Broadway", regex=True)
+        .str.replace(r"\bJunc\b", "Junction", regex=True)
+        .str.strip()
+    )
+
+
+def address_key(address: str) -> str:
+    """
+    Build the cache key for an address: lower case with whitespace collapsed.
+
+    Args:
+        address (str): Normalised location name
+
+    Returns:
+        str: Key used to store the address in the cache
+    """
+    return " ".join(address.lower().split())
+
+
+class GeocodeCache:
+    """
+    JSON-backed store of geocoded addresses and manual coordinate overrides.
+
+    Overrides always win over cached or looked-up results. Addresses that the
+    geocoder could not resolve are cached as None so they are not retried.
+    """
+
+    def __init__(self, cache_path: Path):
+        self.cache_path = Path(cache_path)
+        self.overrides = {key: tuple(coords) for key, coords in MANUAL_OVERRIDES.items()}
+        self.geocoded = {}
+
+        if self.cache_path.exists():
+            stored = json.loads(self.cache_path.read_text(encoding="utf-8"))
+            self.overrides.update({key: tuple(coords) for key, coords in stored.get("overrides", {}).items()})
+            self.geocoded = {
+                key: tuple(coords) if coords is not None else None
+                for key, coords in stored.get("geocoded", {}).items()
+            }
+
+        self.used_overrides = set()
+        self.hits = 0
+        self.override_hits = 0
+        self.misses = 0
+        self.unresolved = 0
+
+    def resolve_batch(self, addresses: Iterable[str], lookup: BatchLookup) -> dict[str, Optional[Coordinates]]:
+        """
+        Return coordinates for each distinct address, only passing cache misses to the geocoder.
+
+        Args:
+            addresses (Iterable[str]): Normalised location names
+            lookup (Callable): Batch geocoder mapping each attempted address to (latitude, longitude) or None
+
+        Returns:
+            dict: Coordinates per address, None where the address could not be geocoded
+        """
+        resolved = {}
+        misses = []
+
+        for address in dict.fromkeys(addresses):
+            key = address_key(address)
+
+            if key in self.overrides:
+                self.override_hits += 1
+                self.used_overrides.add(key)
+                resolved[address] = self.overrides[key]
+            elif key in self.geocoded:
+                self.hits += 1
+                resolved[address] = self.geocoded[key]
+            else:
+                misses.append(address)
+
+        self.misses += len(misses)
+        found = lookup(misses) if misses else {}
+
+        for address in misses:
+            # addresses the geocoder never answered (errors, skipped backends) are retried next run
+            if address in found:
+                self.geocoded[address_key(address)] = found[address]
+            else:
+                self.unresolved += 1
+            resolved[address] = found.get(address)
+
+        return resolved
+
+    def unused_overrides(self) -> list[str]:
+        """
+        Override keys that matched no address resolved so far, e.g. a typo or a source address that has changed.
+        """
+        return sorted(set(self.overrides) - self.used_overrides)
+
+    def save(self) -> None:
+        """
+        Write the overrides and geocoded addresses back to disk.
+        """
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        stored = {
+            "overrides": {key: list(coords) for key, coords in sorted(self.overrides.items())},
+            "geocoded": {
+                key: list(coords) if coords is not None else None
+                for key, coords in sorted(self.geocoded.items())
+            },
+        }
+        self.cache_path.write_text(json.dumps(stored, indent=2), encoding="utf-8")
+
+    def report(self) -> None:
+        """
+        Print the hit/miss counters for this run.
+        """
+        print(
+            f"Geocode cache: {self.hits} hits, {self.override_hits} overrides, "
+            f"{self.misses} misses ({self.unresolved} unresolved)"
+        )
+
+
+def token_key(address: str) -> str:
+    """
+    Build an order-independent key for an address from its sorted distinct word tokens.
+
+    Args:
+        address (str): Normalised location name
+
+    Returns:
+        str: Sorted, de-duplicated tokens joined by spaces
+    """
+    return " ".join(sorted(set(re.findall(r"[a-z0-9']+", address_key(address)))))
+
+
+def _trigrams(text: str) -> Counter:
+    padded = f"  {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class GazetteerGeocoder:
+    """
+    Offline geocoder backed by a local gazetteer of London streets, stations and junctions.
+
+    The gazetteer is a CSV with `name`, `latitude` and `longitude` columns and an
+    optional `locality` column (e.g. "High St North" / "East Ham"). Names go through
+    the same abbreviation normalisation as the deployment records, then are indexed
+    by token key for exact lookup and by character trigrams for fuzzy lookup.
+    """
+
+    def __init__(self, gazetteer_path: Path, min_similarity: float = 0.8):
+        gazetteer = pd.read_csv(gazetteer_path).dropna(subset=["name", "latitude", "longitude"])
+
+        names = normalise_locations(gazetteer["name"].astype(str))
+        if "locality" in gazetteer.columns:
+            localities = normalise_locations(gazetteer["locality"].fillna("").astype(str))
+            names = names.where(localities == "", names + ", " + localities)
+
+        self.min_similarity = min_similarity
+        self.keys = names.map(token_key).to_numpy()
+        self.coords = gazetteer[["latitude", "longitude"]].to_numpy(dtype=float)
+
+        # first entry wins where the gazetteer repeats a name
+        self.index = {}
+        for i, key in enumerate(self.keys):
+            self.index.setdefault(key, i)
+
+        self.vocabulary = {}
+        self.matrix = self._trigram_matrix(self.keys, grow=True)
+
+    def _trigram_matrix(self, keys: Sequence[str], grow: bool) -> sparse.csr_matrix:
+        rows, cols, values = [], [], []
+
+        for row, key in enumerate(keys):
+            counts = _trigrams(key)
+            norm = math.sqrt(sum(c * c for c in counts.values())) or 1.0
+
+            for gram, count in counts.items():
+                col = self.vocabulary.get(gram)
+                if col is None:
+                    if not grow:
+                        continue
+                    col = self.vocabulary[gram] = len(self.vocabulary)
+                rows.append(row)
+                cols.append(col)
+                values.append(count / norm)
+
+        return sparse.csr_matrix((values, (rows, cols)), shape=(len(keys), len(self.vocabulary)))
+
+    def geocode_batch(self, addresses: list[str]) -> dict[str, Optional[Coordinates]]:
+        """
+        Resolve a batch of addresses in one pass: exact token matches first, then trigram cosine similarity.
+
+        Args:
+            addresses (list[str]): Normalised location names
+
+        Returns:
+            dict: Coordinates for each address that matched; unresolved addresses are left out
+        """
+        found = {}
+        fuzzy = []
+
+        for address in addresses:
+            i = self.index.get(token_key(address))
+            if i is None:
+                fuzzy.append(address)
+            else:
+                found[address] = (float(self.coords[i, 0]), float(self.coords[i, 1]))
+
+        if fuzzy and self.matrix.shape[0]:
+            similarity = self._trigram_matrix([token_key(a) for a in fuzzy], grow=False) @ self.matrix.T
+            best = np.asarray(similarity.argmax(axis=1)).ravel()
+            scores = similarity.max(axis=1).toarray().ravel()
+
+            for address, i, score in zip(fuzzy, best, scores):
+                if score >= self.min_similarity:
+                    found[address] = (float(self.coords[i, 0]), float(self.coords[i, 1]))
+
+        return found
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket allowing `rate` requests per second with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class GeocodeFailure:
+    """
+    An address the network geocoder gave up on, with the last error seen.
+    """
+
+    address: str
+    attempts: int
+    error: str
+    transient: bool
+
+
+def _is_transient(error: Exception) -> bool:
+    # geopy raises a bare GeocoderServiceError for 5xx responses; its subclasses are client errors
+    return isinstance(error, (GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited)) or type(error) is GeocoderServiceError
+
+
+class AsyncNominatimGeocoder:
+    """
+    Batch Nominatim geocoder that issues requests concurrently under a token-bucket rate limit.
+
+    Transient errors (timeouts, 429s, 5xx) are retried with exponential backoff and jitter.
+    Addresses that still fail are left out of the results and recorded in `failures`.
+    The defaults respect the public Nominatim usage policy; raise `requests_per_second`
+    and `concurrency` for self-hosted instances or providers that allow more.
+    """
+
+    def __init__(
+        self,
+        domain: str = "nominatim.openstreetmap.org",
+        scheme: str = "https",
+        requests_per_second: float = 1.0,
+        burst: float = 1.0,
+        concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 1.0,
+        timeout: float = 10.0,
+    ):
+        self.domain = domain
+        self.scheme = scheme
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.failures = []
+
+    async def geocode_batch_async(self, addresses: list[str]) -> dict[str, Optional[Coordinates]]:
+        """
+        Geocode addresses concurrently.
+
+        Args:
+            addresses (list[str]): Normalised location names
+
+        Returns:
+            dict: latitude and longitude per address (None if no match); failed addresses are left out
+        """
+        bucket = TokenBucket(self.requests_per_second, self.burst)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        found = {}
+
+        async with Nominatim(
+            user_agent="lfr_deployment",
+            domain=self.domain,
+            scheme=self.scheme,
+            timeout=self.timeout,
+            adapter_factory=AioHTTPAdapter,
+        ) as geolocator:
+
+            async def geocode_one(address: str) -> None:
+                async with semaphore:
+                    for attempt in range(1, self.retries + 2):
+                        await bucket.acquire()
+                        count("nominatim.requests")
+                        try:
+                            location = await geolocator.geocode(f"{address}, London, UK")
+                        except Exception as e:
+                            transient = _is_transient(e)
+                            if not transient or attempt > self.retries:
+                                self.failures.append(GeocodeFailure(address, attempt, repr(e), transient))
+                                count("nominatim.failures")
+                                return
+
+                            count("nominatim.retries")
+                            delay = self.backoff * 2 ** (attempt - 1)
+                            if isinstance(e, GeocoderRateLimited) and e.retry_after:
+                                delay = max(delay, e.retry_after)
+                            await asyncio.sleep(delay * random.uniform(1.0, 1.5))
+                        else:
+                            found[address] = (location.latitude, location.longitude) if location else None
+                            return
+
+            await asyncio.gather(*(geocode_one(address) for address in addresses))
+
+        return found
+
+    def __call__(self, addresses: list[str]) -> dict[str, Optional[Coordinates]]:
+        return asyncio.run(self.geocode_batch_async(addresses))
+
+    def report(self, failures_path: Optional[Path] = None) -> None:
+        """
+        Print the failed addresses and optionally write them to a JSON file.
+
+        Args:
+            failures_path (Path | None): Where to write the failure records
+        """
+        for failure in self.failures:
+            kind = "transient" if failure.transient else "permanent"
+            print(f"Geocoding failed for '{failure.address}' after {failure.attempts} attempt(s) ({kind}): {failure.error}")
+
+        if failures_path is not None:
+            failures_path.parent.mkdir(parents=True, exist_ok=True)
+            failures_path.write_text(json.dumps([asdict(f) for f in self.failures], indent=2), encoding="utf-8")
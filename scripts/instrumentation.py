@@ -0,0 +1,534 @@
+"""
+Record where a script's time and memory go: timed spans around pipeline functions, call counters,
+and optional profiling of one span, written out as a JSON run report and a Chrome trace.
+
+A script's main block runs inside `recording(name)`. Functions decorated with `@instrumented`
+then record a span each time they are called: wall and CPU time, rows in and out, and resident
+memory. Outside `recording` the decorator just calls the function, so library use and the
+benchmarks are unaffected.
+
+Options are read from the environment, so `run_pipeline.py` can set them per stage:
+    PIPELINE_REPORT_DIR    folder for reports (default ../data/processed/run_reports)
+    PIPELINE_TRACE=1       also write a Chrome trace (open in chrome://tracing or ui.perfetto.dev)
+    PIPELINE_PROFILE       span to profile: the run name for the whole script, or a function name
+    PIPELINE_PROFILER      "cprofile" (default) or "sample" for a stack-sampling profiler
+"""
+
+import cProfile
+import functools
+import io
+import json
+import os
+import platform
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterator
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_REPORT_DIR = Path("../data/processed/run_reports")
+SAMPLE_INTERVAL_S = 0.02
+PROFILE_SAMPLE_INTERVAL_S = 0.005
+
+_active = None
+
+
+def peak_rss_mb() -> float | None:
+    """
+    Peak resident memory of this process in MB, or None where the platform does not report it.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def current_rss_mb() -> float | None:
+    """
+    Current resident memory of this process in MB, or None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def cpu_seconds() -> float:
+    """
+    User + system CPU time of this process, all of its threads, and the worker processes it has waited for.
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _rows(value) -> int | None:
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    return None
+
+
+@dataclass
+class Span:
+    """
+    One timed call, with the memory seen while it ran.
+
+    CPU time is the calling thread's, so spans running side by side in worker threads are not
+    charged for each other's work; work handed to other threads shows up in their own spans.
+    """
+
+    name: str
+    span_id: int
+    parent_id: int | None
+    thread: int
+    start: float
+    cpu_start: float
+    rss_start: float | None
+    end: float | None = None
+    cpu_end: float | None = None
+    rss_end: float | None = None
+    peak_rss: float | None = None
+    rows_in: int | None = None
+    rows_out: int | None = None
+    status: str = "ok"
+    attrs: dict = field(default_factory=dict)
+
+    def observe(self, rss: float | None) -> None:
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+
+class RunRecorder:
+    """
+    Collects spans, counters and memory samples for one script run.
+
+    A background thread samples resident memory every `sample_interval` seconds and raises the
+    peak of every open span, so a span's peak covers allocations made and freed inside it.
+    The same thread takes stack samples of the profiled span when the sampling profiler is on.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        profile_span: str | None = None,
+        profiler: str = "cprofile",
+        sample_interval: float = SAMPLE_INTERVAL_S,
+    ):
+        if profiler not in ("cprofile", "sample"):
+            raise ValueError(f"Unknown profiler: {profiler}")
+
+        self.name = name
+        self.profile_span = profile_span
+        self.profiler = profiler
+        self.sample_interval = sample_interval
+
+        self.started_at = datetime.now(timezone.utc)
+        self.epoch_offset = time.time() - time.perf_counter()
+        self.spans = []
+        self.counters = Counter()
+        self.memory_samples = []
+
+        self._open = {}
+        self._stacks = threading.local()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._stop = threading.Event()
+        self._sampler = None
+
+        self._root = None
+        self._cpu_start = None
+        self._cpu_end = None
+        self._profile = None
+        self._profiled = None
+        self._profiled_done = None
+        self._stack_samples = Counter()
+
+    def start(self) -> None:
+        # the run total covers every thread and waited-for worker process, unlike the per-thread span times
+        self._cpu_start = cpu_seconds()
+        self._sampler = threading.Thread(target=self._sample, name="instrumentation-sampler", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._cpu_end = cpu_seconds()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def _sample(self) -> None:
+        while True:
+            interval = PROFILE_SAMPLE_INTERVAL_S if self._profiled is not None and self.profiler == "sample" else self.sample_interval
+            if self._stop.wait(interval):
+                return
+
+            rss = current_rss_mb()
+            now = time.perf_counter()
+            with self._lock:
+                if rss is not None and (not self.memory_samples or now - self.memory_samples[-1][0] >= self.sample_interval):
+                    self.memory_samples.append((now, rss))
+                for span in self._open.values():
+                    span.observe(rss)
+
+                profiled = self._profiled
+            if profiled is not None and self.profiler == "sample":
+                self._take_stack_sample(profiled.thread)
+
+    def _take_stack_sample(self, thread: int) -> None:
+        frame = sys._current_frames().get(thread)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+            frame = frame.f_back
+
+        if stack:
+            self._stack_samples[";".join(reversed(stack))] += 1
+
+    def _stack(self) -> list[Span]:
+        if not hasattr(self._stacks, "spans"):
+            self._stacks.spans = []
+        return self._stacks.spans
+
+    @contextmanager
+    def span(self, name: str, rows_in: int | None = None, **attrs) -> Iterator[Span]:
+        """
+        Time a block of code as a span nested under the calling thread's current span.
+
+        Args:
+            name (str): Span name, usually the function name
+            rows_in (int | None): Rows the block was given
+            **attrs: Extra JSON-serialisable details to keep with the span
+
+        Yields:
+            Span: The open span, whose `rows_out` and `attrs` can be set inside the block
+        """
+        stack = self._stack()
+        rss = current_rss_mb()
+
+        with self._lock:
+            span = Span(
+                name=name,
+                span_id=self._next_id,
+                parent_id=stack[-1].span_id if stack else None,
+                thread=threading.get_ident(),
+                start=time.perf_counter(),
+                cpu_start=time.thread_time(),
+                rss_start=rss,
+                rows_in=rows_in,
+                attrs=dict(attrs),
+            )
+            span.observe(rss)
+            self._next_id += 1
+            self._open[span.span_id] = span
+        stack.append(span)
+
+        profiling = self._start_profile(span)
+        try:
+            yield span
+        except BaseException:
+            span.status = "failed"
+            raise
+        finally:
+            if profiling:
+                self._stop_profile()
+
+            span.end = time.perf_counter()
+            span.cpu_end = time.thread_time()
+            span.rss_end = current_rss_mb()
+            span.observe(span.rss_end)
+            if span.peak_rss is None:
+                # no /proc: fall back to the lifetime high-water mark
+                span.peak_rss = peak_rss_mb()
+
+            stack.pop()
+            with self._lock:
+                del self._open[span.span_id]
+                self.spans.append(span)
+
+    def _start_profile(self, span: Span) -> bool:
+        if span.name != self.profile_span or self._profiled is not None:
+            return False
+
+        self._profiled = span
+        if self.profiler == "cprofile":
+            # cProfile follows the calling thread only; worker threads and processes are not profiled
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+        return True
+
+    def _stop_profile(self) -> None:
+        if self._profile is not None:
+            self._profile.disable()
+        self._profiled_done = self._profiled
+        self._profiled = None
+
+    def count(self, name: str, n: float = 1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def _span_dict(self, span: Span) -> dict:
+        return {
+            "name": span.name,
+            "id": span.span_id,
+            "parent": span.parent_id,
+            "thread": span.thread,
+            "status": span.status,
+            "start_s": span.start - self._root.start,
+            "wall_s": span.end - span.start,
+            "cpu_s": span.cpu_end - span.cpu_start,
+            "rows_in": span.rows_in,
+            "rows_out": span.rows_out,
+            "rss_start_mb": span.rss_start,
+            "rss_end_mb": span.rss_end,
+            "peak_rss_mb": span.peak_rss,
+            **({"attrs": span.attrs} if span.attrs else {}),
+        }
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Spans aggregated by name: calls, total wall and CPU time, rows and the highest peak, slowest first.
+        """
+        spans = pd.DataFrame([self._span_dict(span) for span in self.spans])
+        if spans.empty:
+            return spans
+
+        summary = spans.groupby("name", sort=False).agg(
+            calls=("id", "size"),
+            wall_s=("wall_s", "sum"),
+            cpu_s=("cpu_s", "sum"),
+            rows_in=("rows_in", lambda rows: rows.sum(min_count=1)),
+            rows_out=("rows_out", lambda rows: rows.sum(min_count=1)),
+            peak_rss_mb=("peak_rss_mb", "max"),
+        )
+        summary["rows_per_s"] = summary["rows_in"] / summary["wall_s"].where(summary["wall_s"] > 0)
+        summary = summary.sort_values("wall_s", ascending=False).reset_index()
+
+        # missing row counts are None rather than NaN, so the report is valid JSON
+        return summary.astype(object).where(summary.notna(), None)
+
+    def _profile_report(self, out_dir: Path) -> dict | None:
+        span = self._profiled_done
+        if span is None:
+            return None
+
+        stem = f"{self.name}.{span.name}"
+        if self.profiler == "cprofile":
+            path = out_dir / f"{stem}.prof"
+            self._profile.dump_stats(path)
+
+            stats = pstats.Stats(self._profile, stream=io.StringIO())
+            top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:30]
+            functions = [
+                {"function": f"{func} ({Path(file).name}:{line})", "calls": calls, "self_s": self_time, "cumulative_s": cumulative}
+                for (file, line, func), (_, calls, self_time, cumulative, _) in top
+            ]
+        else:
+            path = out_dir / f"{stem}.folded"
+            # collapsed stacks, as read by flamegraph.pl and speedscope
+            path.write_text("".join(f"{stack} {n}\n" for stack, n in self._stack_samples.most_common()), encoding="utf-8")
+
+            leaves = Counter()
+            for stack, n in self._stack_samples.items():
+                leaves[stack.rsplit(";", 1)[-1]] += n
+            total = sum(leaves.values()) or 1
+            functions = [{"function": leaf, "samples": n, "pct_samples": 100 * n / total} for leaf, n in leaves.most_common(30)]
+
+        return {"span": span.name, "profiler": self.profiler, "path": str(path), "top": functions}
+
+    def report(self, out_dir: Path, status: str = "ok", error: str | None = None) -> dict:
+        """
+        The run report: run details, every span, spans aggregated by name, counters and the profile.
+        """
+        return {
+            "run": self.name,
+            "status": status,
+            "error": error,
+            "started": self.started_at.isoformat(timespec="seconds"),
+            "wall_s": self._root.end - self._root.start,
+            "cpu_s": self._cpu_end - self._cpu_start,
+            "peak_rss_mb": peak_rss_mb(),
+            "python": platform.python_version(),
+            "argv": sys.argv,
+            "functions": self.summary().to_dict(orient="records"),
+            "counters": dict(self.counters),
+            "profile": self._profile_report(out_dir),
+            "spans": [self._span_dict(span) for span in sorted(self.spans, key=lambda span: span.start)],
+        }
+
+    def chrome_trace(self) -> dict:
+        """
+        Spans as complete events and resident memory as a counter track, in the Chrome trace event format.
+
+        Timestamps are wall-clock microseconds, so traces from several processes can be merged.
+        """
+        pid = os.getpid()
+
+        def us(t: float) -> float:
+            return (t + self.epoch_offset) * 1e6
+
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": self.name}}]
+        for span in self.spans:
+            args = {"rows_in": span.rows_in, "rows_out": span.rows_out, "cpu_s": span.cpu_end - span.cpu_start, "peak_rss_mb": span.peak_rss, **span.attrs}
+            events.append({
+                "name": span.name,
+                "cat": self.name,
+                "ph": "X",
+                "ts": us(span.start),
+                "dur": (span.end - span.start) * 1e6,
+                "pid": pid,
+                "tid": span.thread,
+                "args": {key: value for key, value in args.items() if value is not None},
+            })
+        for t, rss in self.memory_samples:
+            events.append({"name": "rss_mb", "ph": "C", "ts": us(t), "pid": pid, "args": {"rss_mb": rss}})
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def active() -> RunRecorder | None:
+    """
+    The recorder of the current run, None outside `recording`.
+    """
+    return _active
+
+
+@contextmanager
+def span(name: str, rows_in: int | None = None, **attrs) -> Iterator[Span | None]:
+    """
+    Time a block of code (e.g. a file write) as a span of the current run; does nothing outside `recording`.
+    """
+    if _active is None:
+        yield None
+        return
+
+    with _active.span(name, rows_in, **attrs) as opened:
+        yield opened
+
+
+def count(name: str, n: float = 1) -> None:
+    """
+    Add to a run counter (e.g. geocoder requests, cache hits); does nothing outside `recording`.
+    """
+    if _active is not None:
+        _active.count(name, n)
+
+
+def annotate(**attrs) -> None:
+    """
+    Set details on the calling thread's current span. `rows_in` and `rows_out` set its row counts.
+    """
+    if _active is None:
+        return
+
+    stack = _active._stack()
+    if not stack:
+        return
+
+    current = stack[-1]
+    for key in ("rows_in", "rows_out"):
+        if key in attrs:
+            setattr(current, key, attrs.pop(key))
+    current.attrs.update(attrs)
+
+
+def instrumented(func: Callable) -> Callable:
+    """
+    Record a span for every call of `func`, named by its qualified name (e.g. `LsoaIndex.assign_ids`),
+    while a run is being recorded.
+
+    Rows in are taken from the first argument and rows out from the return value when they
+    are DataFrames, Series or arrays; functions can set them with `annotate` otherwise.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _active is None:
+            return func(*args, **kwargs)
+
+        with _active.span(func.__qualname__, _rows(args[0]) if args else None) as opened:
+            result = func(*args, **kwargs)
+            if opened.rows_out is None:
+                opened.rows_out = _rows(result)
+
+            return result
+
+    return wrapper
+
+
+@contextmanager
+def recording(name: str, report_dir: Path | None = None) -> Iterator[RunRecorder]:
+    """
+    Record a script run, writing `<name>.json` (and `<name>.trace.json` when tracing) to the report folder on exit.
+
+    The report is written whether the run succeeds or fails, so a failed run still shows how far it got.
+
+    Args:
+        name (str): Run name, also the name of the root span
+        report_dir (Path | None): Report folder, defaults to PIPELINE_REPORT_DIR or ../data/processed/run_reports
+
+    Yields:
+        RunRecorder: The recorder, active for the duration of the block
+    """
+    global _active
+
+    report_dir = Path(report_dir or os.environ.get("PIPELINE_REPORT_DIR") or DEFAULT_REPORT_DIR)
+    recorder = RunRecorder(
+        name,
+        profile_span=os.environ.get("PIPELINE_PROFILE") or None,
+        profiler=os.environ.get("PIPELINE_PROFILER") or "cprofile",
+    )
+
+    previous = _active
+    _active = recorder
+    recorder.start()
+    status, error = "ok", None
+
+    try:
+        with recorder.span(name) as root:
+            recorder._root = root
+            yield recorder
+    except BaseException as e:
+        # sys.exit(0) ends a run normally
+        if not (isinstance(e, SystemExit) and not e.code):
+            status, error = "failed", "".join(traceback.format_exception_only(type(e), e)).strip()
+        raise
+    finally:
+        recorder.stop()
+        _active = previous
+
+        report_dir.mkdir(parents=True, exist_ok=True)
+        report = recorder.report(report_dir, status, error)
+        (report_dir / f"{name}.json").write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+
+        if os.environ.get("PIPELINE_TRACE") not in (None, "", "0"):
+            (report_dir / f"{name}.trace.json").write_text(json.dumps(recorder.chrome_trace()), encoding="utf-8")
+
+        print_summary(report)
+
+
+def print_summary(report: dict, limit: int = 8) -> None:
+    """
+    Print the slowest functions and the counters of a run report.
+    """
+    peak = f", peak RSS {report['peak_rss_mb']:.0f} MB" if report["peak_rss_mb"] is not None else ""
+    print(f"{report['run']}: {report['status']} in {report['wall_s']:.2f}s wall, {report['cpu_s']:.2f}s CPU{peak}")
+
+    for entry in [entry for entry in report["functions"] if entry["name"] != report["run"]][:limit]:
+        rows = f"{entry['rows_in']:>12,.0f} rows in" if pd.notna(entry["rows_in"]) else " " * 20
+        print(f"  {entry['name']:<32}{entry['calls']:>5}x {entry['wall_s']:>9.2f}s {entry['cpu_s']:>9.2f}s CPU {rows}")
+
+    for name, value in sorted(report["counters"].items()):
+        print(f"  {name}: {value:g}")
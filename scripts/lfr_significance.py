@@ -0,0 +1,126 @@
+"""
+Permutation tests and bootstrap confidence intervals for LFR placement statistics.
+
+Every statistic is expressed as the mean of a per-LSOA score over deployments (e.g. 100 for LSOAs in the
+top 10% of stop & search and 0 elsewhere gives the % of deployments in those LSOAs), so each draw only
+needs the LSOA of every deployment: a batch of draws is one (draws x deployments) array of LSOA ids.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+
+
+def _draw_batch(scores: np.ndarray, cumulative: np.ndarray, n_deployments: int, n_draws: int, seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    Mean score per statistic for `n_draws` draws of deployment locations from a cumulative distribution over LSOAs.
+    """
+    rng = np.random.default_rng(seed)
+    lsoa_ids = np.searchsorted(cumulative, rng.random((n_draws, n_deployments)), side="right")
+
+    return scores[lsoa_ids].mean(axis=1)
+
+
+def draw_statistics(
+    scores: np.ndarray,
+    probabilities: np.ndarray,
+    n_deployments: int,
+    n_draws: int = 20_000,
+    batch_size: int = 1_000,
+    seed: int = 0,
+    workers: int | None = None,
+) -> np.ndarray:
+    """
+    Draw deployment locations from `probabilities` and compute every statistic per draw, in batches spread over a process pool.
+
+    Each batch gets its own child of `seed`, so the draws are the same whatever the number of workers.
+
+    Args:
+        scores (np.ndarray): (n_lsoas, n_statistics) score per LSOA for each statistic
+        probabilities (np.ndarray): Probability of a deployment landing in each LSOA
+        n_deployments (int): Deployments per draw
+        n_draws (int): Number of draws
+        batch_size (int): Draws per batch
+        seed (int): Seed for the whole set of draws
+        workers (int | None): Number of worker processes, defaults to the CPU count
+
+    Returns:
+        np.ndarray: (n_draws, n_statistics) statistic per draw
+    """
+    cumulative = np.cumsum(probabilities / probabilities.sum())
+    # guard against the last bin ending just below 1 through rounding
+    cumulative[-1] = np.inf
+
+    sizes = [min(batch_size, n_draws - start) for start in range(0, n_draws, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(scores, cumulative, n_deployments, size, batch_seed) for size, batch_seed in zip(sizes, seeds)]
+
+    if len(sizes) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            batches = list(executor.map(_draw_batch, *zip(*args)))
+    else:
+        batches = [_draw_batch(*batch_args) for batch_args in args]
+
+    return np.vstack(batches)
+
+
+@instrumented
+def placement_significance(
+    scores: pd.DataFrame,
+    lfr_counts: np.ndarray,
+    weights: np.ndarray | None = None,
+    n_draws: int = 20_000,
+    confidence: float = 0.95,
+    seed: int = 0,
+    workers: int | None = None,
+) -> pd.DataFrame:
+    """
+    Compare each placement statistic with a null of deployments reassigned at random across LSOAs,
+    and bootstrap a confidence interval by resampling the observed deployments.
+
+    Args:
+        scores (DataFrame): Score per LSOA (rows) for each statistic (columns)
+        lfr_counts (np.ndarray): Observed deployments per LSOA, in the same row order
+        weights (np.ndarray | None): Null placement weight per LSOA (e.g. area or population), None for uniform
+        n_draws (int): Number of permutation draws and of bootstrap resamples
+        confidence (float): Confidence level of the bootstrap interval
+        seed (int): Seed for the draws
+        workers (int | None): Number of worker processes, defaults to the CPU count
+
+    Returns:
+        pd.DataFrame: Observed value, null mean and interval, one-sided and two-sided p-values,
+            and bootstrap interval, per statistic
+    """
+    score_matrix = scores.to_numpy(dtype="float64")
+    lfr_counts = np.asarray(lfr_counts, dtype="int64")
+    n_deployments = int(lfr_counts.sum())
+
+    observed = lfr_counts @ score_matrix / n_deployments
+
+    null_weights = np.ones(len(lfr_counts)) if weights is None else np.nan_to_num(np.asarray(weights, dtype="float64"))
+    null = draw_statistics(score_matrix, null_weights, n_deployments, n_draws, seed=seed, workers=workers)
+    # resampling deployments with replacement is a draw in proportion to the observed counts
+    boot = draw_statistics(score_matrix, lfr_counts.astype("float64"), n_deployments, n_draws, seed=seed + 1, workers=workers)
+
+    # a small tolerance so draws equal to the observed value count as at least as extreme
+    tolerance = 1e-9 * np.maximum(np.abs(observed), 1)
+    p_greater = (1 + (null >= observed - tolerance).sum(axis=0)) / (1 + n_draws)
+    p_less = (1 + (null <= observed + tolerance).sum(axis=0)) / (1 + n_draws)
+
+    tail = (1 - confidence) / 2 * 100
+
+    return pd.DataFrame({
+        "stat": scores.columns,
+        "observed": observed,
+        "null_mean": null.mean(axis=0),
+        "null_lower": np.percentile(null, tail, axis=0),
+        "null_upper": np.percentile(null, 100 - tail, axis=0),
+        "p_greater": p_greater,
+        "p_less": p_less,
+        "p_two_sided": np.minimum(1, 2 * np.minimum(p_greater, p_less)),
+        "ci_lower": np.percentile(boot, tail, axis=0),
+        "ci_upper": np.percentile(boot, 100 - tail, axis=0),
+    })
@@ -0,0 +1,181 @@
+"""
+Vectorised LFR share statistics over plain per-LSOA arrays: concentration curves, Gini and group shares.
+"""
+
+import numpy as np
+import pandas as pd
+
+CHANGE_BUCKETS = {-1: "falling", 0: "no_change", 1: "rising"}
+
+
+class Concentration:
+    """
+    Share of a per-LSOA value (e.g. LFR deployments) captured by LSOAs at or above each level of a ranking
+    variable (e.g. 2025 stop & search counts).
+
+    The LSOAs are grouped by distinct ranking level in one sort, and every threshold, quantile and
+    curve point is read off the cumulative sums, so tied LSOAs always fall on the same side of a threshold.
+    """
+
+    def __init__(self, rank_by: np.ndarray, values: np.ndarray):
+        rank_by = np.asarray(rank_by, dtype="float64")
+        values = np.asarray(values, dtype="float64")
+
+        self.rank_by = rank_by
+        levels, inverse = np.unique(rank_by, return_inverse=True)
+        self.levels = levels
+        self.inverse = inverse
+
+        # totals for LSOAs at or above each level, as reverse cumulative sums over the ascending levels
+        lsoas = np.bincount(inverse, minlength=len(levels))
+        value_sums = np.bincount(inverse, weights=values, minlength=len(levels))
+        self.lsoas_at_or_above = np.cumsum(lsoas[::-1])[::-1]
+        self.value_at_or_above = np.cumsum(value_sums[::-1])[::-1]
+
+        self.n_lsoas = len(rank_by)
+        self.total = float(values.sum())
+
+    def above(self, thresholds: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        LSOA count and value total for LSOAs whose ranking value is >= each threshold.
+
+        Args:
+            thresholds (np.ndarray): Thresholds on the ranking variable
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: LSOAs at or above, and their value total, per threshold
+        """
+        first = np.searchsorted(self.levels, np.asarray(thresholds, dtype="float64"), side="left")
+        lsoas = np.append(self.lsoas_at_or_above, 0)[first]
+        value = np.append(self.value_at_or_above, 0.0)[first]
+
+        return lsoas, value
+
+    def at_quantiles(self, quantiles: np.ndarray | None = None) -> pd.DataFrame:
+        """
+        Value captured by LSOAs at or above each quantile of the ranking variable.
+
+        Thresholds use the same linear interpolation as `Series.quantile`, so quantile 0.9 matches
+        `df[df[rank] >= df[rank].quantile(0.9)]`.
+
+        Args:
+            quantiles (np.ndarray | None): Quantiles between 0 and 1, None for every percentile
+
+        Returns:
+            pd.DataFrame: quantile, threshold, lsoas, value and pct_value per quantile
+        """
+        if quantiles is None:
+            quantiles = np.arange(101) / 100
+        quantiles = np.asarray(quantiles, dtype="float64")
+
+        thresholds = np.percentile(self.rank_by, quantiles * 100.0)
+        lsoas, value = self.above(thresholds)
+
+        return pd.DataFrame({
+            "quantile": quantiles,
+            "threshold": thresholds,
+            "lsoas": lsoas,
+            "value": value,
+            "pct_value": value / self.total * 100 if self.total else np.nan,
+        })
+
+    def curve(self) -> pd.DataFrame:
+        """
+        Concentration (Lorenz) curve, ranking LSOAs from the highest level of the ranking variable down.
+
+        Returns:
+            pd.DataFrame: One row per distinct level plus the origin, with the cumulative share of LSOAs and of the value
+        """
+        total = self.total if self.total else np.nan
+        lsoa_share = np.concatenate([[0.0], self.lsoas_at_or_above[::-1] / self.n_lsoas])
+        value_share = np.concatenate([[0.0], self.value_at_or_above[::-1] / total])
+        threshold = np.concatenate([[np.inf], self.levels[::-1]])
+
+        return pd.DataFrame({"threshold": threshold, "lsoa_share": lsoa_share, "value_share": value_share})
+
+    def gini(self) -> float:
+        """
+        Concentration coefficient of the value over the ranking: 0 when the value is spread in proportion
+        to the number of LSOAs, approaching 1 when it all sits in the highest-ranked LSOAs
+        (negative when it sits in the lowest). Ranking by the value itself gives its Gini coefficient.
+
+        Returns:
+            float: Twice the area between the curve and the diagonal
+        """
+        curve = self.curve()
+        x = curve["lsoa_share"].to_numpy()
+        y = curve["value_share"].to_numpy()
+        area = np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2)
+
+        return float(2 * area - 1)
+
+    def gini_weights(self) -> np.ndarray:
+        """
+        Per-LSOA weights that make the concentration coefficient linear in the value:
+        `gini() == values @ gini_weights() / values.sum()`.
+
+        A unit of value in an LSOA whose level spans lsoa shares x0 to x1 of the curve contributes 1 - x0 - x1,
+        so the coefficient can be recomputed for any reallocation of the value without re-sorting.
+
+        Returns:
+            np.ndarray: Weight per LSOA, in input order
+        """
+        x1 = self.lsoas_at_or_above / self.n_lsoas
+        x0 = np.append(self.lsoas_at_or_above[1:], 0) / self.n_lsoas
+
+        return (1 - x0 - x1)[self.inverse]
+
+
+def group_shares(groups: np.ndarray, values: np.ndarray, total: float | None = None) -> pd.DataFrame:
+    """
+    LSOA count and value share per group (e.g. IMD decile) in one bincount, with running totals
+    in group order (e.g. "deciles 1 to 3").
+
+    LSOAs with a missing group are left out of every group but still count towards `total`.
+
+    Args:
+        groups (np.ndarray): Group per LSOA
+        values (np.ndarray): Value per LSOA
+        total (float | None): Total the shares are taken of, None for the sum of `values`
+
+    Returns:
+        pd.DataFrame: group, lsoas, value, pct_value and their cumulative versions
+    """
+    groups = pd.Series(np.asarray(groups))
+    values = np.asarray(values, dtype="float64")
+    if total is None:
+        total = float(values.sum())
+
+    known = groups.notna().to_numpy()
+    labels, inverse = np.unique(groups[known].to_numpy(), return_inverse=True)
+
+    lsoas = np.bincount(inverse, minlength=len(labels))
+    value = np.bincount(inverse, weights=values[known], minlength=len(labels))
+
+    shares = pd.DataFrame({"group": labels, "lsoas": lsoas, "value": value})
+    shares["pct_value"] = shares["value"] / total * 100 if total else np.nan
+    shares["cum_lsoas"] = shares["lsoas"].cumsum()
+    shares["cum_value"] = shares["value"].cumsum()
+    shares["cum_pct_value"] = shares["pct_value"].cumsum()
+
+    return shares
+
+
+def change_buckets(change: np.ndarray) -> np.ndarray:
+    """
+    Label each LSOA's change in stop & search as rising, no_change or falling.
+
+    Args:
+        change (np.ndarray): Change per LSOA
+
+    Returns:
+        np.ndarray: Bucket label per LSOA, None where the change is missing
+    """
+    change = np.asarray(change, dtype="float64")
+    labels = np.array([CHANGE_BUCKETS[-1], CHANGE_BUCKETS[0], CHANGE_BUCKETS[1]], dtype=object)
+
+    buckets = np.full(len(change), None, dtype=object)
+    known = ~np.isnan(change)
+    buckets[known] = labels[np.sign(change[known]).astype(int) + 1]
+
+    return buckets
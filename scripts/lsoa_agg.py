@@ -2,166 +2,174 @@
 Extract LSOA data and join stop & search, LFR deployments, and IMD data to polygons 
 """
  
+import hashlib
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from pathlib import Path
 
+from geo_store import read_partitioned_geoparquet
+from instrumentation import count, instrumented, recording, span
+from manifest import FileManifest, file_hash
+from lsoa_counts import LsoaCounts, attach_geometry, count_lsoa_ids
+from lsoa_index import LsoaIndex
 
-def load_geo_df(geo_path: Path) -> gpd.GeoDataFrame:
+
+@instrumented
+def load_geo_df(
+    geo_path: Path,
+    columns: list[str] | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+    years: list[int] | None = None,
+) -> gpd.GeoDataFrame:
     """
-    Load GeoDataFrames from a saved file.
+    Load GeoDataFrames from a saved file: a partitioned GeoParquet folder, a GeoParquet file or a GPKG.
 
     Args:
-        geo_path (Path): Path to the GeoDataFrame file
+        geo_path (Path): Path to the GeoDataFrame file or partitioned folder
+        columns (list[str] | None): Columns to read, None for all (geometry is always read)
+        bbox (tuple | None): (minx, miny, maxx, maxy) filter in the layer's CRS
+        years (list[int] | None): Year partitions to read from a partitioned folder
 
     Returns:
         gpd.GeoDataFrame: GeoDataFrame to be manipulated
     """
-    geo_df = gpd.read_file(geo_path)
-
-    return geo_df
-
+    if geo_path.is_dir():
+        return read_partitioned_geoparquet(geo_path, columns=columns, bbox=bbox, years=years)
 
+    if geo_path.suffix == ".parquet":
+        if columns is not None and "geometry" not in columns:
+            columns = [*columns, "geometry"]
+        return gpd.read_parquet(geo_path, columns=columns, bbox=bbox)
 
-def load_lsoa(zip_path: Path, shp_inside_zip: Path) -> gpd.GeoDataFrame:
-    """
-    Unzip, load and convert LSOA data 
-
-    Args:
-        zip_path (Path): Zip containing raw LSOA data
-        shp_inside_zip (Path): Path inside zip leading to LSOAs
+    geo_df = gpd.read_file(geo_path, columns=columns, bbox=bbox)
 
-    Returns:
-        gpd.GeoDataFrame: GeoDataFrame containing LSOAs
-    """
-    lsoa_gdf = gpd.read_file(f"zip://{zip_path}!{shp_inside_zip}")
-
-    lsoa_gdf = lsoa_gdf.to_crs("EPSG:4326")
+    return geo_df
 
-    return lsoa_gdf
 
 
-def load_imd(imd_path: Path) -> pd.DataFrame:
+@instrumented
+def load_imd(imd_path: Path, lsoa_codes: list[str] | None = None) -> pd.DataFrame:
     """
     Load the IMD data into a DataFrame for merging 
 
     Args:
-        imd_path (Path): Path to IMD csv
+        imd_path (Path): Path to the IMD parquet written by clean_imd.py
+        lsoa_codes (list[str] | None): Only read these LSOAs (e.g. London), None for all of England
 
     Returns:
         pd.DataFrame: DataFrame containing IMD data 
     """
-    imd_df = pd.read_csv(imd_path)
+    filters = [("LSOA11CD", "in", list(lsoa_codes))] if lsoa_codes is not None else None
+    imd_df = pd.read_parquet(imd_path, filters=filters)
 
     return imd_df
 
 
 
-def spatial_join_geo_data_to_lsoa(data_geo: gpd.GeoDataFrame, lsoa_geo: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+def lsoa_codes_key(codes: np.ndarray) -> str:
     """
-    Spatial join the lsoa polygons to a dataset 
-
-    Args:
-        data_geo (GeoDataFrame): GeoDataFrame containing police data
-        lsoa_geo (GeoDataFrame): GeoDataFrame containing LSOA polygons to be joined to 
-
-    Returns:
-        gpd.GeoDataFrame: GeoDataFrame containing the police data joined to LSOA polygons 
+    Hash of an ordered LSOA code list, identifying the row order that count vectors were built in.
     """
+    return hashlib.sha256("\n".join(map(str, codes)).encode()).hexdigest()
 
-    joined_police_data = gpd.sjoin(
-    data_geo,
-    lsoa_geo,
-    how="left",
-    predicate="within"
-    )
 
-    return joined_police_data
-
-
-def count_stop_search_by_lsoa(joined_data_geo: gpd.GeoDataFrame, lsoa_geo: gpd.GeoDataFrame, year: int) -> gpd.GeoDataFrame:
+@instrumented
+def count_stop_search_months(
+    stop_search_root: Path,
+    lsoa_index: LsoaIndex,
+    partials_dir: Path,
+    mode: str = "grid",
+) -> dict[str, np.ndarray]:
     """
-    Count the number of incidents per LSOA and merge into new GeoDataFrame 
+    Keep a per-month LSOA count partial for each stop & search partition, recounting only changed partitions.
 
     Args:
-        joined_data_geo (GeoDataFrame): GeoDataFrame containing police data and LSOA polygons
-        lsoa_geo (GeoDataFrame): GeoDataFrame containing LSOA data used for merging 
+        stop_search_root (Path): Root of the partitioned stop & search GeoParquet dataset
+        lsoa_index (LsoaIndex): Index over the LSOA polygons
+        partials_dir (Path): Folder holding the partials and their manifest
+        mode (str): "exact" STRtree lookup, or "grid" lookup with exact fallback on boundary cells
 
     Returns:
-        gpd.GeoDataFrame: GeoDataFrame containing the police data joined to LSOA polygons with a count
+        dict[str, np.ndarray]: LSOA count vector (in LSOA id order) per YYYY-MM month
     """
-    lsoa_counts = (
-        joined_data_geo
-        .groupby("LSOA11CD")
-        .size()
-        .reset_index(name=f"stop_search_count_{year}")
-    )
+    partials_path = partials_dir / "monthly_partials.npz"
+    manifest = FileManifest(partials_dir / "manifest.json")
 
-    lsoa_with_counts = (
-        lsoa_geo
-        .merge(lsoa_counts, on="LSOA11CD", how="left")
-        .fillna({f"stop_search_count_{year}": 0})
-    )
+    # partials are only valid for the LSOA set they were counted against
+    lsoa_key = lsoa_codes_key(lsoa_index.codes)
+    partials = {}
+    if partials_path.exists() and not manifest.changed("lsoa_codes", lsoa_key):
+        with np.load(partials_path) as stored:
+            partials = {month: stored[month] for month in stored.files}
+    else:
+        manifest.entries = {}
 
-    return lsoa_with_counts
+    partitions = {
+        f"{path.parent.parent.name.split('=')[1]}-{path.parent.name.split('=')[1]}": path
+        for path in sorted(stop_search_root.glob("year=*/month=*/part-0.parquet"))
+    }
 
+    # months whose partition has gone must not keep contributing their old counts
+    removed = sorted(set(partials) - set(partitions))
+    for month in removed:
+        del partials[month]
+        manifest.entries.pop(month, None)
+    if removed:
+        print(f"Dropped partials for {len(removed)} months with no stop & search partition: {', '.join(removed)}")
 
-def count_lfr_by_lsoa(lfr_lsoa: gpd.GeoDataFrame, lsoa_geo: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    """
-    Count LFR deployments per LSOA.
+    recounted = []
+    for month, partition in partitions.items():
+        digest = file_hash(partition)
 
-    Args:
-        lfr_lsoa (GeoDataFrame): GeoDataFrame containing LFR deployments and LSOA polygons
-        lsoa_geo (GeoDataFrame): GeoDataFrame containing LSOA data used for merging 
+        if month in partials and not manifest.changed(month, digest):
+            count("lsoa_partials.cached")
+            continue
 
-    Returns:
-        gpd.GeoDataFrame: GeoDataFrame containing the LFR joined to LSOA polygons with a count
-    """
+        points = gpd.read_parquet(partition, columns=["geometry"])
+        if mode == "grid":
+            # a sample of each recounted month is checked against sjoin before its grid counts are kept
+            lsoa_index.check_grid_equivalence(points.geometry)
+        partials[month] = count_lsoa_ids(lsoa_index.assign_ids(points.geometry, mode), len(lsoa_index.codes))
+
+        manifest.record(month, digest)
+        recounted.append(month)
+        count("lsoa_partials.recounted")
 
-    lfr_counts = (
-        lfr_lsoa
-        .groupby("LSOA11CD")
-        .size()
-        .reset_index(name="lfr_count")
-    )
+    print(f"Recounted {len(recounted)} of {len(partials)} monthly stop & search partials")
 
-    lsoa_with_lfr = (
-        lsoa_geo
-        .merge(lfr_counts, on="LSOA11CD", how="left")
-        .fillna({"lfr_count": 0})
-    )
+    partials_dir.mkdir(parents=True, exist_ok=True)
+    np.savez(partials_path, **partials)
+    manifest.record("lsoa_codes", lsoa_key)
+    manifest.save()
 
-    return lsoa_with_lfr
+    return partials
 
-def merge_all_data(stop_search_2025: gpd.GeoDataFrame, stop_search_2023: gpd.GeoDataFrame, lfr_gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+
+def sum_monthly_partials(partials: dict[str, np.ndarray], start: str, end: str) -> np.ndarray:
     """
-    Merge all the counts per LSOA into a single GeoDataFrame for analysis.
+    Total the monthly LSOA count partials between two months (inclusive).
 
     Args:
-        stop_search_2025 (GeoDataFrame): GeoDataFrame containing 2025 stop and search counts per LSOA
-        stop_search_2023 (GeoDataFrame): GeoDataFrame containing 2023 stop and search counts per LSOA
-        lfr_gdf (GeoDataFrame): GeoDataFrame containing LFR counts per LSOA
+        partials (dict[str, np.ndarray]): LSOA count vector per YYYY-MM month
+        start (str): First month to include, as YYYY-MM
+        end (str): Last month to include, as YYYY-MM
 
     Returns:
-        gpd.GeoDataFrame: GeoDataFrame containing a unified GeoDataFrame with all the counts for each activity per LSOA 
-    """
+        np.ndarray: Summed LSOA counts
 
-    unified_gdf = (
-        stop_search_2025.merge(
-            stop_search_2023[["LSOA11CD", "stop_search_count_2023"]], 
-            how="left",
-            on="LSOA11CD"
-        )
-        .merge(
-            lfr_gdf[["LSOA11CD", "lfr_count"]],
-            how="left",
-            on="LSOA11CD"
-        )
-    )
+    Raises:
+        ValueError: If any month between `start` and `end` has no partial
+    """
+    months = list(pd.period_range(start, end, freq="M").strftime("%Y-%m"))
+    missing = [month for month in months if month not in partials]
+    if missing:
+        raise ValueError(f"Missing monthly stop & search partials between {start} and {end}: {', '.join(missing)}")
 
-    return unified_gdf
+    return np.sum([partials[month] for month in months], axis=0)
 
-def calcualte_change_stop_search(unified_gdf: gpd.geoDataFrame) -> gpd.GeoDataFrame:
+@instrumented
+def calcualte_change_stop_search(unified_gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     """
     Calculate the difference between Jan-Nov 2023 stop & search statistics and Jan_nov 2025 stop & search statistics
 
@@ -176,6 +184,7 @@ def calcualte_change_stop_search(unified_gdf: gpd.geoDataFrame) -> gpd.GeoDataFr
     return unified_gdf
 
 
+@instrumented
 def merge_imd_with_counts(abs_difference_complete_gdf: gpd.GeoDataFrame, imd_df: pd.DataFrame) -> gpd.GeoDataFrame:
     """
     Merge the IMD data (London only) with the unified dataset
@@ -204,40 +213,42 @@ def merge_imd_with_counts(abs_difference_complete_gdf: gpd.GeoDataFrame, imd_df:
 
 if __name__ == "__main__":
 
-    in_path_2025 = Path("../data/processed/lsoa_data_2025.gpkg")
-    in_path_2023 = Path("../data/processed/lsoa_data_2023.gpkg")
+    in_path_stop_search = Path("../data/processed/stop_search")
 
-    in_path_lfr = Path("../data/processed/lfr_deployments.gpkg")
+    in_path_lfr = Path("../data/processed/lfr_deployments.parquet")
 
-    in_path_imd = Path("../data/processed/imd_2019.csv")
+    in_path_imd = Path("../data/processed/imd_2019.parquet")
 
     zip_path = Path("../data/raw/statistical-gis-boundaries-london.zip")
     shp_inside_zip_path = "statistical-gis-boundaries-london/ESRI/LSOA_2011_London_gen_MHW.shp"
 
-    out_path = Path("../data/processed/combined_counts.gpkg")
+    lsoa_cache_dir = Path("../data/processed/lsoa_index")
+    partials_dir = Path("../data/processed/lsoa_monthly_partials")
 
+    out_path = Path("../data/processed/combined_counts.gpkg")
 
-    geo_search_2025 = load_geo_df(in_path_2025)
-    geo_stop_search_2023 = load_geo_df(in_path_2023)
-    lfr_geo = load_geo_df(in_path_lfr)
-    lsoa_geo = load_lsoa(zip_path, shp_inside_zip_path)
-    imd_df = load_imd(in_path_imd)
 
-    joined_search_2025 = spatial_join_geo_data_to_lsoa(geo_search_2025, lsoa_geo)
-    joined_stop_search_2023 = spatial_join_geo_data_to_lsoa(geo_stop_search_2023, lsoa_geo)
-    joined_lfr = spatial_join_geo_data_to_lsoa(lfr_geo, lsoa_geo)
+    with recording("lsoa_agg"):
+        lfr_geo = load_geo_df(in_path_lfr)
+        # boundaries are parsed and reprojected once, then reused from the cache
+        lsoa_index = LsoaIndex.load(zip_path, shp_inside_zip_path, lsoa_cache_dir)
+        lsoa_geo = lsoa_index.boundaries
+        imd_df = load_imd(in_path_imd, lsoa_index.codes)
 
-    counts_joined_search_lsoa_2025 = count_stop_search_by_lsoa(joined_search_2025, lsoa_geo, 2025)
-    counts_joined_stop_search_lsoa_2023 = count_stop_search_by_lsoa(joined_stop_search_2023, lsoa_geo, 2023)
- 
-    lfr_counts_lsoa = count_lfr_by_lsoa(joined_lfr, lsoa_geo)
+        # only new or changed monthly partitions are counted; totals are sums of the monthly partials
+        monthly_partials = count_stop_search_months(in_path_stop_search, lsoa_index, partials_dir, mode="grid")
 
-    complete_gdf_with_counts = merge_all_data(counts_joined_search_lsoa_2025, counts_joined_stop_search_lsoa_2023, lfr_counts_lsoa)
+        lsoa_counts = LsoaCounts(lsoa_index.codes)
+        lsoa_counts.add_counts("stop_search_count_2025", sum_monthly_partials(monthly_partials, "2025-01", "2025-11"))
+        lsoa_counts.add_counts("stop_search_count_2023", sum_monthly_partials(monthly_partials, "2023-01", "2023-11"))
+        lsoa_counts.add("lfr_count", lsoa_index.assign_ids(lfr_geo.geometry))
 
-    abs_difference_complete_gdf = calcualte_change_stop_search(complete_gdf_with_counts)
+        abs_difference_complete_df = calcualte_change_stop_search(lsoa_counts.to_frame())
 
-    final_gdf_set = merge_imd_with_counts(abs_difference_complete_gdf, imd_df)
+        final_df_set = merge_imd_with_counts(abs_difference_complete_df, imd_df)
 
-    final_gdf_set.to_file(out_path, driver="GPKG")
+        # geometry is attached once, for the QGIS-facing export
+        final_gdf_set = attach_geometry(final_df_set, lsoa_geo)
 
-    
\ No newline at end of file
+        with span("write_gpkg", rows_in=len(final_gdf_set)):
+            final_gdf_set.to_file(out_path, driver="GPKG")
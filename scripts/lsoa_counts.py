@@ -0,0 +1,130 @@
+"""
+Count points per LSOA into a single integer matrix keyed by LSOA id, with optional categorical breakdowns.
+"""
+
+from itertools import product
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+
+
+def count_lsoa_ids(lsoa_ids: np.ndarray, n_lsoas: int, *breakdowns: pd.Categorical) -> np.ndarray:
+    """
+    Count points per LSOA id, optionally split by categoricals, with a single bincount.
+
+    Args:
+        lsoa_ids (np.ndarray): LSOA row id per point, -1 for points outside every LSOA
+        n_lsoas (int): Number of LSOAs
+        *breakdowns (Categorical): One categorical per point for each extra axis
+
+    Returns:
+        np.ndarray: int64 counts with shape (n_lsoas, n_categories_1, n_categories_2, ...)
+    """
+    shape = (n_lsoas, *(len(b.categories) for b in breakdowns))
+    keep = lsoa_ids >= 0
+    flat = lsoa_ids.astype(np.int64)
+
+    for breakdown in breakdowns:
+        category_codes = np.asarray(breakdown.codes, dtype=np.int64)
+        # points with a missing category cannot be placed on the axis
+        keep &= category_codes >= 0
+        flat = flat * len(breakdown.categories) + category_codes
+
+    counts = np.bincount(flat[keep], minlength=int(np.prod(shape)))
+
+    return counts.reshape(shape)
+
+
+class LsoaCounts:
+    """
+    Dense LSOA x column matrix of counts, one column per dataset/period (or breakdown category).
+
+    Rows follow the order of the LSOA index, so counts are keyed by integer LSOA id
+    and geometry only needs attaching once, at export.
+    """
+
+    def __init__(self, codes: np.ndarray, code_column: str = "LSOA11CD"):
+        self.codes = np.asarray(codes)
+        self.code_column = code_column
+        self.columns = []
+        self._blocks = []
+
+    def add(self, name: str, lsoa_ids: np.ndarray, by: list[pd.Series] | None = None) -> np.ndarray:
+        """
+        Count a batch of points per LSOA and add the result as one or more columns.
+
+        With `by`, one column is added per combination of categories, named
+        `{name}_{category}` (e.g. `stop_search_count_2025_2025-01`).
+
+        Args:
+            name (str): Column name, or prefix when breaking down by categoricals
+            lsoa_ids (np.ndarray): LSOA row id per point, -1 for points outside every LSOA
+            by (list[Series] | None): Per-point categoricals to break the counts down by
+
+        Returns:
+            np.ndarray: The counts, shaped (n_lsoas, n_categories_1, ...)
+        """
+        breakdowns = [pd.Categorical(b) for b in (by or [])]
+        counts = count_lsoa_ids(np.asarray(lsoa_ids), len(self.codes), *breakdowns)
+
+        if breakdowns:
+            labels = product(*(b.categories for b in breakdowns))
+            self.columns.extend(f"{name}_" + "_".join(str(label) for label in combo) for combo in labels)
+        else:
+            self.columns.append(name)
+        self._blocks.append(counts.reshape(len(self.codes), -1))
+
+        return counts
+
+    def add_counts(self, name: str, counts: np.ndarray) -> None:
+        """
+        Add an already computed per-LSOA count vector (e.g. a sum of monthly partials) as a column.
+
+        Args:
+            name (str): Column name
+            counts (np.ndarray): Counts in LSOA id order
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        if counts.shape != (len(self.codes),):
+            raise ValueError(f"Expected {len(self.codes)} LSOA counts for {name}, got shape {counts.shape}")
+
+        self.columns.append(name)
+        self._blocks.append(counts.reshape(-1, 1))
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        All counts as an (n_lsoas, n_columns) int64 matrix.
+        """
+        if not self._blocks:
+            return np.zeros((len(self.codes), 0), dtype=np.int64)
+
+        return np.hstack(self._blocks)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The count matrix as a DataFrame with an LSOA code column and one column per count.
+        """
+        frame = pd.DataFrame(self.matrix, columns=self.columns)
+        frame.insert(0, self.code_column, self.codes)
+
+        return frame
+
+
+@instrumented
+def attach_geometry(counts_df: pd.DataFrame, lsoa_geo: gpd.GeoDataFrame, code_column: str = "LSOA11CD") -> gpd.GeoDataFrame:
+    """
+    Join per-LSOA values onto the LSOA polygons for export.
+
+    Args:
+        counts_df (DataFrame): Per-LSOA values with an LSOA code column
+        lsoa_geo (GeoDataFrame): LSOA polygons and attributes
+        code_column (str): Column holding the LSOA code
+
+    Returns:
+        gpd.GeoDataFrame: LSOA polygons with the values attached
+    """
+    return lsoa_geo.merge(counts_df, on=code_column, how="left")
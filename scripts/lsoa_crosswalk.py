@@ -0,0 +1,370 @@
+"""
+Move per-LSOA counts between the 2011 and 2021 LSOA boundaries with a sparse matrix product,
+using the ONS LSOA11 -> LSOA21 lookup rather than re-joining every point to the new boundaries.
+
+Usage (from the scripts folder):
+    python lsoa_crosswalk.py --weighting area --lsoa21-zip <boundaries.zip> --lsoa21-shp <path/in/zip.shp>
+"""
+
+import argparse
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import sparse
+
+from geo_store import read_partitioned_geoparquet
+from instrumentation import annotate, instrumented, recording, span
+from lsoa_index import LsoaIndex
+from proximity import BRITISH_NATIONAL_GRID
+
+# CHGIND in the ONS lookup
+CHANGE_INDICATORS = {"U": "unchanged", "S": "split", "M": "merged", "X": "irregular"}
+
+# numeric columns whose name contains one of these (case-insensitive) are rates, ranks or attributes
+# of the polygon, which do not add up across LSOAs: IMD deciles, ranks and scores, POPDEN, AVHHOLDSZ...
+NON_ADDITIVE_COLUMNS = ("decile", "rank", "score", "density", "popden", "avhholdsz", "ratio", "pct", "share")
+
+
+@instrumented
+def load_lookup(path: Path, source_column: str = "LSOA11CD", target_column: str = "LSOA21CD") -> pd.DataFrame:
+    """
+    Load the LSOA pairs from an ONS best-fit lookup (e.g. "LSOA (2011) to LSOA (2021) to Local Authority District (2022)").
+
+    Args:
+        path (Path): Lookup CSV
+        source_column (str): Column holding the codes counts are keyed by now
+        target_column (str): Column holding the codes to move them to
+
+    Returns:
+        pd.DataFrame: One row per distinct (source, target) pair, with CHGIND where the lookup has it
+    """
+    wanted = {source_column, target_column, "CHGIND"}
+    lookup = pd.read_csv(path, usecols=lambda column: column in wanted, dtype=str)
+
+    missing = {source_column, target_column} - set(lookup.columns)
+    if missing:
+        raise ValueError(f"{path} has no {', '.join(sorted(missing))} column")
+
+    return lookup.dropna(subset=[source_column, target_column]).drop_duplicates([source_column, target_column]).reset_index(drop=True)
+
+
+def additive_columns(frame: pd.DataFrame, columns: list[str] | None = None, code_column: str = "LSOA11CD") -> list[str]:
+    """
+    The columns of a per-LSOA frame that can be moved by summing: the given ones, or every numeric
+    column except the code and those named in `NON_ADDITIVE_COLUMNS`.
+
+    Args:
+        frame (DataFrame): One row per LSOA
+        columns (list[str] | None): Columns to move, None to pick them from the dtypes and names
+        code_column (str): Column holding the LSOA code
+
+    Returns:
+        list[str]: Columns to move
+
+    Raises:
+        ValueError: If a named column is missing or not numeric, or no column is left to move
+    """
+    numeric = frame.select_dtypes("number").columns
+    if columns is not None:
+        unusable = [c for c in columns if c not in numeric]
+        if unusable:
+            raise ValueError(f"Columns missing or not numeric: {', '.join(map(str, unusable))}")
+    else:
+        columns = [
+            c for c in numeric
+            if c != code_column and not any(name in str(c).lower() for name in NON_ADDITIVE_COLUMNS)
+        ]
+
+    if not columns:
+        raise ValueError(f"No numeric count columns to move among: {', '.join(map(str, frame.columns))}")
+
+    return list(columns)
+
+
+@instrumented
+def area_weights(
+    lookup: pd.DataFrame,
+    target_boundaries: gpd.GeoDataFrame,
+    source_boundaries: gpd.GeoDataFrame | None = None,
+    source_column: str = "LSOA11CD",
+    target_column: str = "LSOA21CD",
+) -> np.ndarray:
+    """
+    Weight each lookup pair by area, in British National Grid.
+
+    With source boundaries the weight is the area the two polygons share, which also divides irregular
+    (X) changes properly. Without them it is the target's own area, which is exact for splits, where
+    the new LSOAs nest inside the old one.
+
+    Args:
+        lookup (DataFrame): Pairs from `load_lookup`
+        target_boundaries (GeoDataFrame): Polygons of the target vintage
+        source_boundaries (GeoDataFrame | None): Polygons of the source vintage
+        source_column (str): Source code column, in `lookup` and `source_boundaries`
+        target_column (str): Target code column, in `lookup` and `target_boundaries`
+
+    Returns:
+        np.ndarray: float64 weight per lookup row, 0 where a polygon is missing
+    """
+    def geometries(boundaries: gpd.GeoDataFrame, column: str, codes: pd.Series) -> np.ndarray:
+        projected = boundaries.to_crs(BRITISH_NATIONAL_GRID)
+        rows = pd.Index(projected[column]).get_indexer(codes)
+        found = np.asarray(projected.geometry.values)[np.maximum(rows, 0)]
+
+        return np.where(rows >= 0, found, None)
+
+    targets = geometries(target_boundaries, target_column, lookup[target_column])
+    if source_boundaries is None:
+        return np.nan_to_num(shapely.area(targets))
+
+    sources = geometries(source_boundaries, source_column, lookup[source_column])
+
+    return np.nan_to_num(shapely.area(shapely.intersection(sources, targets)))
+
+
+@instrumented
+def point_weights(
+    lookup: pd.DataFrame,
+    points: gpd.GeoSeries,
+    source_index: LsoaIndex,
+    target_index: LsoaIndex,
+    mode: str = "grid",
+) -> np.ndarray:
+    """
+    Weight each lookup pair by the number of reference points (e.g. stop & search records or
+    address points) lying in both LSOAs.
+
+    Only points in source LSOAs that the lookup divides between several targets are joined to the
+    target boundaries; everywhere else the weights are not needed.
+
+    Args:
+        lookup (DataFrame): Pairs from `load_lookup`
+        points (GeoSeries): Reference points
+        source_index (LsoaIndex): Index over the source boundaries, keyed by the lookup's source column
+        target_index (LsoaIndex): Index over the target boundaries, keyed by the lookup's target column
+        mode (str): "exact" or "grid" LSOA lookup, see `LsoaIndex.assign_ids`
+
+    Returns:
+        np.ndarray: float64 weight per lookup row
+    """
+    source_column, target_column = source_index.code_column, target_index.code_column
+    pair_source = pd.Index(source_index.codes).get_indexer(lookup[source_column])
+    pair_target = pd.Index(target_index.codes).get_indexer(lookup[target_column])
+
+    targets_per_source = np.bincount(pair_source[pair_source >= 0], minlength=len(source_index.codes))
+    divided = targets_per_source > 1
+
+    source_ids = source_index.assign_ids(points, mode)
+    in_divided = np.flatnonzero((source_ids >= 0) & divided[np.maximum(source_ids, 0)])
+    annotate(rows_in=len(points), rows_joined=len(in_divided))
+
+    target_ids = target_index.assign_ids(points.iloc[in_divided], mode)
+    located = target_ids >= 0
+
+    # (source, target) pairs as single int64 keys, so the counts are one np.unique
+    n_targets = len(target_index.codes)
+    point_keys = source_ids[in_divided][located].astype(np.int64) * n_targets + target_ids[located]
+    keys, counts = np.unique(point_keys, return_counts=True)
+    if len(keys) == 0:
+        return np.zeros(len(lookup))
+
+    pair_keys = pair_source.astype(np.int64) * n_targets + pair_target
+    position = np.minimum(np.searchsorted(keys, pair_keys), len(keys) - 1)
+    matched = (pair_source >= 0) & (pair_target >= 0) & (keys[position] == pair_keys)
+
+    return np.where(matched, counts[position], 0).astype(np.float64)
+
+
+class LsoaCrosswalk:
+    """
+    Sparse (n_target x n_source) matrix moving per-LSOA values from one boundary vintage to another.
+
+    Column j holds the shares of source LSOA j sent to each target LSOA and sums to one, so totals
+    are kept: unchanged and merged LSOAs pass whole, split and irregular ones are divided by the
+    pair weights. Re-keying every count column is then a single sparse-dense product.
+    """
+
+    def __init__(self, matrix: sparse.csr_matrix, source_codes: np.ndarray, target_codes: np.ndarray, source_column: str = "LSOA11CD", target_column: str = "LSOA21CD"):
+        self.matrix = matrix.tocsr()
+        self.source_codes = np.asarray(source_codes)
+        self.target_codes = np.asarray(target_codes)
+        self.source_column = source_column
+        self.target_column = target_column
+
+    @classmethod
+    def from_lookup(
+        cls,
+        lookup: pd.DataFrame,
+        source_codes: np.ndarray,
+        target_codes: np.ndarray | None = None,
+        weights: np.ndarray | None = None,
+        source_column: str = "LSOA11CD",
+        target_column: str = "LSOA21CD",
+    ) -> "LsoaCrosswalk":
+        """
+        Build the crosswalk for a set of source LSOAs (e.g. the rows of an LsoaIndex).
+
+        Sources whose pairs all weigh zero (no shared area or no reference points) are split evenly.
+
+        Args:
+            lookup (DataFrame): Pairs from `load_lookup`
+            source_codes (np.ndarray): Source LSOA codes, in the row order of the counts to move
+            target_codes (np.ndarray | None): Target LSOA codes in output order, defaults to the sorted targets of `source_codes`
+            weights (np.ndarray | None): Weight per lookup row from `area_weights` or `point_weights`, None to split evenly
+            source_column (str): Source code column in `lookup`
+            target_column (str): Target code column in `lookup`
+
+        Returns:
+            LsoaCrosswalk: The crosswalk
+        """
+        source_codes = np.asarray(source_codes)
+        if target_codes is None:
+            target_codes = np.sort(lookup.loc[lookup[source_column].isin(source_codes), target_column].unique())
+        target_codes = np.asarray(target_codes)
+
+        source_ids = pd.Index(source_codes).get_indexer(lookup[source_column])
+        target_ids = pd.Index(target_codes).get_indexer(lookup[target_column])
+        keep = (source_ids >= 0) & (target_ids >= 0)
+        source_ids, target_ids = source_ids[keep], target_ids[keep]
+
+        pair_weights = np.ones(keep.sum()) if weights is None else np.asarray(weights, dtype=np.float64)[keep]
+        totals = np.bincount(source_ids, pair_weights, minlength=len(source_codes))
+        pair_weights = np.where(totals[source_ids] > 0, pair_weights, 1.0)
+        totals = np.bincount(source_ids, pair_weights, minlength=len(source_codes))
+
+        matrix = sparse.csr_matrix(
+            (pair_weights / totals[source_ids], (target_ids, source_ids)),
+            shape=(len(target_codes), len(source_codes)),
+        )
+
+        crosswalk = cls(matrix, source_codes, target_codes, source_column, target_column)
+        unmatched = crosswalk.unmatched_sources()
+        if len(unmatched):
+            print(f"{len(unmatched)} of {len(source_codes)} {source_column} codes are not in the lookup; their counts are dropped")
+
+        return crosswalk
+
+    def unmatched_sources(self) -> np.ndarray:
+        """
+        Source codes with no target in the lookup, whose values cannot be moved.
+        """
+        return self.source_codes[np.diff(self.matrix.tocsc().indptr) == 0]
+
+    @instrumented
+    def apply(self, values: np.ndarray | sparse.spmatrix) -> np.ndarray | sparse.csr_matrix:
+        """
+        Move values keyed by source LSOA onto the target LSOAs.
+
+        Only additive values (counts, or differences of counts) can be moved this way; rates and
+        ranks such as IMD deciles need the target vintage's own release.
+
+        Args:
+            values (np.ndarray | sparse matrix): (n_source,) or (n_source, n_columns), in `source_codes` order
+
+        Returns:
+            np.ndarray | sparse.csr_matrix: float64 values in `target_codes` order; split counts are expected, not whole, counts
+        """
+        if values.shape[0] != len(self.source_codes):
+            raise ValueError(f"Expected {len(self.source_codes)} rows of {self.source_column} values, got shape {values.shape}")
+        annotate(rows_in=values.shape[0])
+
+        if sparse.issparse(values):
+            return (self.matrix @ values.astype(np.float64)).tocsr()
+
+        return self.matrix @ np.asarray(values, dtype=np.float64)
+
+    def apply_frame(self, frame: pd.DataFrame, columns: list[str] | None = None) -> pd.DataFrame:
+        """
+        Move the count columns of a frame keyed by source LSOA code (e.g. `LsoaCounts.to_frame()`).
+
+        Args:
+            frame (DataFrame): One row per source LSOA with a `source_column` code column
+            columns (list[str] | None): Columns to move, defaults to every numeric column
+
+        Returns:
+            pd.DataFrame: One row per target LSOA with a `target_column` code column and the moved columns
+        """
+        if columns is None:
+            columns = [c for c in frame.select_dtypes("number").columns if c != self.source_column]
+
+        rows = pd.Index(self.source_codes).get_indexer(frame[self.source_column])
+        if (rows < 0).any():
+            unknown = frame.loc[rows < 0, self.source_column].head(5).tolist()
+            raise ValueError(f"{(rows < 0).sum()} {self.source_column} codes are not in the crosswalk, e.g. {unknown}")
+
+        # LSOAs absent from the frame count as zero
+        values = np.zeros((len(self.source_codes), len(columns)))
+        values[rows] = frame[columns].fillna(0).to_numpy(dtype=np.float64)
+
+        moved = pd.DataFrame(self.apply(values), columns=columns)
+        moved.insert(0, self.target_column, self.target_codes)
+
+        return moved
+
+    def summary(self, lookup: pd.DataFrame) -> pd.DataFrame:
+        """
+        Number of source LSOAs per change type (unchanged, split, merged, irregular) in the lookup.
+        """
+        if "CHGIND" not in lookup.columns:
+            return pd.DataFrame(columns=["change", "lsoas"])
+
+        changes = lookup.loc[lookup[self.source_column].isin(self.source_codes)].drop_duplicates(self.source_column)
+
+        return (
+            changes["CHGIND"].map(CHANGE_INDICATORS).fillna(changes["CHGIND"])
+            .value_counts()
+            .rename_axis("change")
+            .reset_index(name="lsoas")
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lookup", type=Path, default=Path("../data/raw/LSOA11_LSOA21_LAD22_lookup.csv"), help="ONS LSOA11 -> LSOA21 lookup CSV")
+    parser.add_argument("--counts", type=Path, default=Path("../data/processed/combined_counts.gpkg"), help="per-LSOA counts (GPKG or parquet) keyed by LSOA11CD")
+    parser.add_argument("--out", type=Path, default=Path("../data/processed/combined_counts_lsoa21.parquet"))
+    parser.add_argument("--weighting", choices=["equal", "area", "points"], default="area", help="how split LSOAs divide their counts")
+    parser.add_argument("--lsoa-zip", type=Path, default=Path("../data/raw/statistical-gis-boundaries-london.zip"))
+    parser.add_argument("--lsoa-shp", default="statistical-gis-boundaries-london/ESRI/LSOA_2011_London_gen_MHW.shp")
+    parser.add_argument("--lsoa-cache", type=Path, default=Path("../data/processed/lsoa_index"))
+    parser.add_argument("--lsoa21-zip", type=Path, help="2021 LSOA boundaries, needed for area and points weighting")
+    parser.add_argument("--lsoa21-shp", help="path of the 2021 shapefile inside the zip")
+    parser.add_argument("--lsoa21-cache", type=Path, default=Path("../data/processed/lsoa_index_2021"))
+    parser.add_argument("--points", type=Path, default=Path("../data/processed/stop_search"), help="reference points for points weighting")
+    parser.add_argument("--columns", nargs="+", help="columns to move (default: every numeric column except IMD deciles, densities and other non-additive ones)")
+    args = parser.parse_args()
+
+    if args.weighting != "equal" and (args.lsoa21_zip is None or args.lsoa21_shp is None):
+        parser.error(f"--weighting {args.weighting} needs --lsoa21-zip and --lsoa21-shp")
+
+    with recording("lsoa_crosswalk"):
+        lookup = load_lookup(args.lookup)
+
+        # counts are moved for every LSOA the boundaries know about, in the LsoaIndex row order
+        source_index = LsoaIndex.load(args.lsoa_zip, args.lsoa_shp, args.lsoa_cache)
+        counts = pd.read_parquet(args.counts) if args.counts.suffix == ".parquet" else gpd.read_file(args.counts, ignore_geometry=True)
+
+        weights = None
+        if args.weighting != "equal":
+            target_index = LsoaIndex.load(args.lsoa21_zip, args.lsoa21_shp, args.lsoa21_cache, code_column="LSOA21CD")
+            if args.weighting == "area":
+                weights = area_weights(lookup, target_index.boundaries, source_index.boundaries)
+            else:
+                points = read_partitioned_geoparquet(args.points, columns=["geometry"]).geometry
+                weights = point_weights(lookup, points, source_index, target_index)
+
+        crosswalk = LsoaCrosswalk.from_lookup(lookup, source_index.codes, weights=weights)
+        print(crosswalk.summary(lookup).to_string(index=False))
+
+        # IMD deciles, densities and other boundary attributes do not add up across LSOAs, so only counts are moved
+        count_columns = additive_columns(counts, args.columns)
+        moved = crosswalk.apply_frame(counts, count_columns)
+
+        with span("write_parquet", rows_in=len(moved)):
+            args.out.parent.mkdir(parents=True, exist_ok=True)
+            moved.to_parquet(args.out, index=False)
+
+        print(f"Moved {len(count_columns)} count columns from {len(crosswalk.source_codes)} 2011 LSOAs to {len(moved)} 2021 LSOAs ({args.weighting} weighting)")
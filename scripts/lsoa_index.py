@@ -0,0 +1,240 @@
+"""
+Load, index and cache LSOA boundaries once, then assign LSOA codes to batches of points.
+"""
+
+import json
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from instrumentation import annotate, count, instrumented
+from manifest import file_hash
+
+
+class LsoaIndex:
+    """
+    LSOA polygons in EPSG:4326 with an STRtree for point-in-polygon assignment.
+
+    Points are matched with the same `within` predicate as the original
+    `gpd.sjoin`, so points on a shared boundary are left unassigned.
+
+    In "grid" mode a regular lookup grid is laid over the boundaries. Cells that
+    lie strictly inside a single LSOA map straight to it; only points falling in
+    cells that cross a boundary go through the exact `within` test.
+    """
+
+    def __init__(self, boundaries: gpd.GeoDataFrame, code_column: str = "LSOA11CD", cache_dir: Path | None = None):
+        self.boundaries = boundaries.reset_index(drop=True)
+        self.code_column = code_column
+        self.codes = self.boundaries[code_column].to_numpy()
+        self.tree = shapely.STRtree(self.boundaries.geometry.values)
+        self.cache_dir = cache_dir
+        self.grid = None
+
+    @classmethod
+    @instrumented
+    def load(cls, zip_path: Path, shp_inside_zip: str, cache_dir: Path, code_column: str = "LSOA11CD") -> "LsoaIndex":
+        """
+        Load the index from the cache, parsing and reprojecting the shapefile only if the zip has changed.
+
+        Args:
+            zip_path (Path): Zip containing raw LSOA data
+            shp_inside_zip (str): Path inside zip leading to LSOAs
+            cache_dir (Path): Folder holding the reprojected boundaries
+            code_column (str): Column holding the LSOA code
+
+        Returns:
+            LsoaIndex: Index over the LSOA polygons
+        """
+        boundaries_path = cache_dir / "boundaries.parquet"
+        manifest_path = cache_dir / "manifest.json"
+        source = {"zip_hash": file_hash(zip_path), "shp": str(shp_inside_zip), "crs": "EPSG:4326"}
+
+        if boundaries_path.exists() and manifest_path.exists():
+            if json.loads(manifest_path.read_text(encoding="utf-8")) == source:
+                count("lsoa_index.cache_hits")
+                return cls(gpd.read_parquet(boundaries_path), code_column, cache_dir)
+
+        boundaries = gpd.read_file(f"zip://{zip_path}!{shp_inside_zip}").to_crs("EPSG:4326")
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for stale_grid in cache_dir.glob("grid_*.npz"):
+            stale_grid.unlink()
+        boundaries.to_parquet(boundaries_path, index=False)
+        manifest_path.write_text(json.dumps(source, indent=2), encoding="utf-8")
+
+        return cls(boundaries, code_column, cache_dir)
+
+    @instrumented
+    def build_grid(self, cell_size: float = 0.0005, max_cells: int = 25_000_000, band_cells: int = 200_000) -> None:
+        """
+        Precompute the lookup grid, loading it from the cache folder if it was built before.
+
+        Args:
+            cell_size (float): Cell width and height in degrees (0.0005 is roughly 35m x 55m in London)
+            max_cells (int): Refuse to build grids larger than this
+            band_cells (int): Cells built and tested at once
+
+        Raises:
+            ValueError: If the grid would need more than `max_cells` cells
+        """
+        grid_path = self.cache_dir / f"grid_{cell_size:g}.npz" if self.cache_dir is not None else None
+
+        if grid_path is not None and grid_path.exists():
+            count("lsoa_grid.cache_hits")
+            stored = np.load(grid_path)
+            self.grid = (tuple(stored["origin"]), float(stored["cell_size"]), tuple(stored["shape"]), stored["cells"])
+            return
+
+        minx, miny, maxx, maxy = self.boundaries.total_bounds
+        nx = int(np.ceil((maxx - minx) / cell_size))
+        ny = int(np.ceil((maxy - miny) / cell_size))
+        if nx * ny > max_cells:
+            raise ValueError(f"A {cell_size:g} degree grid needs {nx * ny} cells (limit {max_cells}); use a larger cell_size")
+
+        lookup = np.full(nx * ny, -1, dtype=np.int32)
+        # cells are padded slightly so points rounded onto a neighbouring cell are still covered
+        eps = cell_size * 1e-6
+
+        # built in bands of rows so memory stays bounded for national-scale grids
+        rows_per_band = max(1, band_cells // nx)
+        for first_row in range(0, ny, rows_per_band):
+            band = np.arange(first_row * nx, min(ny, first_row + rows_per_band) * nx)
+            iy, ix = np.divmod(band, nx)
+            x0 = minx + ix * cell_size
+            y0 = miny + iy * cell_size
+            cells = shapely.box(x0 - eps, y0 - eps, x0 + cell_size + eps, y0 + cell_size + eps)
+
+            band_box = shapely.box(minx, y0[0] - eps, maxx + cell_size, y0[-1] + cell_size + eps)
+            candidates = self.tree.query(band_box)
+            lsoa_idx, cell_idx = shapely.STRtree(cells).query(
+                self.boundaries.geometry.values[candidates], predicate="contains_properly"
+            )
+            lookup[band[cell_idx]] = candidates[lsoa_idx]
+
+        self.grid = ((minx, miny), cell_size, (ny, nx), lookup)
+
+        if grid_path is not None:
+            np.savez(grid_path, origin=np.array([minx, miny]), cell_size=cell_size, shape=np.array([ny, nx]), cells=lookup)
+
+        interior = (lookup >= 0).mean() * 100
+        print(f"LSOA grid: {nx} x {ny} cells, {interior:.1f}% inside a single LSOA")
+
+    def _exact_ids(self, geometries: np.ndarray) -> np.ndarray:
+        point_idx, lsoa_idx = self.tree.query(geometries, predicate="within")
+
+        ids = np.full(len(geometries), -1, dtype=np.int32)
+        # reversed so the first match wins if polygons ever overlap
+        ids[point_idx[::-1]] = lsoa_idx[::-1]
+
+        return ids
+
+    def _grid_ids(self, geometries: np.ndarray) -> np.ndarray:
+        if self.grid is None:
+            self.build_grid()
+        (minx, miny), cell_size, (ny, nx), lookup = self.grid
+
+        ids = np.full(len(geometries), -1, dtype=np.int32)
+        # empty points have no coordinates to look up; they take the exact path with everything else
+        is_point = (shapely.get_type_id(geometries) == 0) & ~shapely.is_empty(geometries)
+        x = np.full(len(geometries), np.nan)
+        y = np.full(len(geometries), np.nan)
+        x[is_point] = shapely.get_x(geometries[is_point])
+        y[is_point] = shapely.get_y(geometries[is_point])
+
+        with np.errstate(invalid="ignore"):
+            ix = np.floor((x - minx) / cell_size)
+            iy = np.floor((y - miny) / cell_size)
+        on_grid = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+
+        ids[on_grid] = lookup[(iy[on_grid] * nx + ix[on_grid]).astype(np.int64)]
+
+        # boundary cells and off-grid points take the exact path, once per distinct location;
+        # police.uk snaps records to a fixed set of map points so these repeat heavily
+        fallback = (ids < 0) & is_point & ~np.isnan(x)
+        locations, inverse = np.unique(x[fallback] + 1j * y[fallback], return_inverse=True)
+        ids[fallback] = self._exact_ids(shapely.points(locations.real, locations.imag))[inverse]
+
+        # anything that is not a simple point is tested as-is
+        other = ~is_point
+        ids[other] = self._exact_ids(geometries[other])
+
+        return ids
+
+    @instrumented
+    def assign_ids(self, points: gpd.GeoSeries, mode: str = "exact") -> np.ndarray:
+        """
+        Find the row of the LSOA containing each point.
+
+        Args:
+            points (GeoSeries): Points to assign
+            mode (str): "exact" for an STRtree query per point, "grid" for the grid lookup with exact fallback
+
+        Returns:
+            np.ndarray: int32 row index into `boundaries` per point, -1 where no LSOA contains the point
+        """
+        annotate(rows_in=len(points), mode=mode)
+        if points.crs is not None and points.crs != self.boundaries.crs:
+            points = points.to_crs(self.boundaries.crs)
+
+        if mode == "grid":
+            return self._grid_ids(np.asarray(points.values))
+        if mode == "exact":
+            return self._exact_ids(points.values)
+
+        raise ValueError(f"Unknown LSOA assignment mode: {mode}")
+
+    def assign(self, points: gpd.GeoSeries, mode: str = "exact") -> np.ndarray:
+        """
+        Find the code of the LSOA containing each point.
+
+        Args:
+            points (GeoSeries): Points to assign
+            mode (str): "exact" or "grid", see `assign_ids`
+
+        Returns:
+            np.ndarray: LSOA code per point, None where no LSOA contains the point
+        """
+        ids = self.assign_ids(points, mode)
+
+        codes = np.full(len(ids), None, dtype=object)
+        codes[ids >= 0] = self.codes[ids[ids >= 0]]
+
+        return codes
+
+    def check_grid_equivalence(self, points: gpd.GeoSeries, sample_size: int | None = 10_000, seed: int = 0) -> int:
+        """
+        Check the grid lookup against a plain `gpd.sjoin(..., predicate="within")` on a sample of points.
+
+        Args:
+            points (GeoSeries): Points to check
+            sample_size (int | None): Number of points to sample, None to check every point
+            seed (int): Seed for the sample
+
+        Returns:
+            int: Number of points checked
+
+        Raises:
+            ValueError: If any point is assigned differently
+        """
+        if sample_size is not None and len(points) > sample_size:
+            points = points.sample(sample_size, random_state=seed)
+        points = points.reset_index(drop=True)
+
+        joined = gpd.sjoin(
+            gpd.GeoDataFrame(geometry=points),
+            self.boundaries[[self.code_column, "geometry"]],
+            how="left",
+            predicate="within",
+        )
+        expected = joined[self.code_column].groupby(level=0).first().reindex(points.index).to_numpy()
+        actual = self.assign(points, mode="grid")
+
+        mismatched = ~((expected == actual) | (pd.isna(expected) & pd.isna(actual)))
+        if mismatched.any():
+            raise ValueError(f"Grid LSOA lookup disagrees with sjoin for {mismatched.sum()} of {len(points)} points")
+
+        return len(points)
@@ -0,0 +1,58 @@
+"""
+Content hashes of pipeline inputs, used to skip work whose inputs have not changed.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+
+def file_hash(path: Path) -> str:
+    """
+    SHA-256 of a file's contents.
+
+    Args:
+        path (Path): File to hash
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """
+    JSON file mapping keys (e.g. a month or file name) to the content hash last processed for them.
+    """
+
+    def __init__(self, manifest_path: Path):
+        self.manifest_path = Path(manifest_path)
+        self.entries = {}
+
+        if self.manifest_path.exists():
+            self.entries = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+
+    def changed(self, key: str, digest: str) -> bool:
+        """
+        Whether the input recorded under `key` has a different hash from the one last processed.
+        """
+        return self.entries.get(key) != digest
+
+    def record(self, key: str, digest: str) -> None:
+        """
+        Remember that the input with this hash has been processed.
+        """
+        self.entries[key] = digest
+
+    def save(self) -> None:
+        """
+        Write the manifest back to disk.
+        """
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        self.manifest_path.write_text(json.dumps(self.entries, indent=2, sort_keys=True), encoding="utf-8")
@@ -0,0 +1,64 @@
+"""
+Build point geometries from coordinate columns in bulk, screening out unusable coordinates.
+"""
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+# (min lon, min lat, max lon, max lat), with a margin around the London LSOA extent
+LONDON_BOUNDS = (-0.6, 51.2, 0.4, 51.8)
+GREAT_BRITAIN_BOUNDS = (-8.7, 49.8, 1.8, 60.9)
+
+
+def points_from_coordinates(
+    df: pd.DataFrame,
+    lon_column: str = "Longitude",
+    lat_column: str = "Latitude",
+    bounds: tuple[float, float, float, float] | None = LONDON_BOUNDS,
+    drop: bool = True,
+    verbose: bool = True,
+) -> gpd.GeoDataFrame:
+    """
+    Convert longitude/latitude columns to a point GeoDataFrame with vectorised geometry construction.
+
+    Rows with missing coordinates, or coordinates outside `bounds`, are dropped, or kept
+    with an empty geometry and `valid_location` set to False when `drop` is False.
+
+    Args:
+        df (DataFrame): Data with coordinate columns
+        lon_column (str): Name of the longitude column
+        lat_column (str): Name of the latitude column
+        bounds (tuple | None): (min lon, min lat, max lon, max lat) accepted, None to accept any
+        drop (bool): Drop invalid rows rather than flagging them
+        verbose (bool): Print how many rows were dropped or flagged
+
+    Returns:
+        gpd.GeoDataFrame: Points in EPSG:4326
+    """
+    lon = pd.to_numeric(df[lon_column], errors="coerce").to_numpy(dtype="float64")
+    lat = pd.to_numeric(df[lat_column], errors="coerce").to_numpy(dtype="float64")
+
+    missing = np.isnan(lon) | np.isnan(lat)
+    out_of_bounds = np.zeros(len(df), dtype=bool)
+    if bounds is not None:
+        min_lon, min_lat, max_lon, max_lat = bounds
+        out_of_bounds = ~missing & ((lon < min_lon) | (lon > max_lon) | (lat < min_lat) | (lat > max_lat))
+
+    valid = ~(missing | out_of_bounds)
+    if verbose:
+        action = "Dropped" if drop else "Flagged"
+        print(
+            f"{action} {(~valid).sum()} of {len(df)} rows without a usable location "
+            f"({missing.sum()} missing, {out_of_bounds.sum()} out of bounds)"
+        )
+
+    if drop:
+        df = df.loc[valid]
+        geometry = gpd.points_from_xy(lon[valid], lat[valid], crs="EPSG:4326")
+    else:
+        df = df.assign(valid_location=valid)
+        geometry = gpd.points_from_xy(lon, lat, crs="EPSG:4326")
+        geometry[~valid] = None
+
+    return gpd.GeoDataFrame(df, geometry=geometry, crs="EPSG:4326")
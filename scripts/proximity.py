@@ -0,0 +1,195 @@
+"""
+Count stop & search events within fixed distances of each LFR deployment, independent of LSOA boundaries.
+"""
+
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.spatial import cKDTree
+
+from geo_store import read_partitioned_geoparquet
+
+BRITISH_NATIONAL_GRID = "EPSG:27700"
+RADII_M = (100, 250, 500, 1000)
+
+
+def to_bng_xy(points: gpd.GeoSeries) -> np.ndarray:
+    """
+    Project points to British National Grid, so distances are in metres.
+
+    Args:
+        points (GeoSeries): Points with a CRS set
+
+    Returns:
+        np.ndarray: (n, 2) easting/northing per point, NaN for missing or empty geometries
+    """
+    projected = points.to_crs(BRITISH_NATIONAL_GRID).values
+    usable = ~(shapely.is_missing(projected) | shapely.is_empty(projected))
+
+    xy = np.full((len(projected), 2), np.nan)
+    xy[usable] = shapely.get_coordinates(projected[usable])
+
+    return xy
+
+
+def distinct_bng_locations(points: gpd.GeoSeries) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Project each distinct point location to British National Grid once, with the number of points at it.
+
+    police.uk snaps records to a fixed set of map points, so this is far fewer projections than points.
+
+    Args:
+        points (GeoSeries): Points with a CRS set; missing and empty geometries are skipped
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (n_locations, 2) easting/northing and the point count per location
+    """
+    usable = ~(shapely.is_missing(points.values) | shapely.is_empty(points.values))
+    xy = shapely.get_coordinates(points.values[usable])
+    locations, counts = np.unique(xy[:, 0] + 1j * xy[:, 1], return_counts=True)
+
+    located = gpd.GeoSeries(shapely.points(locations.real, locations.imag), crs=points.crs)
+
+    return to_bng_xy(located), counts
+
+
+class ProximityIndex:
+    """
+    KD-tree over event locations in British National Grid.
+
+    Events snapped to the same map point are stored once with a weight, which keeps the tree
+    small for police.uk data where millions of records share a fixed set of locations.
+    """
+
+    def __init__(self, event_xy: np.ndarray, weights: np.ndarray | None = None):
+        usable = ~np.isnan(event_xy).any(axis=1)
+
+        self.xy = event_xy[usable]
+        self.weights = np.ones(len(self.xy)) if weights is None else np.asarray(weights, dtype="float64")[usable]
+        self.n_events = self.weights.sum()
+        self.tree = cKDTree(self.xy)
+
+    @classmethod
+    def from_points(cls, points: gpd.GeoSeries) -> "ProximityIndex":
+        """
+        Build the index from event points in any CRS, projecting each distinct location once.
+        """
+        return cls(*distinct_bng_locations(points))
+
+    def count_within(self, query_xy: np.ndarray, radii: tuple[float, ...] = RADII_M, batch_size: int = 10_000) -> np.ndarray:
+        """
+        Count events within each radius of each query point.
+
+        Each batch of query points needs one ball query at the largest radius; the smaller radii are
+        counted from the distances to the neighbours found.
+
+        Args:
+            query_xy (np.ndarray): (n, 2) query points in British National Grid
+            radii (tuple[float, ...]): Radii in metres
+            batch_size (int): Query points per ball query
+
+        Returns:
+            np.ndarray: (n, n_radii) event count per query point and radius, NaN for query points without a location
+        """
+        radii = np.asarray(radii, dtype="float64")
+        counts = np.full((len(query_xy), len(radii)), np.nan)
+
+        for start in range(0, len(query_xy), batch_size):
+            batch = query_xy[start:start + batch_size]
+            usable = ~np.isnan(batch).any(axis=1)
+
+            neighbours = self.tree.query_ball_point(batch[usable], radii.max(), workers=-1)
+            lengths = np.fromiter((len(found) for found in neighbours), dtype=np.int64, count=len(neighbours))
+            found = np.concatenate(neighbours).astype(np.int64) if lengths.sum() else np.zeros(0, dtype=np.int64)
+            owner = np.repeat(np.arange(len(neighbours)), lengths)
+
+            distance = np.hypot(*(self.xy[found] - batch[usable][owner]).T)
+            batch_counts = np.column_stack([
+                np.bincount(owner, weights=self.weights[found] * (distance <= radius), minlength=len(neighbours))
+                for radius in radii
+            ])
+            counts[start:start + batch_size][usable] = batch_counts
+
+        return counts
+
+
+def proximity_counts(
+    lfr_gdf: gpd.GeoDataFrame,
+    event_layers: dict[str, gpd.GeoSeries],
+    radii: tuple[float, ...] = RADII_M,
+) -> gpd.GeoDataFrame:
+    """
+    Add one count column per event layer and radius to the LFR deployments.
+
+    Args:
+        lfr_gdf (GeoDataFrame): LFR deployments
+        event_layers (dict[str, GeoSeries]): Event points by name (e.g. "stop_search_2025")
+        radii (tuple[float, ...]): Radii in metres
+
+    Returns:
+        gpd.GeoDataFrame: Deployments with `{name}_within_{radius}m` columns
+    """
+    deployment_xy = to_bng_xy(lfr_gdf.geometry)
+    columns = {}
+
+    for name, events in event_layers.items():
+        counts = ProximityIndex.from_points(events).count_within(deployment_xy, radii)
+        for radius, column in zip(radii, counts.T):
+            columns[f"{name}_within_{radius:g}m"] = column
+
+    return lfr_gdf.assign(**columns)
+
+
+def summarise_proximity(proximity_gdf: gpd.GeoDataFrame, event_names: list[str], radii: tuple[float, ...] = RADII_M) -> pd.DataFrame:
+    """
+    Summarise the per-deployment counts for each event layer and radius.
+
+    Args:
+        proximity_gdf (GeoDataFrame): Output of `proximity_counts`
+        event_names (list[str]): Event layer names
+        radii (tuple[float, ...]): Radii in metres
+
+    Returns:
+        pd.DataFrame: Deployments located, mean/median/90th percentile count and % of deployments with any event, per layer and radius
+    """
+    rows = []
+
+    for name in event_names:
+        for radius in radii:
+            counts = proximity_gdf[f"{name}_within_{radius:g}m"].dropna()
+            rows.append({
+                "events": name,
+                "radius_m": radius,
+                "deployments": len(counts),
+                "mean_events": counts.mean(),
+                "median_events": counts.median(),
+                "p90_events": counts.quantile(0.9),
+                "pct_deployments_with_events": (counts > 0).mean() * 100,
+            })
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    in_path_stop_search = Path("../data/processed/stop_search")
+    in_path_lfr = Path("../data/processed/lfr_deployments.parquet")
+
+    out_path = Path("../data/processed/lfr_proximity.gpkg")
+    summary_out_path = Path("../outputs/tables/lfr_proximity_summary.csv")
+
+
+    lfr_gdf = gpd.read_parquet(in_path_lfr)
+
+    event_layers = {
+        f"stop_search_{year}": read_partitioned_geoparquet(in_path_stop_search, columns=[], years=[year]).geometry
+        for year in (2025, 2023)
+    }
+
+    proximity_gdf = proximity_counts(lfr_gdf, event_layers)
+    summary = summarise_proximity(proximity_gdf, list(event_layers))
+
+    proximity_gdf.to_file(out_path, driver="GPKG")
+    summary.round(2).to_csv(summary_out_path, index=False)
@@ -0,0 +1,403 @@
+"""
+Local HTTP/JSON service answering filtered aggregate queries over the per-LSOA counts, without re-running
+stats_analysis.py or opening combined_counts.gpkg.
+
+The monthly stop & search partials, LFR deployments per LSOA and month, IMD deciles, boroughs and
+LSOA centroids are loaded into arrays once. Queries filter and sum those arrays, and responses are kept
+in an LRU cache. Geometry is only read, once, for the first GeoJSON response.
+
+Usage (from the scripts folder, after lsoa_agg.py):
+    python query_service.py --port 8765
+    curl "http://127.0.0.1:8765/summary?start=2025-01&end=2025-06&quantile=0.85"
+    curl "http://127.0.0.1:8765/lsoas?borough=Westminster&decile=1,2&format=geojson"
+
+Endpoints:
+    /summary    totals, shares of the unfiltered-by-quantile selection, and breakdowns by IMD decile and borough
+    /lsoas      one row per selected LSOA (format=json) or a GeoJSON FeatureCollection (format=geojson)
+    /meta       months, boroughs and cache statistics
+
+Filters (all optional, on /summary and /lsoas):
+    start, end      months as YYYY-MM (inclusive), default every month
+    borough         borough names, comma separated or repeated
+    decile          IMD deciles, comma separated or repeated
+    bbox            minx,miny,maxx,maxy in longitude/latitude, matched on LSOA centroids
+    quantile        keep LSOAs at or above this quantile of stop & search over the period, e.g. 0.85 for the top 15%
+"""
+
+import argparse
+import functools
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+from lsoa_agg import load_imd, lsoa_codes_key
+from lsoa_counts import count_lsoa_ids
+from lsoa_index import LsoaIndex
+from manifest import FileManifest
+
+IMD_DECILE = "Index of Multiple Deprivation (IMD) Decile"
+
+
+@dataclass(frozen=True)
+class Query:
+    """
+    A normalised set of filters, hashable so it can key the result cache.
+    """
+
+    start: str | None = None
+    end: str | None = None
+    boroughs: tuple[str, ...] = ()
+    deciles: tuple[int, ...] = ()
+    bbox: tuple[float, float, float, float] | None = None
+    quantile: float | None = None
+
+    @classmethod
+    def from_params(cls, params: dict[str, list[str]]) -> "Query":
+        """
+        Parse URL query parameters, so that equivalent queries (reordered lists, repeated keys) compare equal.
+
+        Args:
+            params (dict[str, list[str]]): Parameters as returned by `parse_qs`
+
+        Returns:
+            Query: The filters
+
+        Raises:
+            ValueError: If a parameter is malformed
+        """
+        def values(key: str) -> list[str]:
+            return [v.strip() for raw in params.get(key, []) for v in raw.split(",") if v.strip()]
+
+        def month(key: str) -> str | None:
+            found = values(key)
+            if not found:
+                return None
+            try:
+                return pd.Period(found[-1], freq="M").strftime("%Y-%m")
+            except ValueError:
+                raise ValueError(f"{key} must be a month as YYYY-MM, got {found[-1]!r}") from None
+
+        try:
+            deciles = tuple(sorted({int(v) for v in values("decile")}))
+            bbox = tuple(float(v) for v in values("bbox")) or None
+            quantile = float(values("quantile")[-1]) if values("quantile") else None
+        except ValueError:
+            raise ValueError("decile must be integers, and bbox and quantile numbers") from None
+
+        if bbox is not None and len(bbox) != 4:
+            raise ValueError("bbox must be minx,miny,maxx,maxy")
+        if quantile is not None and not 0 <= quantile <= 1:
+            raise ValueError("quantile must be between 0 and 1")
+
+        return cls(
+            start=month("start"),
+            end=month("end"),
+            boroughs=tuple(sorted(set(values("borough")))),
+            deciles=deciles,
+            bbox=bbox,
+            quantile=quantile,
+        )
+
+
+@dataclass
+class LsoaAggregates:
+    """
+    Per-LSOA arrays in LsoaIndex row order: attributes, centroids, and stop & search and LFR counts per month.
+
+    Counts are held as cumulative sums over the month axis, so a period total is one subtraction per LSOA.
+    """
+
+    codes: np.ndarray
+    boroughs: np.ndarray
+    deciles: np.ndarray
+    lon: np.ndarray
+    lat: np.ndarray
+    months: np.ndarray
+    stop_search_cum: np.ndarray
+    lfr_cum: np.ndarray
+    boundaries_path: Path
+
+    @classmethod
+    @instrumented
+    def load(
+        cls,
+        lsoa_cache_dir: Path,
+        partials_dir: Path,
+        lfr_path: Path,
+        imd_path: Path,
+        borough_column: str = "LAD11NM",
+    ) -> "LsoaAggregates":
+        """
+        Load the outputs of lsoa_agg.py: the cached LSOA boundaries and the monthly stop & search partials,
+        plus the LFR deployments (counted per LSOA and month here) and the IMD deciles.
+
+        Args:
+            lsoa_cache_dir (Path): LsoaIndex cache folder
+            partials_dir (Path): Folder of the monthly stop & search partials
+            lfr_path (Path): LFR deployments GeoParquet
+            imd_path (Path): IMD parquet written by clean_imd.py
+            borough_column (str): Boundary column holding the borough name
+
+        Returns:
+            LsoaAggregates: The arrays
+
+        Raises:
+            ValueError: If the partials were counted against a different set of LSOAs
+        """
+        boundaries_path = lsoa_cache_dir / "boundaries.parquet"
+        index = LsoaIndex(gpd.read_parquet(boundaries_path, columns=["LSOA11CD", borough_column, "geometry"]))
+        codes = index.codes
+
+        if FileManifest(partials_dir / "manifest.json").changed("lsoa_codes", lsoa_codes_key(codes)):
+            raise ValueError(f"The partials in {partials_dir} were counted against other LSOAs; re-run lsoa_agg.py")
+        with np.load(partials_dir / "monthly_partials.npz") as stored:
+            partials = {month: stored[month] for month in stored.files}
+
+        lfr_gdf = gpd.read_parquet(lfr_path, columns=["Date", "geometry"])
+        lfr_months = pd.to_datetime(lfr_gdf["Date"], format="%d/%m/%y", errors="coerce").dt.strftime("%Y-%m")
+
+        months = np.array(sorted(set(partials) | set(lfr_months.dropna())))
+        stop_search = np.zeros((len(codes), len(months)), dtype=np.int64)
+        for month, counts in partials.items():
+            stop_search[:, np.searchsorted(months, month)] = counts
+
+        lfr = count_lsoa_ids(
+            index.assign_ids(lfr_gdf.geometry),
+            len(codes),
+            pd.Categorical(lfr_months, categories=months),
+        )
+
+        imd = load_imd(imd_path, codes).set_index("LSOA11CD")[IMD_DECILE]
+        centroids = index.boundaries.geometry.representative_point()
+
+        # a leading column of zeros, so the total for months i..j is cum[:, j + 1] - cum[:, i]
+        def cumulative(counts: np.ndarray) -> np.ndarray:
+            return np.concatenate([np.zeros((len(codes), 1), dtype=np.int64), np.cumsum(counts, axis=1)], axis=1)
+
+        return cls(
+            codes=codes,
+            boroughs=index.boundaries[borough_column].to_numpy(),
+            deciles=imd.reindex(codes).to_numpy(dtype="float64"),
+            lon=centroids.x.to_numpy(),
+            lat=centroids.y.to_numpy(),
+            months=months,
+            stop_search_cum=cumulative(stop_search),
+            lfr_cum=cumulative(lfr),
+            boundaries_path=boundaries_path,
+        )
+
+    def period(self, start: str | None, end: str | None) -> tuple[np.ndarray, np.ndarray, list[str]]:
+        """
+        Stop & search and LFR totals per LSOA for the months between `start` and `end` (inclusive).
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, list[str]]: Stop & search counts, LFR counts, and the months covered
+        """
+        first = np.searchsorted(self.months, start, side="left") if start else 0
+        last = np.searchsorted(self.months, end, side="right") if end else len(self.months)
+        if first >= last:
+            raise ValueError(f"No data between {start or 'the start'} and {end or 'the end'}")
+
+        stop_search = self.stop_search_cum[:, last] - self.stop_search_cum[:, first]
+        lfr = self.lfr_cum[:, last] - self.lfr_cum[:, first]
+
+        return stop_search, lfr, self.months[first:last].tolist()
+
+
+class QueryService:
+    """
+    Answers queries over `LsoaAggregates`, caching encoded responses by query in an LRU cache.
+    """
+
+    def __init__(self, aggregates: LsoaAggregates, cache_size: int = 1024):
+        self.aggregates = aggregates
+        self.summary = functools.lru_cache(maxsize=cache_size)(self._summary)
+        self.lsoas = functools.lru_cache(maxsize=cache_size)(self._lsoas)
+        self._geometry = None
+        self._geometry_lock = threading.Lock()
+
+    def select(self, query: Query) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, list[str]]:
+        """
+        Apply the filters of a query.
+
+        Args:
+            query (Query): Filters
+
+        Returns:
+            tuple: Mask of the LSOAs matching every filter but the quantile, mask of those also at or above it,
+            stop & search and LFR counts per LSOA for the period, and the months covered
+        """
+        data = self.aggregates
+        stop_search, lfr, months = data.period(query.start, query.end)
+
+        base = np.ones(len(data.codes), dtype=bool)
+        if query.boroughs:
+            unknown = set(query.boroughs) - set(data.boroughs)
+            if unknown:
+                raise ValueError(f"Unknown borough: {', '.join(sorted(unknown))}")
+            base &= np.isin(data.boroughs, query.boroughs)
+        if query.deciles:
+            base &= np.isin(data.deciles, query.deciles)
+        if query.bbox is not None:
+            minx, miny, maxx, maxy = query.bbox
+            base &= (data.lon >= minx) & (data.lon <= maxx) & (data.lat >= miny) & (data.lat <= maxy)
+
+        selected = base.copy()
+        if query.quantile is not None and base.any():
+            # same interpolation as Concentration.at_quantiles, so results match the stats tables
+            threshold = np.percentile(stop_search[base], query.quantile * 100.0)
+            selected &= stop_search >= threshold
+
+        return base, selected, stop_search, lfr, months
+
+    def _summary(self, query: Query) -> bytes:
+        data = self.aggregates
+        base, selected, stop_search, lfr, months = self.select(query)
+
+        def totals(mask: np.ndarray) -> dict:
+            return {"lsoas": int(mask.sum()), "stop_search": int(stop_search[mask].sum()), "lfr": int(lfr[mask].sum())}
+
+        def breakdown(groups: np.ndarray, name: str) -> list[dict]:
+            frame = pd.DataFrame({name: groups[selected], "lsoas": 1, "stop_search": stop_search[selected], "lfr": lfr[selected]})
+            summed = frame.dropna(subset=[name]).groupby(name, sort=True).sum().reset_index()
+            if name == "decile":
+                summed["decile"] = summed["decile"].astype(int)
+
+            return summed.to_dict(orient="records")
+
+        result = totals(selected)
+        base_totals = totals(base)
+        # share of the LSOAs matching the other filters, e.g. the LFR share in the top 15% stop & search LSOAs
+        result["pct_of_base"] = {
+            key: (100 * result[key] / base_totals[key] if base_totals[key] else None) for key in ("lsoas", "stop_search", "lfr")
+        }
+        if query.quantile is not None and base.any():
+            result["threshold"] = float(np.percentile(stop_search[base], query.quantile * 100.0))
+
+        response = {
+            "query": asdict(query),
+            "months": months,
+            **result,
+            "base": base_totals,
+            "by_decile": breakdown(data.deciles, "decile"),
+            "by_borough": breakdown(data.boroughs, "borough"),
+        }
+
+        return json.dumps(response, default=int).encode("utf-8")
+
+    def _lsoas(self, query: Query, geojson: bool = False) -> bytes:
+        data = self.aggregates
+        _, selected, stop_search, lfr, _ = self.select(query)
+
+        rows = pd.DataFrame({
+            "LSOA11CD": data.codes[selected],
+            "borough": data.boroughs[selected],
+            "decile": pd.array(data.deciles[selected]).astype("Int64"),
+            "stop_search": stop_search[selected],
+            "lfr": lfr[selected],
+        })
+
+        if geojson:
+            geometry = self.geometry().reindex(rows["LSOA11CD"]).to_numpy()
+            return gpd.GeoDataFrame(rows, geometry=geometry, crs="EPSG:4326").to_json(drop_id=True).encode("utf-8")
+
+        records = json.loads(rows.to_json(orient="records"))
+        return json.dumps({"query": asdict(query), "lsoas": records}).encode("utf-8")
+
+    def geometry(self) -> gpd.GeoSeries:
+        """
+        LSOA polygons by code, read from the boundary cache on first use.
+        """
+        with self._geometry_lock:
+            if self._geometry is None:
+                boundaries = gpd.read_parquet(self.aggregates.boundaries_path, columns=["LSOA11CD", "geometry"])
+                self._geometry = boundaries.set_index("LSOA11CD").geometry
+
+        return self._geometry
+
+    def meta(self) -> bytes:
+        data = self.aggregates
+        caches = {name: cache.cache_info()._asdict() for name, cache in (("summary", self.summary), ("lsoas", self.lsoas))}
+
+        return json.dumps({
+            "lsoas": len(data.codes),
+            "months": data.months.tolist(),
+            "boroughs": sorted(set(data.boroughs.tolist())),
+            "cache": caches,
+        }).encode("utf-8")
+
+
+def make_handler(service: QueryService) -> type[BaseHTTPRequestHandler]:
+    """
+    Request handler class bound to a service.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            started = time.perf_counter()
+            url = urlsplit(self.path)
+            params = parse_qs(url.query)
+            content_type = "application/json"
+
+            try:
+                if url.path == "/summary":
+                    status, body = 200, service.summary(Query.from_params(params))
+                elif url.path == "/lsoas":
+                    geojson = params.get("format", ["json"])[-1] == "geojson"
+                    status, body = 200, service.lsoas(Query.from_params(params), geojson)
+                    if geojson:
+                        content_type = "application/geo+json"
+                elif url.path == "/meta":
+                    status, body = 200, service.meta()
+                else:
+                    status, body = 404, json.dumps({"error": f"Unknown endpoint {url.path}"}).encode("utf-8")
+            except ValueError as e:
+                status, body = 400, json.dumps({"error": str(e)}).encode("utf-8")
+
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+            print(f"{self.command} {self.path} {status} {(time.perf_counter() - started) * 1000:.1f}ms")
+
+        def log_message(self, format: str, *args) -> None:
+            # requests are logged with their timing in do_GET
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-size", type=int, default=1024, help="responses kept per endpoint")
+    parser.add_argument("--lsoa-cache", type=Path, default=Path("../data/processed/lsoa_index"))
+    parser.add_argument("--partials", type=Path, default=Path("../data/processed/lsoa_monthly_partials"))
+    parser.add_argument("--lfr", type=Path, default=Path("../data/processed/lfr_deployments.parquet"))
+    parser.add_argument("--imd", type=Path, default=Path("../data/processed/imd_2019.parquet"))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    aggregates = LsoaAggregates.load(args.lsoa_cache, args.partials, args.lfr, args.imd)
+    service = QueryService(aggregates, args.cache_size)
+    print(f"Loaded {len(aggregates.codes)} LSOAs x {len(aggregates.months)} months in {time.perf_counter() - started:.2f}s")
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
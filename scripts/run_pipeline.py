@@ -0,0 +1,445 @@
+"""
+Run the processing scripts as a DAG of stages, skipping stages whose inputs and code have not changed.
+
+Usage (from any directory):
+    python scripts/run_pipeline.py
+    python scripts/run_pipeline.py --force lsoa_agg --workers 2
+    python scripts/run_pipeline.py --force lsoa_agg --trace --profile lsoa_agg:count_stop_search_months
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from manifest import file_hash
+
+ROOT = Path(__file__).resolve().parent.parent
+SCRIPTS = ROOT / "scripts"
+STATE_PATH = ROOT / "data" / "processed" / ".pipeline_state.json"
+REPORT_DIR = ROOT / "data" / "processed" / "run_reports"
+
+
+@dataclass
+class Stage:
+    """
+    One processing script, with the files it reads and writes (globs relative to the repo root).
+
+    `code` lists the script and the local modules it imports, so editing any of them re-runs the stage.
+    """
+
+    name: str
+    script: str
+    inputs: list[str]
+    outputs: list[str]
+    code: list[str]
+    depends_on: list[str] = field(default_factory=list)
+    params: dict = field(default_factory=dict)
+
+
+STAGES = [
+    Stage(
+        name="clean_imd",
+        script="clean_imd.py",
+        inputs=["data/raw/File_1_-_IMD2019_Index_of_Multiple_Deprivation.xlsx"],
+        outputs=["data/processed/imd_2019.parquet"],
+        code=["clean_imd.py", "manifest.py"],
+    ),
+    Stage(
+        name="clean_lfr",
+        script="clean_lfr.py",
+        inputs=[
+            "data/raw/live-facial-recognition---deployment-record-2025-to-date.pdf",
+            "data/raw/london_gazetteer.csv",
+        ],
+        outputs=["data/processed/lfr_deployments.parquet", "data/processed/lfr_deployments.gpkg"],
+        code=["clean_lfr.py", "geocoding.py", "points.py", "instrumentation.py"],
+    ),
+    Stage(
+        name="clean_stop_search",
+        script="clean_s&s_agg.py",
+        inputs=[
+            "data/raw/*-metropolitan-stop-and-search.csv",
+            "data/raw/stop_search_jan_nov_2023/*-metropolitan-stop-and-search.csv",
+        ],
+        outputs=["data/processed/stop_search"],
+        code=[
+            "clean_s&s_agg.py", "geo_store.py", "points.py", "manifest.py", "lsoa_index.py", "lsoa_counts.py",
+            "instrumentation.py",
+        ],
+    ),
+    Stage(
+        name="lsoa_agg",
+        script="lsoa_agg.py",
+        inputs=[
+            "data/processed/stop_search",
+            "data/processed/lfr_deployments.parquet",
+            "data/processed/imd_2019.parquet",
+            "data/raw/statistical-gis-boundaries-london.zip",
+        ],
+        outputs=["data/processed/combined_counts.gpkg"],
+        code=["lsoa_agg.py", "geo_store.py", "lsoa_index.py", "lsoa_counts.py", "manifest.py", "instrumentation.py"],
+        depends_on=["clean_imd", "clean_lfr", "clean_stop_search"],
+    ),
+    Stage(
+        name="proximity",
+        script="proximity.py",
+        inputs=["data/processed/stop_search", "data/processed/lfr_deployments.parquet"],
+        outputs=["data/processed/lfr_proximity.gpkg", "outputs/tables/lfr_proximity_summary.csv"],
+        code=["proximity.py", "geo_store.py", "instrumentation.py"],
+        depends_on=["clean_lfr", "clean_stop_search"],
+    ),
+    Stage(
+        name="spatiotemporal",
+        script="spatiotemporal.py",
+        inputs=["data/processed/stop_search", "data/processed/lfr_deployments.parquet"],
+        outputs=[
+            "data/processed/lfr_spatiotemporal.gpkg",
+            "data/processed/lfr_stop_search_matches.parquet",
+            "outputs/tables/lfr_spatiotemporal_summary.csv",
+        ],
+        code=["spatiotemporal.py", "proximity.py", "geo_store.py", "instrumentation.py"],
+        depends_on=["clean_lfr", "clean_stop_search"],
+    ),
+    Stage(
+        name="density_grid",
+        script="density_grid.py",
+        inputs=["data/processed/stop_search", "data/processed/lfr_deployments.parquet"],
+        outputs=["data/processed/density/*.tif", "data/processed/density/hexbins_*.gpkg"],
+        code=["density_grid.py", "proximity.py", "geo_store.py", "points.py", "instrumentation.py"],
+        depends_on=["clean_lfr", "clean_stop_search"],
+    ),
+    Stage(
+        name="spatial_autocorrelation",
+        script="spatial_autocorrelation.py",
+        inputs=["data/processed/combined_counts.gpkg", "data/raw/statistical-gis-boundaries-london.zip"],
+        outputs=["data/processed/lisa_hotspots.gpkg", "outputs/tables/morans_i.csv"],
+        code=["spatial_autocorrelation.py", "lsoa_index.py", "manifest.py", "proximity.py", "instrumentation.py"],
+        depends_on=["lsoa_agg"],
+    ),
+    Stage(
+        name="stats_analysis",
+        script="stats_analysis.py",
+        inputs=["data/processed/combined_counts.gpkg"],
+        outputs=[
+            "outputs/tables/summary_stats.csv",
+            "outputs/tables/lfr_stop_search_concentration.csv",
+            "outputs/tables/lfr_by_imd_decile.csv",
+            "outputs/tables/lfr_by_stop_search_change.csv",
+            "outputs/tables/summary_stats_significance.csv",
+        ],
+        code=["stats_analysis.py", "lfr_stats.py", "lfr_significance.py", "instrumentation.py"],
+        depends_on=["lsoa_agg"],
+    ),
+    Stage(
+        name="vector_tiles",
+        script="vector_tiles.py",
+        inputs=["data/processed/combined_counts.gpkg", "data/processed/lfr_deployments.parquet"],
+        outputs=["outputs/tiles/lfr_stop_search.mbtiles"],
+        code=["vector_tiles.py", "instrumentation.py"],
+        depends_on=["lsoa_agg", "clean_lfr"],
+    ),
+]
+
+
+class InputHasher:
+    """
+    Content hashes of input files, reusing the stored hash while a file's size and mtime are unchanged.
+    """
+
+    def __init__(self, known: dict):
+        self.known = known
+
+    def file(self, path: Path) -> str:
+        stat = path.stat()
+        key = str(path.relative_to(ROOT))
+        entry = self.known.get(key)
+
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            entry = [stat.st_size, stat.st_mtime_ns, file_hash(path)]
+            self.known[key] = entry
+
+        return entry[2]
+
+    def pattern(self, pattern: str) -> list[tuple[str, str]]:
+        """
+        Hash every file matched by a glob; folders are hashed file by file.
+        """
+        hashes = []
+
+        for match in sorted(ROOT.glob(pattern)):
+            files = sorted(p for p in match.rglob("*") if p.is_file()) if match.is_dir() else [match]
+            hashes.extend((str(f.relative_to(ROOT)), self.file(f)) for f in files)
+
+        return hashes
+
+
+def stage_key(stage: Stage, hasher: InputHasher) -> str:
+    """
+    Hash a stage's code, parameters and inputs into the key used to decide whether it is up to date.
+
+    Args:
+        stage (Stage): Stage to hash
+        hasher (InputHasher): Hasher for input files
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(stage.params, sort_keys=True).encode())
+
+    for module in stage.code:
+        digest.update(module.encode())
+        digest.update(hasher.file(SCRIPTS / module).encode())
+
+    for pattern in stage.inputs:
+        for path, file_digest in hasher.pattern(pattern):
+            digest.update(f"{path}:{file_digest}".encode())
+
+    return digest.hexdigest()
+
+
+def stage_env(stage: Stage, trace: bool = False, profile: dict[str, str] | None = None, profiler: str = "cprofile") -> dict:
+    """
+    Environment for a stage's script: where instrumented scripts write their run report, and
+    whether they trace or profile (see instrumentation.py).
+
+    Args:
+        stage (Stage): Stage to run
+        trace (bool): Write a Chrome trace alongside the run report
+        profile (dict[str, str] | None): Span to profile per stage name
+        profiler (str): "cprofile" or "sample"
+
+    Returns:
+        dict: Environment variables
+    """
+    env = dict(os.environ, PIPELINE_REPORT_DIR=str(REPORT_DIR))
+
+    if trace:
+        env["PIPELINE_TRACE"] = "1"
+    if profile and stage.name in profile:
+        env["PIPELINE_PROFILE"] = profile[stage.name]
+        env["PIPELINE_PROFILER"] = profiler
+
+    return env
+
+
+def read_run_report(stage: Stage) -> dict | None:
+    """
+    The run report the stage's script wrote, None for scripts that are not instrumented.
+    """
+    path = REPORT_DIR / f"{stage.name}.json"
+
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else None
+
+
+def run_stage(stage: Stage, env: dict | None = None) -> tuple[bool, str]:
+    """
+    Run a stage's script from the scripts folder, as the README describes.
+
+    Args:
+        stage (Stage): Stage to run
+        env (dict | None): Environment for the script, defaults to this process's
+
+    Returns:
+        tuple[bool, str]: Whether it succeeded, and its combined output
+    """
+    result = subprocess.run(
+        [sys.executable, stage.script],
+        cwd=SCRIPTS,
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+
+    return result.returncode == 0, result.stdout + result.stderr
+
+
+def run_pipeline(
+    stages: list[Stage],
+    force: set[str],
+    workers: int,
+    dry_run: bool = False,
+    trace: bool = False,
+    profile: dict[str, str] | None = None,
+    profiler: str = "cprofile",
+) -> dict[str, dict]:
+    """
+    Run stages in dependency order, in parallel where possible, skipping up-to-date stages.
+
+    Keys are computed when a stage becomes ready, after its upstream stages have written their outputs.
+
+    Args:
+        stages (list[Stage]): Stages to run
+        force (set[str]): Stage names to run even if up to date
+        workers (int): Maximum number of stages running at once
+        dry_run (bool): Report which stages would run without running them
+        trace (bool): Have instrumented scripts write Chrome traces
+        profile (dict[str, str] | None): Span to profile per stage name
+        profiler (str): "cprofile" or "sample"
+
+    Returns:
+        dict[str, dict]: Status, timing and, for instrumented scripts, CPU time and peak memory per stage
+    """
+    state = json.loads(STATE_PATH.read_text(encoding="utf-8")) if STATE_PATH.exists() else {}
+    stage_keys = state.setdefault("stages", {})
+    hasher = InputHasher(state.setdefault("files", {}))
+
+    by_name = {stage.name: stage for stage in stages}
+    report = {}
+    running = {}
+    would_run = set()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(report) < len(stages):
+            for stage in stages:
+                if stage.name in report or stage.name in running:
+                    continue
+
+                upstream = [report.get(dep, {}).get("status") for dep in stage.depends_on if dep in by_name]
+                if any(status is None for status in upstream):
+                    continue
+
+                if any(status in ("failed", "skipped") for status in upstream):
+                    report[stage.name] = {"status": "skipped", "seconds": 0.0}
+                    continue
+
+                key = stage_key(stage, hasher)
+                outputs_exist = all(any(ROOT.glob(pattern)) for pattern in stage.outputs)
+                up_to_date = stage_keys.get(stage.name) == key and outputs_exist
+
+                # in a dry run upstream outputs are not rewritten, so anything downstream of a stage that would run would too
+                if dry_run and would_run & set(stage.depends_on):
+                    up_to_date = False
+
+                if up_to_date and stage.name not in force:
+                    report[stage.name] = {"status": "cached", "seconds": 0.0}
+                elif dry_run:
+                    report[stage.name] = {"status": "would run", "seconds": 0.0}
+                    would_run.add(stage.name)
+                else:
+                    print(f"[{stage.name}] running {stage.script}")
+                    # a stale report from an earlier run must not be read back as this run's
+                    (REPORT_DIR / f"{stage.name}.json").unlink(missing_ok=True)
+                    env = stage_env(stage, trace, profile, profiler)
+                    running[stage.name] = (executor.submit(run_stage, stage, env), time.perf_counter())
+
+            if not running:
+                continue
+
+            done, _ = wait([future for future, _ in running.values()], return_when=FIRST_COMPLETED)
+            for name, (future, started) in list(running.items()):
+                if future not in done:
+                    continue
+
+                succeeded, output = future.result()
+                seconds = time.perf_counter() - started
+                del running[name]
+
+                print(f"[{name}] {'finished' if succeeded else 'FAILED'} in {seconds:.1f}s")
+                if output.strip():
+                    print("\n".join(f"[{name}]   {line}" for line in output.rstrip().splitlines()))
+
+                report[name] = {"status": "ran" if succeeded else "failed", "seconds": seconds}
+                run_report = read_run_report(by_name[name])
+                if run_report is not None:
+                    report[name].update(cpu_s=run_report["cpu_s"], peak_rss_mb=run_report["peak_rss_mb"])
+                if succeeded:
+                    # hash again so the key reflects the inputs the stage actually read
+                    stage_keys[name] = stage_key(by_name[name], hasher)
+                else:
+                    stage_keys.pop(name, None)
+
+    if not dry_run:
+        STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        STATE_PATH.write_text(json.dumps(state, indent=2), encoding="utf-8")
+
+    return report
+
+
+def write_reports(report: dict[str, dict], trace: bool = False) -> None:
+    """
+    Write the pipeline report and, when tracing, merge the stages' Chrome traces into one.
+
+    Stage traces carry wall-clock timestamps and their own process ids, so stages that ran in
+    parallel show up side by side in the merged trace.
+
+    Args:
+        report (dict[str, dict]): Report returned by `run_pipeline`
+        trace (bool): Merge the traces of the stages that ran
+    """
+    REPORT_DIR.mkdir(parents=True, exist_ok=True)
+    (REPORT_DIR / "pipeline.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    if not trace:
+        return
+
+    events = []
+    for name, entry in report.items():
+        path = REPORT_DIR / f"{name}.trace.json"
+        if entry["status"] in ("ran", "failed") and path.exists():
+            events.extend(json.loads(path.read_text(encoding="utf-8"))["traceEvents"])
+
+    merged = {"traceEvents": events, "displayTimeUnit": "ms"}
+    (REPORT_DIR / "pipeline.trace.json").write_text(json.dumps(merged), encoding="utf-8")
+    print(f"Trace of {len(events)} events written to {REPORT_DIR / 'pipeline.trace.json'}")
+
+
+def print_report(report: dict[str, dict]) -> None:
+    """
+    Print the per-stage status and timing table, with CPU time and peak memory for instrumented scripts.
+    """
+    def optional(value: float | None, width: int) -> str:
+        return f"{value:>{width}.1f}" if value is not None else f"{'-':>{width}}"
+
+    print(f"\n{'stage':<24}{'status':<12}{'seconds':>10}{'cpu_s':>10}{'peak_mb':>10}")
+    for name, entry in report.items():
+        cpu, peak = optional(entry.get("cpu_s"), 10), optional(entry.get("peak_rss_mb"), 10)
+        print(f"{name:<24}{entry['status']:<12}{entry['seconds']:>10.1f}{cpu}{peak}")
+
+    cached = sum(entry["status"] == "cached" for entry in report.values())
+    total = sum(entry["seconds"] for entry in report.values())
+    print(f"{cached} of {len(report)} stages up to date; {total:.1f}s spent running stages")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--force", nargs="*", default=[], help="stages to run even if up to date (no names: all)")
+    parser.add_argument("--workers", type=int, default=3, help="maximum number of stages running at once")
+    parser.add_argument("--dry-run", action="store_true", help="show which stages would run")
+    parser.add_argument("--trace", action="store_true", help="write Chrome traces of the stages that run")
+    parser.add_argument(
+        "--profile",
+        nargs="*",
+        default=[],
+        metavar="STAGE[:SPAN]",
+        help="profile a stage, or one function within it (e.g. lsoa_agg:count_stop_search_months)",
+    )
+    parser.add_argument("--profiler", choices=["cprofile", "sample"], default="cprofile", help="profiler to use")
+    args = parser.parse_args()
+
+    known = {stage.name for stage in STAGES}
+    profile = {}
+    for spec in args.profile:
+        stage_name, _, span_name = spec.partition(":")
+        if stage_name not in known:
+            parser.error(f"unknown stage to profile: {stage_name}")
+        # without a span the whole script is profiled through its root span, named after the stage
+        profile[stage_name] = span_name or stage_name
+
+    force = set(args.force) if args.force else set()
+    if "--force" in sys.argv and not args.force:
+        force = {stage.name for stage in STAGES}
+
+    report = run_pipeline(STAGES, force, args.workers, args.dry_run, args.trace, profile, args.profiler)
+    print_report(report)
+    if not args.dry_run:
+        write_reports(report, args.trace)
+
+    sys.exit(1 if any(entry["status"] == "failed" for entry in report.values()) else 0)
@@ -0,0 +1,313 @@
+"""
+Global Moran's I and local (LISA) hotspot classes for the per-LSOA counts, on sparse spatial weights.
+"""
+
+import json
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from lsoa_index import LsoaIndex
+from manifest import file_hash
+from proximity import BRITISH_NATIONAL_GRID
+
+VARIABLES = ["stop_search_count_2025", "abs_difference", "lfr_count"]
+LISA_CLASSES = {1: "High-High", 2: "Low-High", 3: "Low-Low", 4: "High-Low"}
+
+
+def contiguity_pairs(geometries: np.ndarray, method: str = "queen") -> tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs of neighbouring polygons: sharing any boundary point (queen) or a boundary segment (rook).
+
+    Args:
+        geometries (np.ndarray): Polygons
+        method (str): "queen" or "rook"
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Row and column index of each neighbouring pair (both directions)
+    """
+    left, right = shapely.STRtree(geometries).query(geometries, predicate="intersects")
+    keep = left != right
+    left, right = left[keep], right[keep]
+
+    if method == "rook":
+        shared = shapely.intersection(shapely.boundary(geometries[left]), shapely.boundary(geometries[right]))
+        keep = shapely.length(shared) > 0
+        left, right = left[keep], right[keep]
+    elif method != "queen":
+        raise ValueError(f"Unknown contiguity method: {method}")
+
+    return left, right
+
+
+def knn_pairs(geometries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Each polygon's `k` nearest neighbours by centroid distance (not symmetric).
+    """
+    centroids = shapely.get_coordinates(shapely.centroid(geometries))
+    _, neighbours = cKDTree(centroids).query(centroids, k=k + 1)
+
+    left = np.repeat(np.arange(len(geometries)), k)
+    right = neighbours[:, 1:].ravel()
+
+    return left, right
+
+
+def build_weights(boundaries: gpd.GeoDataFrame, method: str = "queen", k: int = 8) -> sparse.csr_matrix:
+    """
+    Row-standardised spatial weights as a sparse matrix, in the row order of `boundaries`.
+
+    Args:
+        boundaries (GeoDataFrame): Polygons
+        method (str): "queen", "rook" or "knn"
+        k (int): Neighbours per polygon for "knn"
+
+    Returns:
+        sparse.csr_matrix: (n, n) weights; rows of polygons without neighbours are all zero
+    """
+    geometries = boundaries.to_crs(BRITISH_NATIONAL_GRID).geometry.values
+    n = len(geometries)
+
+    if method == "knn":
+        left, right = knn_pairs(geometries, k)
+    else:
+        left, right = contiguity_pairs(geometries, method)
+
+    binary = sparse.csr_matrix((np.ones(len(left)), (left, right)), shape=(n, n))
+    binary.data[:] = 1
+    cardinality = np.asarray(binary.sum(axis=1)).ravel()
+
+    with np.errstate(divide="ignore"):
+        scale = np.where(cardinality > 0, 1 / cardinality, 0)
+
+    return sparse.diags(scale) @ binary
+
+
+def load_weights(
+    boundary_path: Path,
+    boundaries: gpd.GeoDataFrame,
+    cache_dir: Path,
+    method: str = "queen",
+    k: int = 8,
+    code_column: str = "LSOA11CD",
+) -> sparse.csr_matrix:
+    """
+    Load the weights from the cache, building them only if the boundary file has changed.
+
+    Args:
+        boundary_path (Path): Raw boundary file the polygons come from, whose content hash keys the cache
+        boundaries (GeoDataFrame): The polygons, in the row order the weights should follow
+        cache_dir (Path): Folder holding cached weights
+        method (str): "queen", "rook" or "knn"
+        k (int): Neighbours per polygon for "knn"
+        code_column (str): Column holding the LSOA code
+
+    Returns:
+        sparse.csr_matrix: Row-standardised weights
+    """
+    name = method if method != "knn" else f"knn{k}"
+    weights_path = cache_dir / f"weights_{file_hash(boundary_path)[:16]}_{name}.npz"
+    codes_path = weights_path.with_suffix(".json")
+    codes = boundaries[code_column].tolist()
+
+    if weights_path.exists() and codes_path.exists():
+        if json.loads(codes_path.read_text(encoding="utf-8")) == codes:
+            return sparse.load_npz(weights_path).tocsr()
+
+    weights = build_weights(boundaries, method, k)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for stale in cache_dir.glob(f"weights_*_{name}.*"):
+        stale.unlink()
+    sparse.save_npz(weights_path, weights)
+    codes_path.write_text(json.dumps(codes), encoding="utf-8")
+
+    return weights
+
+
+def _pseudo_p(observed: np.ndarray, permuted: np.ndarray, axis: int) -> np.ndarray:
+    """
+    Folded pseudo p-value: the share of permutations at least as extreme, on the observed side of the permutation distribution.
+    """
+    n_permutations = permuted.shape[axis]
+    larger = (permuted >= np.expand_dims(observed, axis)).sum(axis=axis)
+    larger = np.minimum(larger, n_permutations - larger)
+
+    return (larger + 1) / (n_permutations + 1)
+
+
+def morans_i(values: np.ndarray, weights: sparse.csr_matrix, permutations: int = 999, seed: int = 0, batch_size: int = 100) -> dict:
+    """
+    Global Moran's I with permutation inference; permutations are done in batches as one sparse-dense product each.
+
+    Args:
+        values (np.ndarray): Value per polygon
+        weights (sparse.csr_matrix): Row-standardised weights
+        permutations (int): Number of random permutations
+        seed (int): Seed for the permutations
+        batch_size (int): Permutations per sparse-dense product
+
+    Returns:
+        dict: I, its expectation under no autocorrelation, the permutation mean and sd, z-score and pseudo p-value
+    """
+    z = np.asarray(values, dtype="float64")
+    z = z - z.mean()
+    n = len(z)
+    s0 = weights.sum()
+
+    observed = n / s0 * (z @ (weights @ z)) / (z @ z)
+
+    rng = np.random.default_rng(seed)
+    permuted = []
+    for start in range(0, permutations, batch_size):
+        size = min(batch_size, permutations - start)
+        shuffled = rng.permuted(np.tile(z[:, None], (1, size)), axis=0)
+        permuted.append(n / s0 * (shuffled * (weights @ shuffled)).sum(axis=0) / (z @ z))
+    permuted = np.concatenate(permuted)
+
+    return {
+        "morans_i": observed,
+        "expected_i": -1 / (n - 1),
+        "mean_permuted_i": permuted.mean(),
+        "sd_permuted_i": permuted.std(),
+        "z_score": (observed - permuted.mean()) / permuted.std(),
+        "p_value": float(_pseudo_p(np.array(observed), permuted, axis=0)),
+    }
+
+
+def local_morans(
+    values: np.ndarray,
+    weights: sparse.csr_matrix,
+    permutations: int = 999,
+    alpha: float = 0.05,
+    seed: int = 0,
+    max_batch_elements: int = 5_000_000,
+) -> pd.DataFrame:
+    """
+    Local Moran's I (LISA) per polygon with conditional permutation inference and hotspot classes.
+
+    Each polygon's neighbours are replaced by random draws from the other polygons. One set of
+    draws is shared by every polygon (shifted past the polygon itself), so a polygon with k
+    neighbours just sums the first k columns of the draws: one gather per batch of polygons,
+    rather than a loop over polygons.
+
+    Args:
+        values (np.ndarray): Value per polygon
+        weights (sparse.csr_matrix): Row-standardised weights with equal weights per row (contiguity or knn)
+        permutations (int): Number of random permutations
+        alpha (float): Significance level for the hotspot classes
+        seed (int): Seed for the draws
+        max_batch_elements (int): Cap on polygons x permutations x neighbours gathered at once
+
+    Returns:
+        pd.DataFrame: local_i, p_value, quadrant (1 HH, 2 LH, 3 LL, 4 HL) and lisa_class per polygon
+    """
+    z = np.asarray(values, dtype="float64")
+    z = z - z.mean()
+    n = len(z)
+    # (n - 1) in the denominator, as in PySAL's Moran_Local, so values are comparable
+    m2 = (z @ z) / (n - 1)
+
+    lag = weights @ z
+    local_i = z * lag / m2
+    cardinality = np.diff(weights.indptr)
+
+    # draws without replacement from the n - 1 other polygons, shared by every polygon
+    rng = np.random.default_rng(seed)
+    max_k = int(cardinality.max()) if n else 0
+    draws = np.stack([rng.choice(n - 1, size=max_k, replace=False) for _ in range(permutations)]) if max_k else np.zeros((permutations, 0), dtype=np.int64)
+
+    larger = np.zeros(n, dtype=np.int64)
+    for k in np.unique(cardinality[cardinality > 0]):
+        members = np.flatnonzero(cardinality == k)
+        step = max(1, max_batch_elements // (permutations * k))
+
+        for start in range(0, len(members), step):
+            batch = members[start:start + step]
+            picked = draws[None, :, :k] + (draws[None, :, :k] >= batch[:, None, None])
+            permuted_lag = z[picked].mean(axis=2)
+            permuted_i = z[batch, None] * permuted_lag / m2
+            larger[batch] = (permuted_i >= local_i[batch, None]).sum(axis=1)
+
+    larger = np.minimum(larger, permutations - larger)
+    p_value = np.where(cardinality > 0, (larger + 1) / (permutations + 1), np.nan)
+
+    quadrant = np.select([(z > 0) & (lag > 0), (z <= 0) & (lag > 0), (z <= 0) & (lag <= 0), (z > 0) & (lag <= 0)], [1, 2, 3, 4])
+    significant = p_value <= alpha
+    lisa_class = np.where(significant, pd.Series(quadrant).map(LISA_CLASSES).to_numpy(), "Not significant")
+
+    return pd.DataFrame({"local_i": local_i, "p_value": p_value, "quadrant": quadrant, "lisa_class": lisa_class})
+
+
+def autocorrelation_tables(
+    counts_df: pd.DataFrame,
+    weights: sparse.csr_matrix,
+    variables: list[str] = VARIABLES,
+    permutations: int = 999,
+    seed: int = 0,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Global and local Moran's I for each variable.
+
+    Args:
+        counts_df (DataFrame): Per-LSOA values, in the row order of the weights
+        weights (sparse.csr_matrix): Row-standardised weights
+        variables (list[str]): Columns to analyse
+        permutations (int): Number of random permutations
+        seed (int): Seed for the permutations
+
+    Returns:
+        tuple[DataFrame, DataFrame]: One global row per variable; and `{variable}_local_i`,
+            `{variable}_p_value` and `{variable}_lisa` columns per LSOA
+    """
+    global_rows = []
+    local_columns = {}
+
+    for variable in variables:
+        values = counts_df[variable].fillna(0).to_numpy()
+
+        global_rows.append({"variable": variable, **morans_i(values, weights, permutations, seed)})
+
+        local = local_morans(values, weights, permutations, seed=seed)
+        local_columns[f"{variable}_local_i"] = local["local_i"].to_numpy()
+        local_columns[f"{variable}_p_value"] = local["p_value"].to_numpy()
+        local_columns[f"{variable}_lisa"] = local["lisa_class"].to_numpy()
+
+    return pd.DataFrame(global_rows), pd.DataFrame(local_columns, index=counts_df.index)
+
+
+if __name__ == "__main__":
+    in_path = Path("../data/processed/combined_counts.gpkg")
+
+    zip_path = Path("../data/raw/statistical-gis-boundaries-london.zip")
+    shp_inside_zip_path = "statistical-gis-boundaries-london/ESRI/LSOA_2011_London_gen_MHW.shp"
+
+    lsoa_cache_dir = Path("../data/processed/lsoa_index")
+    weights_cache_dir = Path("../data/processed/spatial_weights")
+
+    out_path = Path("../data/processed/lisa_hotspots.gpkg")
+    global_out_path = Path("../outputs/tables/morans_i.csv")
+
+
+    lsoa_index = LsoaIndex.load(zip_path, shp_inside_zip_path, lsoa_cache_dir)
+    weights = load_weights(zip_path, lsoa_index.boundaries, weights_cache_dir, method="queen")
+
+    # align the combined layer to the row order of the weights
+    counts_df = gpd.read_file(in_path, columns=["LSOA11CD", *VARIABLES], ignore_geometry=True)
+    counts_df = counts_df.set_index("LSOA11CD").reindex(lsoa_index.codes).reset_index()
+
+    global_df, local_df = autocorrelation_tables(counts_df, weights, seed=2025)
+
+    lisa_gdf = gpd.GeoDataFrame(
+        pd.concat([counts_df, local_df], axis=1),
+        geometry=lsoa_index.boundaries.geometry.values,
+        crs=lsoa_index.boundaries.crs,
+    )
+
+    lisa_gdf.to_file(out_path, driver="GPKG")
+    global_df.round(4).to_csv(global_out_path, index=False)
@@ -0,0 +1,404 @@
+"""
+Match stop & search events to LFR deployments in space and time: within a distance and within a time window of the deployment day.
+"""
+
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.spatial import cKDTree
+
+from geo_store import read_partitioned_geoparquet
+from proximity import to_bng_xy
+
+EPOCH = pd.Timestamp(0, tz="UTC")
+RADIUS_M = 500
+WINDOWS = {"same_day": pd.Timedelta(0), "within_1_day": pd.Timedelta(days=1), "within_3_days": pd.Timedelta(days=3)}
+# the same weekday 1 to 4 weeks either side, as a baseline for the deployment day
+CONTROL_OFFSETS = [pd.Timedelta(weeks=w) for w in (-4, -3, -2, -1, 1, 2, 3, 4)]
+
+
+def to_seconds(times: pd.Series) -> np.ndarray:
+    """
+    Convert datetimes to integer seconds since the epoch (UTC); naive datetimes are taken as UTC.
+
+    Args:
+        times (Series): Datetimes without missing values
+
+    Returns:
+        np.ndarray: int64 seconds
+    """
+    times = pd.to_datetime(pd.Series(times), utc=True)
+
+    return ((times - EPOCH) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
+
+
+def parse_duration_hours(durations: pd.Series) -> pd.Series:
+    """
+    Parse deployment durations such as "4hr 47m" or "5h 14m" (both appear in the record) into hours.
+
+    >>> parse_duration_hours(pd.Series(["4hr 47m", "5h 14m", "2hrs", "45m", ""])).round(3).tolist()
+    [4.783, 5.233, 2.0, 0.75, nan]
+
+    Args:
+        durations (Series): Duration strings
+
+    Returns:
+        pd.Series: Hours, NaN where the duration could not be read
+    """
+    parts = durations.astype(str).str.extract(r"(?:(\d+)\s*h(?:rs?)?)?\s*(?:(\d+)\s*m)?").astype(float)
+    hours = parts[0].fillna(0) + parts[1].fillna(0) / 60
+
+    return hours.where(parts.notna().any(axis=1))
+
+
+def deployment_intervals(lfr_gdf: gpd.GeoDataFrame, tz: str = "Europe/London") -> gpd.GeoDataFrame:
+    """
+    Add the deployment day as a UTC interval, and the deployment duration in hours.
+
+    The record only gives the date and how long the cameras ran, not the start time,
+    so each deployment is taken to cover its whole local day.
+
+    Args:
+        lfr_gdf (GeoDataFrame): LFR deployments with `Date` (dd/mm/yy) and `Duration` (e.g. "4hr 47m" or "5h 14m")
+        tz (str): Time zone the dates are recorded in
+
+    Returns:
+        gpd.GeoDataFrame: Deployments with `start`, `end` and `duration_hours` columns
+    """
+    day = pd.to_datetime(lfr_gdf["Date"], format="%d/%m/%y", errors="coerce").dt.tz_localize(tz)
+
+    duration_hours = parse_duration_hours(lfr_gdf["Duration"])
+    unparsed = duration_hours.isna() & lfr_gdf["Duration"].notna()
+    if unparsed.any():
+        print(f"Could not read the duration of {unparsed.sum()} deployments: {', '.join(lfr_gdf.loc[unparsed, 'Duration'].astype(str).unique()[:5])}")
+
+    return lfr_gdf.assign(
+        start=day.dt.tz_convert("UTC"),
+        end=(day + pd.DateOffset(days=1)).dt.tz_convert("UTC"),
+        duration_hours=duration_hours,
+    )
+
+
+class SpatioTemporalIndex:
+    """
+    Events grouped by distinct location, with a KD-tree over the locations and the events
+    of each location sorted by time.
+
+    Events are stored sorted on a single int64 key, `location * span + seconds`, so the events
+    at one location within a time interval are one contiguous slice found by two binary searches.
+    A query is then one ball query over locations plus two `searchsorted` calls per
+    (query, nearby location) pair, never a scan over events.
+    """
+
+    def __init__(self, location_xy: np.ndarray, event_location: np.ndarray, event_seconds: np.ndarray, event_rows: np.ndarray):
+        order = np.lexsort((event_seconds, event_location))
+
+        self.location_xy = location_xy
+        self.tree = cKDTree(location_xy)
+        self.event_rows = event_rows[order]
+        self.event_seconds = event_seconds[order]
+
+        self.t0 = int(self.event_seconds.min()) if len(order) else 0
+        self.span = int(self.event_seconds.max()) - self.t0 + 1 if len(order) else 1
+        self.keys = event_location[order].astype(np.int64) * self.span + (self.event_seconds - self.t0)
+
+    @classmethod
+    def from_points(cls, points: gpd.GeoSeries, times: pd.Series) -> "SpatioTemporalIndex":
+        """
+        Build the index from event points in any CRS and their datetimes, projecting each distinct location once.
+
+        Args:
+            points (GeoSeries): Event locations
+            times (Series): Event datetimes
+
+        Returns:
+            SpatioTemporalIndex: Index over the events with a location and a time
+        """
+        geometries = points.values
+        usable = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries)) & pd.notna(times).to_numpy()
+        rows = np.flatnonzero(usable)
+
+        xy = shapely.get_coordinates(geometries[usable])
+        locations, event_location = np.unique(xy[:, 0] + 1j * xy[:, 1], return_inverse=True)
+        located = gpd.GeoSeries(shapely.points(locations.real, locations.imag), crs=points.crs)
+
+        return cls(to_bng_xy(located), event_location, to_seconds(pd.Series(times).iloc[rows]), rows)
+
+    def _ranges(self, query_xy: np.ndarray, starts: np.ndarray, ends: np.ndarray, radius: float) -> tuple[np.ndarray, ...]:
+        """
+        Slices of the sorted events within `radius` of each query point and inside [start, end) for that query.
+
+        Returns:
+            tuple: Query index, location index, first and last (exclusive) event position, per (query, location) pair
+        """
+        usable = np.flatnonzero(~np.isnan(query_xy).any(axis=1))
+        neighbours = self.tree.query_ball_point(query_xy[usable], radius, workers=-1)
+
+        lengths = np.fromiter((len(found) for found in neighbours), dtype=np.int64, count=len(neighbours))
+        locations = np.concatenate(neighbours).astype(np.int64) if lengths.sum() else np.zeros(0, dtype=np.int64)
+        queries = np.repeat(usable, lengths)
+
+        # offsets are clipped to the index's time span so a slice never runs into a neighbouring location
+        low = np.clip(starts[queries] - self.t0, 0, self.span)
+        high = np.clip(ends[queries] - self.t0, 0, self.span)
+        first = np.searchsorted(self.keys, locations * self.span + low, side="left")
+        last = np.searchsorted(self.keys, locations * self.span + high, side="left")
+
+        return queries, locations, first, np.maximum(last, first)
+
+    def count(
+        self,
+        query_xy: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        radius: float,
+        window: pd.Timedelta = pd.Timedelta(0),
+        offset: pd.Timedelta = pd.Timedelta(0),
+        batch_size: int = 10_000,
+    ) -> np.ndarray:
+        """
+        Count events within `radius` metres of each query point and within `window` of its [start, end) interval.
+
+        Args:
+            query_xy (np.ndarray): (n, 2) query points in British National Grid
+            starts (np.ndarray): Interval start per query, int64 seconds since the epoch
+            ends (np.ndarray): Interval end per query, int64 seconds since the epoch
+            radius (float): Radius in metres
+            window (Timedelta): How far either side of the interval to match
+            offset (Timedelta): Shift every interval by this much (e.g. a week earlier, for a baseline)
+            batch_size (int): Query points per ball query
+
+        Returns:
+            np.ndarray: Event count per query point, NaN for query points without a location or interval
+        """
+        shift = int(offset.total_seconds())
+        pad = int(window.total_seconds())
+        counts = np.full(len(query_xy), np.nan)
+
+        for start in range(0, len(query_xy), batch_size):
+            batch = slice(start, start + batch_size)
+            queries, _, first, last = self._ranges(
+                query_xy[batch], starts[batch] + shift - pad, ends[batch] + shift + pad, radius
+            )
+            batch_counts = np.bincount(queries, weights=last - first, minlength=len(query_xy[batch]))
+            counts[batch] = np.where(np.isnan(query_xy[batch]).any(axis=1), np.nan, batch_counts)
+
+        return counts
+
+    def match(self, query_xy: np.ndarray, starts: np.ndarray, ends: np.ndarray, radius: float, window: pd.Timedelta = pd.Timedelta(0)) -> pd.DataFrame:
+        """
+        List every (query, event) pair within `radius` metres and within `window` of the query's interval.
+
+        Args:
+            query_xy (np.ndarray): (n, 2) query points in British National Grid
+            starts (np.ndarray): Interval start per query, int64 seconds since the epoch
+            ends (np.ndarray): Interval end per query, int64 seconds since the epoch
+            radius (float): Radius in metres
+            window (Timedelta): How far either side of the interval to match
+
+        Returns:
+            pd.DataFrame: query and event row positions, distance in metres and hours from the interval start
+        """
+        pad = int(window.total_seconds())
+        queries, locations, first, last = self._ranges(query_xy, starts - pad, ends + pad, radius)
+
+        # expand each slice into its event positions
+        lengths = last - first
+        positions = np.repeat(first - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        queries = np.repeat(queries, lengths)
+        locations = np.repeat(locations, lengths)
+
+        return pd.DataFrame({
+            "query": queries,
+            "event_row": self.event_rows[positions],
+            "distance_m": np.hypot(*(self.location_xy[locations] - query_xy[queries]).T),
+            "hours_from_start": (self.event_seconds[positions] - starts[queries]) / 3600,
+        })
+
+
+def partition_months(root: Path, years: list[int] | None = None) -> np.ndarray:
+    """
+    The months that have a partition in a partitioned stop & search dataset.
+
+    Args:
+        root (Path): Root of the partitioned GeoParquet dataset
+        years (list[int] | None): Only these years, None for all
+
+    Returns:
+        np.ndarray: Sorted months as year * 12 + month - 1
+    """
+    months = []
+    for partition in root.glob("year=*/month=*/part-0.parquet"):
+        year = int(partition.parent.parent.name.split("=")[1])
+        month = int(partition.parent.name.split("=")[1])
+        if years is None or year in years:
+            months.append(year * 12 + month - 1)
+
+    return np.unique(np.array(months, dtype=np.int64))
+
+
+def months_cover(starts: np.ndarray, ends: np.ndarray, months: np.ndarray, tz: str = "Europe/London") -> np.ndarray:
+    """
+    Whether every local calendar month touched by each [start, end) interval is among `months`.
+
+    Args:
+        starts (np.ndarray): Interval starts, int64 seconds since the epoch
+        ends (np.ndarray): Interval ends (exclusive), int64 seconds since the epoch
+        months (np.ndarray): Sorted months as year * 12 + month - 1, e.g. from `partition_months`
+        tz (str): Time zone the monthly files are published in
+
+    Returns:
+        np.ndarray: bool per interval
+    """
+    first = pd.to_datetime(starts, unit="s", utc=True).tz_convert(tz)
+    last = pd.to_datetime(ends - 1, unit="s", utc=True).tz_convert(tz)
+    first_month = (first.year * 12 + first.month - 1).to_numpy()
+    last_month = (last.year * 12 + last.month - 1).to_numpy()
+
+    # the months are distinct and sorted, so a run is complete when it holds as many months as it spans
+    loaded = np.searchsorted(months, last_month, side="right") - np.searchsorted(months, first_month, side="left")
+
+    return loaded == last_month - first_month + 1
+
+
+def deployment_queries(lfr_gdf: gpd.GeoDataFrame) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Deployment locations in British National Grid and deployment intervals in seconds, for querying the index.
+
+    Args:
+        lfr_gdf (GeoDataFrame): Output of `deployment_intervals`
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Locations (NaN for deployments without a location or date), starts and ends
+    """
+    dated = lfr_gdf["start"].notna().to_numpy()
+    query_xy = to_bng_xy(lfr_gdf.geometry)
+    query_xy[~dated] = np.nan
+
+    starts = np.zeros(len(lfr_gdf), dtype=np.int64)
+    ends = np.zeros(len(lfr_gdf), dtype=np.int64)
+    starts[dated] = to_seconds(lfr_gdf["start"][dated])
+    ends[dated] = to_seconds(lfr_gdf["end"][dated])
+
+    return query_xy, starts, ends
+
+
+def spatiotemporal_counts(
+    lfr_gdf: gpd.GeoDataFrame,
+    index: SpatioTemporalIndex,
+    radius: float = RADIUS_M,
+    windows: dict[str, pd.Timedelta] = WINDOWS,
+    control_offsets: list[pd.Timedelta] = CONTROL_OFFSETS,
+    months: np.ndarray | None = None,
+) -> gpd.GeoDataFrame:
+    """
+    Count stop & search events near each deployment around its day, and on the same weekday in the surrounding weeks.
+
+    A window reaching into a month whose events were not loaded (e.g. before the first or after the
+    last published month) is NaN rather than 0, and baseline weeks like that are left out of the mean.
+
+    Args:
+        lfr_gdf (GeoDataFrame): Output of `deployment_intervals`
+        index (SpatioTemporalIndex): Index over the stop & search events
+        radius (float): Radius in metres
+        windows (dict[str, Timedelta]): Time windows either side of the deployment day, by name
+        control_offsets (list[Timedelta]): Shifts of the same-day window used as the baseline
+        months (np.ndarray | None): Months the index holds events for, from `partition_months`; None if it covers every window
+
+    Returns:
+        gpd.GeoDataFrame: Deployments with `{window}_within_{radius}m` counts, and the mean baseline count,
+            the number of baseline weeks it averages and the ratio to it for the deployment day
+    """
+    query_xy, starts, ends = deployment_queries(lfr_gdf)
+
+    def windowed_count(window: pd.Timedelta = pd.Timedelta(0), offset: pd.Timedelta = pd.Timedelta(0)) -> np.ndarray:
+        counts = index.count(query_xy, starts, ends, radius, window, offset)
+        if months is not None:
+            shift, pad = int(offset.total_seconds()), int(window.total_seconds())
+            counts[~months_cover(starts + shift - pad, ends + shift + pad, months)] = np.nan
+
+        return counts
+
+    columns = {f"{name}_within_{radius:g}m": windowed_count(window) for name, window in windows.items()}
+
+    controls = np.array([windowed_count(offset=offset) for offset in control_offsets])
+    weeks = (~np.isnan(controls)).sum(axis=0)
+    baseline = np.where(weeks > 0, np.nansum(controls, axis=0) / np.maximum(weeks, 1), np.nan)
+    same_day = windowed_count()
+    columns[f"baseline_same_weekday_within_{radius:g}m"] = baseline
+    columns["baseline_weeks"] = weeks
+    with np.errstate(divide="ignore", invalid="ignore"):
+        columns["same_day_to_baseline_ratio"] = same_day / baseline
+
+    return lfr_gdf.assign(**columns)
+
+
+def summarise_spatiotemporal(counts_gdf: gpd.GeoDataFrame, radius: float = RADIUS_M, windows: dict[str, pd.Timedelta] = WINDOWS) -> pd.DataFrame:
+    """
+    Summarise the per-deployment counts: mean count per window, and the deployment day against its baseline.
+
+    Args:
+        counts_gdf (GeoDataFrame): Output of `spatiotemporal_counts`
+        radius (float): Radius the counts were made with
+        windows (dict[str, Timedelta]): Windows the counts were made with
+
+    Returns:
+        pd.DataFrame: One row per statistic
+    """
+    located = counts_gdf[f"same_day_within_{radius:g}m"].notna()
+    same_day = counts_gdf.loc[located, f"same_day_within_{radius:g}m"]
+    baseline = counts_gdf.loc[located, f"baseline_same_weekday_within_{radius:g}m"]
+
+    rows = [{"stat": "deployments_matched", "value": located.sum()}]
+    rows += [
+        {"stat": f"mean_{name}_within_{radius:g}m", "value": counts_gdf.loc[located, f"{name}_within_{radius:g}m"].mean()}
+        for name in windows
+    ]
+    # the comparison uses only deployments whose day and baseline are both covered by the loaded months
+    compared = same_day.notna() & baseline.notna()
+    same_day, baseline = same_day[compared], baseline[compared]
+    rows += [
+        {"stat": f"mean_baseline_same_weekday_within_{radius:g}m", "value": baseline.mean()},
+        {"stat": "deployments_compared_with_baseline", "value": compared.sum()},
+        {"stat": "pooled_same_day_to_baseline_ratio", "value": same_day.sum() / baseline.sum() if baseline.sum() else np.nan},
+        {"stat": "pct_deployments_above_baseline", "value": (same_day > baseline).mean() * 100 if compared.any() else np.nan},
+    ]
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    in_path_stop_search = Path("../data/processed/stop_search")
+    in_path_lfr = Path("../data/processed/lfr_deployments.parquet")
+
+    out_path = Path("../data/processed/lfr_spatiotemporal.gpkg")
+    matches_out_path = Path("../data/processed/lfr_stop_search_matches.parquet")
+    summary_out_path = Path("../outputs/tables/lfr_spatiotemporal_summary.csv")
+
+
+    lfr_gdf = deployment_intervals(gpd.read_parquet(in_path_lfr))
+
+    # events are loaded for the deployments' dates padded by the widest window and baseline shift,
+    # so windows reaching into the previous December or the next January are counted
+    reach = max(WINDOWS.values()) + max(abs(offset) for offset in CONTROL_OFFSETS)
+    years = list(range((lfr_gdf["start"].min() - reach).year, (lfr_gdf["end"].max() + reach).year + 1))
+    months = partition_months(in_path_stop_search, years)
+    stop_search_gdf = read_partitioned_geoparquet(in_path_stop_search, columns=["Date"], years=years)
+    index = SpatioTemporalIndex.from_points(stop_search_gdf.geometry, stop_search_gdf["Date"])
+
+    counts_gdf = spatiotemporal_counts(lfr_gdf, index, months=months)
+    summary = summarise_spatiotemporal(counts_gdf)
+
+    # event-level matches for the widest window, so individual searches can be inspected
+    matches = index.match(*deployment_queries(lfr_gdf), RADIUS_M, max(WINDOWS.values()))
+    matches = matches.assign(
+        **{"Deployment Location": lfr_gdf["Deployment Location"].to_numpy()[matches["query"]]},
+        **{"Date": stop_search_gdf["Date"].to_numpy()[matches["event_row"]]},
+    )
+
+    counts_gdf.drop(columns=["start", "end"]).to_file(out_path, driver="GPKG")
+    matches.to_parquet(matches_out_path, index=False)
+    summary.round(2).to_csv(summary_out_path, index=False)
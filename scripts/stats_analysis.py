@@ -2,103 +2,160 @@
 Calculate key stats for plotting maps and dissecting information 
 """
  
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from pathlib import Path
 
+from instrumentation import instrumented, recording, span
+from lfr_significance import placement_significance
+from lfr_stats import CHANGE_BUCKETS, Concentration, change_buckets, group_shares
 
-def load_data(data_path: Path) -> gpd.GeoDataFrame:
+IMD_DECILE = 'Index of Multiple Deprivation (IMD) Decile'
+STATS_COLUMNS = ['LSOA11CD', 'stop_search_count_2025', 'stop_search_count_2023', 'abs_difference', 'lfr_count', IMD_DECILE]
+
+
+@instrumented
+def load_data(data_path: Path) -> pd.DataFrame:
     """
-    Load data, and slim into a GeoDataframe ready for analysis.
+    Load data, and slim into a plain DataFrame ready for analysis (geometry is not needed for the stats).
 
     Args:
         data_path (Path): Path to the processed data
 
     Returns:
-        gpd.GeoDataFrame: Data ready for analysis
+        pd.DataFrame: Data ready for analysis
     """
-    complete_dataset = gpd.read_file(data_path)
-    complete_gdf = complete_dataset[['LSOA11CD', 'stop_search_count_2025', 'stop_search_count_2023', 'abs_change', 'lfr_count' 'Index of Multiple Deprivation (IMD) Decile', 'geometry']]
+    complete_df = gpd.read_file(data_path, columns=STATS_COLUMNS, ignore_geometry=True)
 
-    return complete_gdf
+    return complete_df[STATS_COLUMNS]
 
 
-def lfr_deployments_high_stop_search_lsoas(quantile: float, total_lfr: float, complete_gdf: gpd.GeoDataFrame) -> tuple[float, float, float]:
+@instrumented
+def load_null_weights(data_path: Path) -> pd.DataFrame:
     """
-    Calculate percentage of LFR deployments that occured in LSOAs with high stop & search activity in 2025.
+    Load the area and resident population of each LSOA, used to weight random placement of deployments.
 
     Args:
-        quantile (float): quantile of stop and search activity to be analysed against
-        total_lfr (float): total number of LFR deployments
-        complete_gdf (GeoDataFrame): dataset for analysis
+        data_path (Path): Path to the processed data
 
     Returns:
-        float: Percentage of LFR deployments that occured in LSOAs expeicneing specific quantile of stop & search 
+        pd.DataFrame: LSOA11CD, area_km2 and population (usual residents)
     """
+    lsoa_gdf = gpd.read_file(data_path, columns=['LSOA11CD', 'USUALRES'])
 
-    top_stop_search = complete_gdf['stop_search_count_2025'].quantile(quantile)
+    return pd.DataFrame({
+        'LSOA11CD': lsoa_gdf['LSOA11CD'],
+        # British National Grid, so areas are in square metres
+        'area_km2': lsoa_gdf.geometry.to_crs("EPSG:27700").area / 1e6,
+        'population': lsoa_gdf['USUALRES'],
+    })
 
-    high_stop_search_lsoas = complete_gdf[complete_gdf['stop_search_count_2025'] >= top_10_stop_search]
 
-    lfr_in_quantile = high_stop_search_lsoas['lfr_count'].sum()
+@instrumented
+def lfr_share_tables(complete_df: pd.DataFrame) -> tuple[Concentration, pd.DataFrame, pd.DataFrame]:
+    """
+    Calculate the share of LFR deployments across every stop & search quantile, IMD decile and change bucket.
 
-    pct_in_quantile = lfr_in_quantile / total_lfr * 100
+    Args:
+        complete_df (DataFrame): dataset for analysis
 
-    return top_stop_search, lfr_in_quantile, pct_in_quantile
+    Returns:
+        tuple: Concentration of LFR over 2025 stop & search, LFR shares per IMD decile, LFR shares per change bucket
+    """
+    lfr = complete_df['lfr_count'].fillna(0).to_numpy()
 
+    concentration = Concentration(complete_df['stop_search_count_2025'].fillna(0).to_numpy(), lfr)
+    imd_shares = group_shares(complete_df[IMD_DECILE].to_numpy(), lfr)
+    change_shares = group_shares(change_buckets(complete_df['abs_difference'].to_numpy()), lfr)
 
-def lfr_deployments_rising_falling(complete_gdf: gpd.GeoDataFrame, total_lfr: float) -> tuple[float, float, float, float,float,float]:
+    return concentration, imd_shares, change_shares
+
+
+@instrumented
+def key_stats_from_tables(concentration: Concentration, imd_shares: pd.DataFrame, change_shares: pd.DataFrame) -> dict:
     """
-    Calcualte percentage of LFR deployments that occur in LSOAs with rising, falling and stable stop & search
+    Pick the headline figures reported in summary_stats.csv out of the full share tables.
 
     Args:
-        total_lfr (float): total number of LFR deployments
-        complete_gdf (GeoDataFrame): dataset for analysis
+        concentration (Concentration): LFR concentration over 2025 stop & search
+        imd_shares (DataFrame): LFR shares per IMD decile
+        change_shares (DataFrame): LFR shares per change bucket
 
     Returns:
-        tuple[float]: 3 percentages for lfr deployments in areas of rising stop & search, no change and falling stop & search
+        dict: Key stats by name
     """
+    quantiles = concentration.at_quantiles(np.array([0.9, 0.8])).set_index('quantile')
+    imd = imd_shares.set_index('group')
+    change = change_shares.set_index('group').reindex(list(CHANGE_BUCKETS.values()), fill_value=0)
 
-    rising_search = complete_gdf[complete_gdf['abs_change'] > 0]
-    no_change = complete_gdf[complete_gdf['abs_change'] == 0]
-    falling_search = complete_gdf[complete_gdf['abs_change'] < 0]
+    return {
+        "top_10_stop_search": quantiles.loc[0.9, 'threshold'],
+        "lfr_in_top_10": quantiles.loc[0.9, 'value'],
+        "pct_in_top_10": quantiles.loc[0.9, 'pct_value'],
 
-    lfr_rising = rising_search['lfr_count'].sum()
-    lfr_no_change = no_change['lfr_count'].sum()
-    lfr_falling = falling_search['lfr_count'].sum() 
+        "top_20_stop_search": quantiles.loc[0.8, 'threshold'],
+        "lfr_in_top_20": quantiles.loc[0.8, 'value'],
+        "pct_in_top_20": quantiles.loc[0.8, 'pct_value'],
 
-    pct_in_rising = lfr_rising / total_lfr * 100 
-    pct_no_change = lfr_no_change / total_lfr * 100
-    pct_falling = lfr_falling / total_lfr * 100 
+        "lfr_rising": change.loc['rising', 'value'],
+        "lfr_no_change": change.loc['no_change', 'value'],
+        "lfr_falling": change.loc['falling', 'value'],
 
-    return lfr_rising, lfr_no_change, lfr_falling, pct_in_rising, pct_no_change, pct_falling
+        "total_lfr": concentration.total,
 
-def lfr_deployments_high_imd(complete_gfd: gpd.GeoDataFrame, total_lfr: float) -> tuple[float, float, float, float]:
-    """
-    Calcualte percentage of LFR deployments that occur in LSOAs with high levels of deprivation
+        "pct_in_rising": change.loc['rising', 'pct_value'],
+        "pct_no_change": change.loc['no_change', 'pct_value'],
+        "pct_falling": change.loc['falling', 'pct_value'],
 
-    Args:
-        total_lfr (float): total number of LFR deployments
-        complete_gdf (GeoDataFrame): dataset for analysis
+        "hi_dec_sum": imd.loc[1, 'lsoas'],
+        "hi_three_dec": imd.loc[3, 'cum_lsoas'],
 
-    Returns:
-        tuple[float]: 2 percentages for lfr deployments in areas of different levels of deprivation measured by IMD
-    """ 
+        "lfr_highest": imd.loc[1, 'value'],
+        "lfr_three_highest": imd.loc[3, 'cum_value'],
 
-    highest_decile = complete_gfd[complete_gfd['Index of Multiple Deprivation (IMD) Decile'] == 1]
-    three_highest_deciles = complete_gfd[complete_gfd['Index of Multiple Deprivation (IMD) Decile'] < 4]
+        "imd_lfr_pct": imd.loc[1, 'pct_value'],
+        "imd_three_lfr_pct": imd.loc[3, 'cum_pct_value'],
 
-    hi_dec_sum = highest_decile.shape[0]
-    hi_three_dec = three_highest_deciles.shape[0]
+        "stop_search_lfr_gini": concentration.gini(),
+    }
 
-    lfr_highest = highest_decile['lfr_count'].sum()
-    lfr_three_highest = three_highest_deciles['lfr_count'].sum()
 
-    imd_lfr_pct = lfr_highest / total_lfr * 100 
-    imd_three_lfr_pct = lfr_three_highest / total_lfr * 100 
+@instrumented
+def placement_scores(complete_df: pd.DataFrame, concentration: Concentration) -> pd.DataFrame:
+    """
+    Express each headline share as a per-LSOA score whose mean over deployments gives the statistic,
+    so it can be recomputed for any random placement of the deployments.
 
-    return hi_dec_sum, hi_three_dec, lfr_highest, lfr_three_highest, imd_lfr_pct, imd_three_lfr_pct
+    Args:
+        complete_df (DataFrame): dataset for analysis
+        concentration (Concentration): LFR concentration over 2025 stop & search
 
+    Returns:
+        pd.DataFrame: One score column per statistic, one row per LSOA
+    """
+    stop_search = complete_df['stop_search_count_2025'].fillna(0).to_numpy()
+    thresholds = concentration.at_quantiles(np.array([0.9, 0.8]))['threshold'].to_numpy()
+    buckets = change_buckets(complete_df['abs_difference'].to_numpy())
+    imd_decile = complete_df[IMD_DECILE].to_numpy(dtype="float64")
+
+    with np.errstate(invalid="ignore"):
+        scores = {
+            "pct_in_top_10": stop_search >= thresholds[0],
+            "pct_in_top_20": stop_search >= thresholds[1],
+            "pct_in_rising": buckets == 'rising',
+            "pct_no_change": buckets == 'no_change',
+            "pct_falling": buckets == 'falling',
+            "imd_lfr_pct": imd_decile == 1,
+            "imd_three_lfr_pct": imd_decile <= 3,
+        }
+    scores = pd.DataFrame({name: mask * 100.0 for name, mask in scores.items()})
+    scores["stop_search_lfr_gini"] = concentration.gini_weights()
+
+    return scores
+
+
+@instrumented
 def create_dataframe_with_stats(key_stats: dict) -> pd.DataFrame:
     """
     Collate all information into a single Dataframe from a dictionary
@@ -110,57 +167,48 @@ def create_dataframe_with_stats(key_stats: dict) -> pd.DataFrame:
         Dataframe: Contains all the data formatted as a DataFraem 
     """ 
 
-    stats_df = pd.DataFrame([key_stats])
-    stats_df = stats_df.round(2)
+    stats_df = pd.DataFrame({"stat": list(key_stats), "value": [float(v) for v in key_stats.values()]})
+    stats_df["value"] = stats_df["value"].round(2)
 
     return stats_df
 
     
 
 if __name__ == "__main__":
-    in_path = Path("../data/prcoessed/combined_counts.gpkg")
+    in_path = Path("../data/processed/combined_counts.gpkg")
     out_path = Path("../outputs/tables/summary_stats.csv")
+    concentration_path = Path("../outputs/tables/lfr_stop_search_concentration.csv")
+    imd_path = Path("../outputs/tables/lfr_by_imd_decile.csv")
+    change_path = Path("../outputs/tables/lfr_by_stop_search_change.csv")
+    significance_path = Path("../outputs/tables/summary_stats_significance.csv")
 
-    complete_dataset = load_data(in_path)
-
-    total_lfr = complete_dataset['lfr_count'].sum()
+    with recording("stats_analysis"):
+        complete_dataset = load_data(in_path)
 
-    top_10_stop_search, lfr_in_top_10, pct_in_top_10 = lfr_deployments_high_stop_search_lsoas(0.9, complete_dataset)
-    top_20_stop_search, lfr_in_top_20, pct_in_top_20 = lfr_deployments_high_stop_search_lsoas(0.8, complete_dataset)
+        concentration, imd_shares, change_shares = lfr_share_tables(complete_dataset)
 
-    lfr_rising, lfr_no_change, lfr_falling, pct_in_rising, pct_no_change, pct_falling = lfr_deployments_rising_falling(complete_dataset, total_lfr)
+        key_stats = key_stats_from_tables(concentration, imd_shares, change_shares)
 
-    hi_dec_sum, hi_three_dec, lfr_highest, lfr_three_highest, imd_lfr_pct, imd_three_lfr_pct = lfr_deployments_high_imd(complete_dataset, total_lfr)
+        summary_statistics = create_dataframe_with_stats(key_stats)
 
-    key_stats = {
-        "total_lfr": total_lfr,
+        summary_statistics.to_csv(out_path, index=False)
 
-        "top_10_stop_search_threshold": top_10_stop_search,
-        "lfr_in_top_10": lfr_in_top_10,
-        "pct_lfr_in_top_10": pct_in_top_10,
+        # full tables behind the headline figures: every stop & search percentile, decile and change bucket
+        with span("write_tables"):
+            concentration.at_quantiles().round(4).to_csv(concentration_path, index=False)
+            imd_shares.round(4).to_csv(imd_path, index=False)
+            change_shares.round(4).to_csv(change_path, index=False)
 
-        "top_20_stop_search_threshold": top_20_stop_search,
-        "lfr_in_top_20": lfr_in_top_20,
-        "pct_lfr_in_top_20": pct_in_top_20,
-
-        "lfr_rising": lfr_rising,
-        "lfr_no_change": lfr_no_change,
-        "lfr_falling": lfr_falling,
-
-        "pct_lfr_rising": pct_in_rising,
-        "pct_lfr_no_change": pct_no_change,
-        "pct_lfr_falling": pct_falling,
-
-        "lsoas_highest_imd_decile": hi_dec_sum,
-        "lsoas_top_3_imd_deciles": hi_three_dec,
-
-        "lfr_in_highest_imd": lfr_highest,
-        "lfr_in_top_3_imd": lfr_three_highest,
-
-        "pct_lfr_highest_imd": imd_lfr_pct,
-        "pct_lfr_top_3_imd": imd_three_lfr_pct,
-    }
+        # null distributions: the observed deployments placed at random across LSOAs, uniformly or by area or population
+        scores = placement_scores(complete_dataset, concentration)
+        null_weights = complete_dataset[['LSOA11CD']].merge(load_null_weights(in_path), on='LSOA11CD', how='left')
+        lfr_counts = complete_dataset['lfr_count'].fillna(0).to_numpy()
 
-    summary_statistics = create_dataframe_with_stats(key_stats)
+        significance = []
+        for weighting in ("uniform", "area_km2", "population"):
+            weights = None if weighting == "uniform" else null_weights[weighting].to_numpy()
+            with span("null_weighting", weighting=weighting):
+                table = placement_significance(scores, lfr_counts, weights, n_draws=20_000, seed=2025)
+            significance.append(table.assign(null_weighting=weighting))
 
-    summary_statistics.to_csv(out_path)
+        pd.concat(significance).round(4).to_csv(significance_path, index=False)
@@ -0,0 +1,567 @@
+"""
+Generate deterministic synthetic LSOA boundaries, stop & search CSVs and LFR deployment records for benchmarking.
+
+The raw data is not kept in the repo, so the benchmarks run on files with the same schema and
+layout as the real inputs: LSOA polygons in a zipped shapefile in British National Grid,
+monthly police.uk CSVs named `YYYY-MM-<force>-stop-and-search.csv`, and the LFR deployment
+record as a PDF table. The same seed and sizes always give byte-identical files.
+"""
+
+import argparse
+import json
+import shutil
+import zipfile
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import fitz
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import shapely
+
+BRITISH_NATIONAL_GRID = "EPSG:27700"
+# British National Grid extent of Greater London
+LONDON_EXTENT_BNG = (503_500.0, 155_800.0, 561_900.0, 200_900.0)
+LSOA_SHP = "synthetic-lsoa/LSOA_2011_synthetic.shp"
+
+LFR_HEADERS = [
+    'Deployment Location',
+    'Date',
+    'Duration',
+    'LFR Use Case',
+    'Watchlist Size',
+    'Min Threshold Setting',
+    'Total Alerts',
+    'True Alerts Confirmed',
+    'True Alerts Unconfirmed',
+    'False Alerts Confirmed',
+    'False Alerts Unconfirmed',
+    'False Alert Rate',
+    'Outcome - Arrest',
+    'Outcome - Other',
+    'No action',
+    'Faces seen (estimate)']
+
+# categorical columns of the police.uk stop & search CSVs, with rough relative frequencies
+STOP_SEARCH_CATEGORIES = {
+    "Type": {"Person search": 0.8, "Person and Vehicle search": 0.18, "Vehicle search": 0.02},
+    "Gender": {"Male": 0.88, "Female": 0.1, "Other": 0.02},
+    "Age range": {"under 10": 0.001, "10-17": 0.15, "18-24": 0.35, "25-34": 0.28, "over 34": 0.219},
+    "Self-defined ethnicity": {
+        "White - English/Welsh/Scottish/Northern Irish/British": 0.3,
+        "Black/African/Caribbean/Black British - African": 0.15,
+        "Black/African/Caribbean/Black British - Caribbean": 0.1,
+        "Asian/Asian British - Any other Asian background": 0.1,
+        "Other ethnic group - Not stated": 0.25,
+        "Mixed/Multiple ethnic groups - Any other Mixed/Multiple ethnic background": 0.1,
+    },
+    "Officer-defined ethnicity": {"White": 0.35, "Black": 0.35, "Asian": 0.18, "Other": 0.07, "Mixed": 0.05},
+    "Legislation": {
+        "Misuse of Drugs Act 1971 (section 23)": 0.6,
+        "Police and Criminal Evidence Act 1984 (section 1)": 0.3,
+        "Criminal Justice and Public Order Act 1994 (section 60)": 0.05,
+        "Firearms Act 1968 (section 47)": 0.05,
+    },
+    "Object of search": {
+        "Controlled drugs": 0.6,
+        "Offensive weapons": 0.15,
+        "Stolen goods": 0.12,
+        "Articles for use in criminal damage": 0.08,
+        "Firearms": 0.05,
+    },
+    "Outcome": {
+        "A no further action disposal": 0.7,
+        "Arrest": 0.15,
+        "Community resolution": 0.1,
+        "Penalty Notice for Disorder": 0.03,
+        "Summons / charged by post": 0.02,
+    },
+}
+
+STOP_SEARCH_CSV_COLUMNS = [
+    "Type",
+    "Date",
+    "Part of a policing operation",
+    "Policing operation",
+    "Latitude",
+    "Longitude",
+    "Gender",
+    "Age range",
+    "Self-defined ethnicity",
+    "Officer-defined ethnicity",
+    "Legislation",
+    "Object of search",
+    "Outcome",
+    "Outcome linked to object of search",
+    "Removal of more than just outer clothing",
+]
+
+
+@dataclass
+class SyntheticDataset:
+    """
+    Paths and sizes of one generated dataset, as recorded in its `dataset.json`.
+    """
+
+    root: Path
+    n_rows: int
+    n_lsoas: int
+    n_deployments: int
+    start: str
+    end: str
+    forces: tuple[str, ...]
+    seed: int
+
+    @property
+    def lsoa_zip(self) -> Path:
+        return self.root / "lsoa_boundaries.zip"
+
+    @property
+    def stop_search_dir(self) -> Path:
+        return self.root / "stop_search"
+
+    @property
+    def lfr_pdf(self) -> Path:
+        return self.root / "lfr_deployments.pdf"
+
+    @property
+    def lfr_records(self) -> Path:
+        return self.root / "lfr_deployments.parquet"
+
+    @property
+    def lsoa_table(self) -> Path:
+        return self.root / "combined_counts.parquet"
+
+    def params(self) -> dict:
+        params = asdict(self)
+        params.pop("root")
+        params["forces"] = list(self.forces)
+
+        return params
+
+
+def _pick(rng: np.random.Generator, weights: dict[str, float], n: int) -> np.ndarray:
+    labels = np.array(list(weights), dtype=object)
+    probabilities = np.array(list(weights.values()))
+
+    return labels[rng.choice(len(labels), size=n, p=probabilities / probabilities.sum())]
+
+
+def make_lsoas(n_lsoas: int = 4835, n_boroughs: int = 33, extent: tuple[float, float, float, float] = LONDON_EXTENT_BNG, seed: int = 0) -> gpd.GeoDataFrame:
+    """
+    Voronoi polygons that tile the extent like LSOAs: small and dense in the centre, larger towards the edge.
+
+    Args:
+        n_lsoas (int): Number of polygons
+        n_boroughs (int): Number of boroughs the polygons are grouped into
+        extent (tuple): (minx, miny, maxx, maxy) in British National Grid
+        seed (int): Random seed
+
+    Returns:
+        gpd.GeoDataFrame: LSOA11CD, LSOA11NM, LAD11CD, LAD11NM, USUALRES and geometry in British National Grid
+    """
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = extent
+    centre = np.array([(minx + maxx) / 2, (miny + maxy) / 2])
+
+    # half spread evenly, half clustered on the centre, as residential density is
+    n_central = n_lsoas // 2
+    seeds = np.vstack([
+        rng.uniform((minx, miny), (maxx, maxy), size=(n_lsoas - n_central, 2)),
+        rng.normal(centre, ((maxx - minx) / 6, (maxy - miny) / 6), size=(n_central, 2)),
+    ])
+    seeds = np.clip(seeds, (minx + 1, miny + 1), (maxx - 1, maxy - 1))
+
+    frame = shapely.box(*extent)
+    cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(seeds), extend_to=frame))
+    cells = shapely.intersection(cells, frame)
+
+    # voronoi_polygons does not keep the order of its input points
+    seed_idx, cell_idx = shapely.STRtree(cells).query(shapely.points(seeds), predicate="within")
+    geometry = np.empty(n_lsoas, dtype=object)
+    geometry[seed_idx] = cells[cell_idx]
+
+    # boroughs are the nearest of a set of borough centres, so each is one contiguous block
+    borough_centres = rng.uniform((minx, miny), (maxx, maxy), size=(n_boroughs, 2))
+    borough = np.argmin(((seeds[:, None, :] - borough_centres[None, :, :]) ** 2).sum(axis=2), axis=1)
+
+    order = np.lexsort((seeds[:, 0], seeds[:, 1], borough))
+    codes = np.array([f"E01{i:06d}" for i in range(n_lsoas)])
+
+    return gpd.GeoDataFrame({
+        "LSOA11CD": codes,
+        "LSOA11NM": [f"Borough {b + 1:02d} {i:03d}" for i, b in enumerate(borough[order])],
+        "LAD11CD": [f"E09{b + 1:06d}" for b in borough[order]],
+        "LAD11NM": [f"Borough {b + 1:02d}" for b in borough[order]],
+        "USUALRES": rng.normal(1700, 300, n_lsoas).clip(1000, 3000).round().astype(np.int64),
+    }, geometry=geometry[order], crs=BRITISH_NATIONAL_GRID)
+
+
+def write_lsoa_zip(lsoa_gdf: gpd.GeoDataFrame, zip_path: Path, shp_inside_zip: str = LSOA_SHP) -> None:
+    """
+    Write the polygons as a zipped shapefile, laid out like the London boundaries download.
+
+    Args:
+        lsoa_gdf (GeoDataFrame): Polygons from `make_lsoas`
+        zip_path (Path): Zip to write
+        shp_inside_zip (str): Path of the shapefile inside the zip
+    """
+    shp_dir = zip_path.parent / f"{zip_path.stem}_shp"
+    shp_dir.mkdir(parents=True, exist_ok=True)
+    lsoa_gdf.to_file(shp_dir / Path(shp_inside_zip).name)
+
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for part in sorted(shp_dir.iterdir()):
+            # fixed timestamps so the zip, and so every cache keyed on its hash, is reproducible
+            info = zipfile.ZipInfo(str(Path(shp_inside_zip).parent / part.name), date_time=(2011, 1, 1, 0, 0, 0))
+            archive.writestr(info, part.read_bytes(), zipfile.ZIP_DEFLATED)
+            part.unlink()
+    shp_dir.rmdir()
+
+
+def make_map_points(lsoa_gdf: gpd.GeoDataFrame, n_points: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    A fixed set of map points records are snapped to, as police.uk does, with a skewed share of records each.
+
+    Args:
+        lsoa_gdf (GeoDataFrame): Polygons from `make_lsoas`
+        n_points (int): Number of map points
+        seed (int): Random seed
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Longitude, latitude and probability per map point
+    """
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = lsoa_gdf.total_bounds
+
+    xy = rng.uniform((minx, miny), (maxx, maxy), size=(n_points, 2))
+    lonlat = shapely.get_coordinates(
+        gpd.GeoSeries(shapely.points(xy), crs=lsoa_gdf.crs).to_crs("EPSG:4326").values
+    )
+    # rounded to police.uk's six decimal places
+    lonlat = lonlat.round(6)
+
+    # a few map points take most of the records
+    weights = rng.lognormal(0, 1.5, n_points)
+
+    return lonlat[:, 0], lonlat[:, 1], weights / weights.sum()
+
+
+def make_stop_search_rows(
+    n_rows: int,
+    month: str,
+    map_points: tuple[np.ndarray, np.ndarray, np.ndarray],
+    rng: np.random.Generator,
+    missing_location: float = 0.03,
+) -> pd.DataFrame:
+    """
+    Stop & search records for one month in the police.uk CSV schema.
+
+    Args:
+        n_rows (int): Number of records
+        month (str): YYYY-MM
+        map_points (tuple): Output of `make_map_points`
+        rng (Generator): Random generator
+        missing_location (float): Share of records without coordinates
+
+    Returns:
+        pd.DataFrame: Records with the police.uk CSV columns, dates as ISO 8601 strings
+    """
+    lon, lat, probabilities = map_points
+    point = rng.choice(len(lon), size=n_rows, p=probabilities)
+    located = rng.random(n_rows) >= missing_location
+
+    month_start = np.datetime64(f"{month}-01T00:00:00", "s")
+    month_seconds = int((np.datetime64(month, "M") + 1 - np.datetime64(month, "M")).astype("timedelta64[D]").astype(int)) * 86_400
+    dates = month_start + np.sort(rng.integers(0, month_seconds, n_rows)).astype("timedelta64[s]")
+
+    rows = {
+        "Type": _pick(rng, STOP_SEARCH_CATEGORIES["Type"], n_rows),
+        "Date": np.char.add(np.datetime_as_string(dates, unit="s"), "+00:00"),
+        "Part of a policing operation": np.where(rng.random(n_rows) < 0.05, "True", "False"),
+        "Policing operation": np.full(n_rows, "", dtype=object),
+        "Latitude": np.where(located, lat[point], np.nan),
+        "Longitude": np.where(located, lon[point], np.nan),
+    }
+    for column in ("Gender", "Age range", "Self-defined ethnicity", "Officer-defined ethnicity", "Legislation", "Object of search", "Outcome"):
+        rows[column] = _pick(rng, STOP_SEARCH_CATEGORIES[column], n_rows)
+    rows["Outcome linked to object of search"] = np.where(rng.random(n_rows) < 0.3, "True", "False")
+    rows["Removal of more than just outer clothing"] = np.where(rng.random(n_rows) < 0.02, "True", "False")
+
+    return pd.DataFrame(rows, columns=STOP_SEARCH_CSV_COLUMNS)
+
+
+def write_stop_search_csvs(
+    folder_path: Path,
+    n_rows: int,
+    start: str,
+    end: str,
+    map_points: tuple[np.ndarray, np.ndarray, np.ndarray],
+    forces: tuple[str, ...] = ("metropolitan",),
+    seed: int = 0,
+    chunk_rows: int = 1_000_000,
+) -> list[Path]:
+    """
+    Write monthly police.uk CSVs totalling `n_rows` records into one folder, as `load_stop_search` reads them.
+
+    Files are written `chunk_rows` at a time, so 50M rows can be generated in bounded memory.
+
+    Args:
+        folder_path (Path): Folder to write into
+        n_rows (int): Total number of records
+        start (str): First month, as YYYY-MM
+        end (str): Last month, as YYYY-MM
+        map_points (tuple): Output of `make_map_points`, shared by every force
+        forces (tuple[str, ...]): Force names used in the file names
+        seed (int): Random seed
+        chunk_rows (int): Records generated and written at once
+
+    Returns:
+        list[Path]: The CSVs written
+    """
+    months = pd.period_range(start, end, freq="M").strftime("%Y-%m").tolist()
+    files = [(month, force) for month in months for force in forces]
+    file_rows = np.full(len(files), n_rows // len(files))
+    file_rows[:n_rows % len(files)] += 1
+
+    written = []
+    for (month, force), rows, file_seed in zip(files, file_rows, np.random.SeedSequence(seed).spawn(len(files))):
+        csv_path = folder_path / f"{month}-{force}-stop-and-search.csv"
+        csv_path.parent.mkdir(parents=True, exist_ok=True)
+
+        rng = np.random.default_rng(file_seed)
+        with open(csv_path, "wb") as csv_file:
+            csv_file.write((",".join(STOP_SEARCH_CSV_COLUMNS) + "\n").encode())
+            for first in range(0, rows, chunk_rows):
+                chunk = make_stop_search_rows(min(chunk_rows, rows - first), month, map_points, rng)
+                # pyarrow writes CSV far faster than pandas; no value contains a comma, so nothing needs quoting
+                pacsv.write_csv(
+                    pa.Table.from_pandas(chunk, preserve_index=False),
+                    csv_file,
+                    write_options=pacsv.WriteOptions(include_header=False, quoting_style="none"),
+                )
+        written.append(csv_path)
+
+    return written
+
+
+def make_lfr_records(
+    n_deployments: int,
+    lsoa_gdf: gpd.GeoDataFrame,
+    start: str,
+    end: str,
+    n_sites: int | None = None,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    LFR deployment records with the columns of the published deployment record, and the coordinates of each site.
+
+    Args:
+        n_deployments (int): Number of deployments
+        lsoa_gdf (GeoDataFrame): Polygons from `make_lsoas`, deployments are placed inside them
+        start (str): First month, as YYYY-MM
+        end (str): Last month, as YYYY-MM
+        n_sites (int | None): Number of distinct sites, deployments revisit them; defaults to a third of the deployments
+        seed (int): Random seed
+
+    Returns:
+        pd.DataFrame: The 16 record columns as strings, plus `latitude` and `longitude`
+    """
+    rng = np.random.default_rng(seed)
+    n_sites = n_sites or max(1, n_deployments // 3)
+
+    site_lsoa = rng.choice(len(lsoa_gdf), size=n_sites)
+    sites = gpd.GeoSeries(lsoa_gdf.geometry.values[site_lsoa], crs=lsoa_gdf.crs).representative_point().to_crs("EPSG:4326")
+    site = rng.choice(n_sites, size=n_deployments)
+
+    first_day = pd.Period(start, freq="M").start_time
+    n_days = (pd.Period(end, freq="M").end_time - first_day).days + 1
+    days = first_day + pd.to_timedelta(np.sort(rng.integers(0, n_days, n_deployments)), unit="D")
+
+    minutes = rng.integers(60, 10 * 60, n_deployments)
+    faces = rng.integers(1_000, 60_000, n_deployments)
+    true_alerts = rng.poisson(3, n_deployments)
+    false_alerts = rng.binomial(1, 0.05, n_deployments)
+    arrests = rng.binomial(true_alerts, 0.5)
+    other = rng.binomial(true_alerts - arrests, 0.5)
+
+    return pd.DataFrame({
+        'Deployment Location': [f"Synthetic Site {s + 1:04d}, High Street" for s in site],
+        'Date': days.strftime("%d/%m/%y"),
+        'Duration': [f"{m // 60}hr {m % 60}m" for m in minutes],
+        'LFR Use Case': _pick(rng, {"Crime hotspot": 0.8, "Event": 0.1, "Transport hub": 0.1}, n_deployments),
+        'Watchlist Size': rng.integers(5_000, 20_000, n_deployments).astype(str),
+        'Min Threshold Setting': "0.64",
+        'Total Alerts': (true_alerts + false_alerts).astype(str),
+        'True Alerts Confirmed': true_alerts.astype(str),
+        'True Alerts Unconfirmed': "0",
+        'False Alerts Confirmed': false_alerts.astype(str),
+        'False Alerts Unconfirmed': "0",
+        'False Alert Rate': [f"{f / n:.4%}" for f, n in zip(false_alerts, faces)],
+        'Outcome - Arrest': arrests.astype(str),
+        'Outcome - Other': other.astype(str),
+        'No action': (true_alerts - arrests - other).astype(str),
+        'Faces seen (estimate)': [f"{n:,}" for n in faces],
+        'latitude': sites.y.to_numpy()[site],
+        'longitude': sites.x.to_numpy()[site],
+    })
+
+
+def write_lfr_pdf(records: pd.DataFrame, pdf_path: Path, rows_per_page: int = 20) -> None:
+    """
+    Draw the records as a ruled table over landscape pages, with the same layout `clean_lfr.load_lfr` expects:
+    a title row and the column headers on the first page only.
+
+    Args:
+        records (DataFrame): Output of `make_lfr_records`
+        pdf_path (Path): PDF to write
+        rows_per_page (int): Table rows per page
+    """
+    width, height = fitz.paper_size("a4-l")
+    margin = 20
+    column_width = (width - 2 * margin) / len(LFR_HEADERS)
+    row_height = (height - 2 * margin) / (rows_per_page + 2)
+
+    values = records[LFR_HEADERS].astype(str).to_numpy()
+    pages = [values[:rows_per_page]] + [values[i:i + rows_per_page + 2] for i in range(rows_per_page, len(values), rows_per_page + 2)]
+
+    doc = fitz.open()
+    for page_number, page_rows in enumerate(pages):
+        page = doc.new_page(width=width, height=height)
+        rows = list(page_rows)
+        if page_number == 0:
+            rows = [["Live Facial Recognition deployment record"] + [""] * (len(LFR_HEADERS) - 1), LFR_HEADERS] + rows
+
+        bottom = margin + len(rows) * row_height
+        for i in range(len(rows) + 1):
+            page.draw_line((margin, margin + i * row_height), (width - margin, margin + i * row_height), width=0.5)
+        for j in range(len(LFR_HEADERS) + 1):
+            page.draw_line((margin + j * column_width, margin), (margin + j * column_width, bottom), width=0.5)
+
+        for i, row in enumerate(rows):
+            for j, value in enumerate(row):
+                cell = fitz.Rect(margin + j * column_width, margin + i * row_height, margin + (j + 1) * column_width, margin + (i + 1) * row_height)
+                page.insert_textbox(cell + (2, 2, -2, -2), value, fontsize=5)
+
+    # no timestamps in the file, so the same records always give the same PDF
+    doc.set_metadata({})
+    doc.save(pdf_path, garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+
+
+def make_lsoa_table(lsoa_gdf: gpd.GeoDataFrame, lfr_gdf: gpd.GeoDataFrame, seed: int = 0) -> pd.DataFrame:
+    """
+    A per-LSOA table with the columns of combined_counts.gpkg, for benchmarking the statistics on their own.
+
+    Stop & search counts follow a skewed distribution, deprivation is correlated with them, and
+    deployments are counted from the synthetic LFR sites.
+
+    Args:
+        lsoa_gdf (GeoDataFrame): Polygons from `make_lsoas`
+        lfr_gdf (GeoDataFrame): LFR deployments as points
+        seed (int): Random seed
+
+    Returns:
+        pd.DataFrame: LSOA11CD, stop & search counts for 2025 and 2023, abs_difference, lfr_count, IMD decile and USUALRES
+    """
+    rng = np.random.default_rng(seed)
+    n = len(lsoa_gdf)
+
+    intensity = rng.lognormal(2.5, 1.0, n)
+    count_2025 = rng.poisson(intensity)
+    count_2023 = rng.poisson(intensity * rng.lognormal(0, 0.3, n))
+
+    # more deprived (lower decile) where stop & search is heavier
+    deprivation = np.argsort(np.argsort(-(np.log1p(intensity) + rng.normal(0, 1, n))))
+    imd_decile = (deprivation * 10 // n + 1).astype(np.int8)
+
+    located = lfr_gdf.geometry[~lfr_gdf.geometry.is_empty].to_crs(lsoa_gdf.crs)
+    point_idx, lsoa_idx = shapely.STRtree(lsoa_gdf.geometry.values).query(located.values, predicate="within")
+    lfr_count = np.bincount(lsoa_idx, minlength=n)
+
+    return pd.DataFrame({
+        "LSOA11CD": lsoa_gdf["LSOA11CD"].to_numpy(),
+        "stop_search_count_2025": count_2025.astype("float64"),
+        "stop_search_count_2023": count_2023.astype("float64"),
+        "abs_difference": (count_2025 - count_2023).astype("float64"),
+        "lfr_count": lfr_count.astype("float64"),
+        "Index of Multiple Deprivation (IMD) Decile": imd_decile,
+        "USUALRES": lsoa_gdf["USUALRES"].to_numpy(),
+    })
+
+
+def generate_dataset(
+    root: Path,
+    n_rows: int,
+    n_lsoas: int = 4835,
+    n_deployments: int = 250,
+    start: str = "2025-01",
+    end: str = "2025-11",
+    forces: tuple[str, ...] = ("metropolitan",),
+    seed: int = 0,
+) -> SyntheticDataset:
+    """
+    Generate every synthetic input into `root`, or reuse the files already there if they were generated with the same parameters.
+
+    Args:
+        root (Path): Folder for the dataset
+        n_rows (int): Stop & search records in total
+        n_lsoas (int): Number of LSOA polygons
+        n_deployments (int): Number of LFR deployments
+        start (str): First month, as YYYY-MM
+        end (str): Last month, as YYYY-MM
+        forces (tuple[str, ...]): Forces to write CSVs for
+        seed (int): Random seed
+
+    Returns:
+        SyntheticDataset: Paths and sizes of the dataset
+    """
+    dataset = SyntheticDataset(root, n_rows, n_lsoas, n_deployments, start, end, tuple(forces), seed)
+    params_path = root / "dataset.json"
+
+    if params_path.exists() and json.loads(params_path.read_text(encoding="utf-8")) == dataset.params():
+        return dataset
+
+    root.mkdir(parents=True, exist_ok=True)
+    params_path.unlink(missing_ok=True)
+    shutil.rmtree(dataset.stop_search_dir, ignore_errors=True)
+    lsoa_seed, points_seed, rows_seed, lfr_seed, table_seed = np.random.SeedSequence(seed).generate_state(5)
+
+    lsoa_gdf = make_lsoas(n_lsoas, seed=int(lsoa_seed))
+    write_lsoa_zip(lsoa_gdf, dataset.lsoa_zip)
+
+    # police.uk has roughly one map point per 5 records in a year of Met data
+    map_points = make_map_points(lsoa_gdf, max(100, min(n_rows // 5, 40_000)), seed=int(points_seed))
+    write_stop_search_csvs(dataset.stop_search_dir, n_rows, start, end, map_points, forces, seed=int(rows_seed))
+
+    records = make_lfr_records(n_deployments, lsoa_gdf, start, end, seed=int(lfr_seed))
+    write_lfr_pdf(records, dataset.lfr_pdf)
+    lfr_gdf = gpd.GeoDataFrame(records, geometry=gpd.points_from_xy(records["longitude"], records["latitude"]), crs="EPSG:4326")
+    lfr_gdf.to_parquet(dataset.lfr_records, index=False)
+
+    make_lsoa_table(lsoa_gdf, lfr_gdf, seed=int(table_seed)).to_parquet(dataset.lsoa_table, index=False)
+
+    # written last, so an interrupted run is regenerated rather than reused
+    params_path.write_text(json.dumps(dataset.params(), indent=2), encoding="utf-8")
+    print(f"Generated {n_rows} stop & search rows, {n_lsoas} LSOAs and {n_deployments} deployments in {root}")
+
+    return dataset
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset for benchmarking")
+    parser.add_argument("--rows", type=int, default=100_000, help="Stop & search records in total")
+    parser.add_argument("--lsoas", type=int, default=4835)
+    parser.add_argument("--deployments", type=int, default=250)
+    parser.add_argument("--start", default="2025-01")
+    parser.add_argument("--end", default="2025-11")
+    parser.add_argument("--forces", nargs="+", default=["metropolitan"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, default=None, help="Defaults to ../data/synthetic/<rows>_seed<seed>")
+    args = parser.parse_args()
+
+    out_path = args.out or Path(f"../data/synthetic/{args.rows}_seed{args.seed}")
+    generate_dataset(out_path, args.rows, args.lsoas, args.deployments, args.start, args.end, tuple(args.forces), args.seed)
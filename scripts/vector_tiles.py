@@ -0,0 +1,745 @@
+"""
+Export the LSOA choropleth attributes and LFR deployment points as a Mapbox vector tile pyramid in an
+MBTiles file, for web maps and QGIS (Layer > Add Vector Tile Layer).
+
+Polygons are simplified once per zoom, as a coverage so neighbouring LSOAs keep shared edges. Tiles are
+encoded in batches across a process pool. Each feature's content hash and the tiles it was written to
+are kept in the MBTiles file, so a refresh only rewrites the tiles over LSOAs or deployments that changed.
+"""
+
+import gzip
+import hashlib
+import json
+import sqlite3
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import cached_property
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+from instrumentation import annotate, count, instrumented, recording, span
+
+WEB_MERCATOR = "EPSG:3857"
+MERCATOR_HALF_WIDTH = 20037508.342789244
+EXTENT = 4096
+BUFFER = 64
+
+IMD_DECILE = "Index of Multiple Deprivation (IMD) Decile"
+LSOA_PROPERTIES = {
+    "LSOA11CD": "LSOA11CD",
+    "LSOA11NM": "LSOA11NM",
+    "stop_search_count_2025": "stop_search_count_2025",
+    "stop_search_count_2023": "stop_search_count_2023",
+    "abs_difference": "abs_difference",
+    "lfr_count": "lfr_count",
+    IMD_DECILE: "imd_decile",
+}
+LFR_PROPERTIES = {
+    "Deployment Location": "location",
+    "Date": "date",
+    "LFR Use Case": "use_case",
+}
+
+# geometry type ids shared by shapely and the MVT spec
+MVT_POINT, MVT_POLYGON = 1, 3
+
+
+@dataclass
+class VectorLayer:
+    """
+    One tile layer: features with a stable id (e.g. the LSOA code), geometry in Web Mercator and properties.
+    """
+
+    name: str
+    ids: np.ndarray
+    geometry: np.ndarray
+    properties: pd.DataFrame
+    simplify: bool = True
+
+    @classmethod
+    def from_gdf(cls, name: str, gdf: gpd.GeoDataFrame, properties: dict[str, str], id_column: str | None = None, simplify: bool = True) -> "VectorLayer":
+        """
+        Build a layer from a GeoDataFrame, keeping and renaming the given columns.
+
+        Args:
+            name (str): Layer name
+            gdf (GeoDataFrame): Features
+            properties (dict[str, str]): Column -> property name; missing columns are skipped
+            id_column (str | None): Column identifying a feature across refreshes, None to identify features by their content
+            simplify (bool): Simplify the geometry per zoom (polygons)
+
+        Returns:
+            VectorLayer: The layer
+        """
+        gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty].reset_index(drop=True)
+        columns = {column: renamed for column, renamed in properties.items() if column in gdf.columns}
+        frame = gdf[list(columns)].rename(columns=columns)
+        for column in frame.columns:
+            if pd.api.types.is_datetime64_any_dtype(frame[column]):
+                frame[column] = frame[column].dt.strftime("%Y-%m-%d")
+
+        layer = cls(name, np.empty(0, dtype=object), np.asarray(gdf.geometry.to_crs(WEB_MERCATOR).values), frame, simplify)
+        if id_column:
+            layer.ids = gdf[id_column].astype(str).to_numpy()
+        else:
+            # content ids, numbered among duplicates, so inserting a row does not shift every other feature's id
+            hashes = pd.Series(layer.feature_hashes())
+            layer.ids = (hashes + "-" + hashes.groupby(hashes).cumcount().astype(str)).to_numpy()
+
+        return layer
+
+    def feature_hashes(self) -> np.ndarray:
+        """
+        Hash of each feature's geometry and properties, as hex strings.
+        """
+        content = self.properties.assign(_wkb=shapely.to_wkb(self.geometry, hex=True))
+        hashes = pd.util.hash_pandas_object(content, index=False).to_numpy()
+
+        return np.char.mod("%016x", hashes)
+
+    def tile_ids(self) -> np.ndarray:
+        """
+        A 48-bit integer per feature derived from its id, stable across refreshes and exact in JavaScript.
+        """
+        return np.array([int(hashlib.blake2b(i.encode(), digest_size=6).hexdigest(), 16) for i in self.ids], dtype=np.uint64)
+
+    @cached_property
+    def geometry_key(self) -> str:
+        digest = hashlib.sha256()
+        for wkb in shapely.to_wkb(self.geometry):
+            digest.update(wkb)
+
+        return digest.hexdigest()
+
+
+def tile_size(zoom: int) -> float:
+    """
+    Width of a tile at `zoom`, in Web Mercator metres.
+    """
+    return 2 * MERCATOR_HALF_WIDTH / 2**zoom
+
+
+@instrumented
+def simplify_for_zoom(layer: VectorLayer, zoom: int, tolerance_px: float, cache_dir: Path | None = None) -> np.ndarray:
+    """
+    Simplify a layer's polygons for one zoom, with a tolerance of `tolerance_px` tile units, reusing the cached result.
+
+    The polygons are simplified together as a coverage, so shared LSOA boundaries are simplified once and
+    neighbours neither overlap nor open gaps.
+
+    Args:
+        layer (VectorLayer): Layer to simplify
+        zoom (int): Zoom level
+        tolerance_px (float): Tolerance in tile units (1/4096 of a tile)
+        cache_dir (Path | None): Folder for simplified geometry, keyed by the input geometry's hash
+
+    Returns:
+        np.ndarray: Simplified geometry per feature
+    """
+    if not layer.simplify:
+        return layer.geometry
+
+    tolerance = tolerance_px * tile_size(zoom) / EXTENT
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = cache_dir / f"{layer.name}_z{zoom}_{tolerance_px:g}px_{layer.geometry_key[:16]}.parquet"
+        if cache_path.exists():
+            count("tile_simplify.cache_hits")
+            return shapely.from_wkb(pq.read_table(cache_path).column("wkb").to_numpy(zero_copy_only=False))
+
+    simplified = shapely.coverage_simplify(layer.geometry, tolerance)
+
+    if cache_path is not None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for stale in cache_dir.glob(f"{layer.name}_z{zoom}_*.parquet"):
+            stale.unlink()
+        pq.write_table(pa.table({"wkb": shapely.to_wkb(simplified)}), cache_path)
+
+    return simplified
+
+
+def tile_pairs(geometry: np.ndarray, zoom: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Every (feature, tile) pair at a zoom, from the feature bounds padded by the tile buffer.
+
+    Args:
+        geometry (np.ndarray): Geometry per feature in Web Mercator
+        zoom (int): Zoom level
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Feature row and tile key (x * 2**zoom + y) per pair
+    """
+    size = tile_size(zoom)
+    n = 2**zoom
+    pad = size * BUFFER / EXTENT
+
+    present = ~shapely.is_empty(geometry) & ~shapely.is_missing(geometry)
+    rows = np.flatnonzero(present)
+    minx, miny, maxx, maxy = shapely.bounds(geometry[rows]).T
+
+    x0 = np.clip(np.floor((minx - pad + MERCATOR_HALF_WIDTH) / size), 0, n - 1).astype(np.int64)
+    x1 = np.clip(np.floor((maxx + pad + MERCATOR_HALF_WIDTH) / size), 0, n - 1).astype(np.int64)
+    y0 = np.clip(np.floor((MERCATOR_HALF_WIDTH - maxy - pad) / size), 0, n - 1).astype(np.int64)
+    y1 = np.clip(np.floor((MERCATOR_HALF_WIDTH - miny + pad) / size), 0, n - 1).astype(np.int64)
+
+    widths = x1 - x0 + 1
+    heights = y1 - y0 + 1
+    per_feature = widths * heights
+
+    feature = np.repeat(np.arange(len(rows)), per_feature)
+    within = np.arange(per_feature.sum()) - np.repeat(np.cumsum(per_feature) - per_feature, per_feature)
+    x = x0[feature] + within % widths[feature]
+    y = y0[feature] + within // widths[feature]
+
+    return rows[feature], x * n + y
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+    return bytes(out)
+
+
+def _varints(values: np.ndarray) -> tuple[bytes, np.ndarray]:
+    """
+    Encode unsigned integers as concatenated protobuf varints in one pass per byte position.
+
+    Returns:
+        tuple[bytes, np.ndarray]: The bytes, and the byte offset of each value (plus the end)
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        n_bytes += values >= np.uint64(1 << shift)
+
+    offsets = np.concatenate([[0], np.cumsum(n_bytes)])
+    out = np.empty(offsets[-1], dtype=np.uint8)
+    for k in range(int(n_bytes.max(initial=0))):
+        has = n_bytes > k
+        group = (values[has] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (n_bytes[has] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[offsets[:-1][has] + k] = (group | more).astype(np.uint8)
+
+    return out.tobytes(), offsets
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    # a length-delimited protobuf field
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _zigzag(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def encode_value(value) -> bytes:
+    """
+    An MVT Value message; whole numbers are written as integers so maps can style them as classes.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return _varint(7 << 3) + _varint(int(value))
+    if isinstance(value, (int, np.integer)) or (isinstance(value, (float, np.floating)) and float(value).is_integer()):
+        return _varint(6 << 3) + _varint(int(_zigzag(np.array([int(value)]))[0]))
+    if isinstance(value, (float, np.floating)):
+        return _varint(3 << 3 | 1) + struct.pack("<d", float(value))
+
+    return _field(1, str(value).encode("utf-8"))
+
+
+def _quantize(coords: np.ndarray, pair: np.ndarray, tile_x: np.ndarray, tile_y: np.ndarray, size: float) -> tuple[np.ndarray, np.ndarray]:
+    # tile units with y pointing down from the tile's top-left corner
+    x = np.rint((coords[:, 0] + MERCATOR_HALF_WIDTH - tile_x[pair] * size) / size * EXTENT).astype(np.int64)
+    y = np.rint((MERCATOR_HALF_WIDTH - tile_y[pair] * size - coords[:, 1]) / size * EXTENT).astype(np.int64)
+
+    return x, y
+
+
+def polygon_commands(geometry: np.ndarray, tile_x: np.ndarray, tile_y: np.ndarray, size: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    MVT geometry command integers for clipped polygons, one feature per entry, all encoded together.
+
+    Rings are quantised to tile units, closing and repeated points dropped, degenerate rings removed
+    (with the holes of a removed exterior), and wound as the spec requires: exteriors with positive
+    area in tile coordinates, holes with negative.
+
+    Args:
+        geometry (np.ndarray): Clipped (multi)polygons in Web Mercator, empty where nothing is left
+        tile_x (np.ndarray): Tile column per feature
+        tile_y (np.ndarray): Tile row per feature
+        size (float): Tile width in Web Mercator metres
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Command integers, and the offset of each feature's commands (plus the end)
+    """
+    parts, part_pair = shapely.get_parts(geometry, return_index=True)
+    polygon = shapely.get_type_id(parts) == MVT_POLYGON
+    parts, part_pair = parts[polygon], part_pair[polygon]
+
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    ring_pair = part_pair[ring_part]
+    exterior = np.concatenate([[True], ring_part[1:] != ring_part[:-1]]) if len(rings) else np.zeros(0, dtype=bool)
+
+    coords, point_ring = shapely.get_coordinates(rings, return_index=True)
+    x, y = _quantize(coords, ring_pair[point_ring], tile_x, tile_y, size)
+
+    same_ring = point_ring[1:] == point_ring[:-1]
+    closing = np.concatenate([~same_ring, [True]])
+    repeated = np.concatenate([[False], same_ring & (x[1:] == x[:-1]) & (y[1:] == y[:-1])])
+    keep = ~closing & ~repeated
+    x, y, point_ring = x[keep], y[keep], point_ring[keep]
+
+    ring_len = np.bincount(point_ring, minlength=len(rings))
+    ring_start = np.concatenate([[0], np.cumsum(ring_len)[:-1]])
+    position = np.arange(len(x)) - ring_start[point_ring]
+
+    # surveyor's formula over each ring, wrapping to its first point
+    following = np.where(position == ring_len[point_ring] - 1, ring_start[point_ring], np.arange(len(x)) + 1)
+    following = np.minimum(following, max(len(x) - 1, 0))
+    area = np.bincount(point_ring, x * y[following] - x[following] * y, minlength=len(rings)) / 2
+
+    valid = (ring_len >= 3) & (area != 0)
+    kept_part = np.zeros(len(parts), dtype=bool)
+    kept_part[ring_part[exterior & valid]] = True
+    valid &= kept_part[ring_part]
+
+    flip = valid & ((area > 0) != exterior)
+    order = np.arange(len(x))
+    reversed_ring = flip[point_ring]
+    order[reversed_ring] = (ring_start + ring_len - 1)[point_ring][reversed_ring] - position[reversed_ring]
+    x, y = x[order], y[order]
+
+    keep = valid[point_ring]
+    x, y, point_ring, position = x[keep], y[keep], point_ring[keep], position[keep]
+    ring_len = np.where(valid, ring_len, 0)
+
+    # the cursor carries on from ring to ring within a feature and restarts at 0 for each feature
+    point_pair = ring_pair[point_ring]
+    first = np.concatenate([[True], point_pair[1:] != point_pair[:-1]]) if len(x) else np.zeros(0, dtype=bool)
+    dx = np.where(first, x, x - np.roll(x, 1))
+    dy = np.where(first, y, y - np.roll(y, 1))
+
+    # per ring: MoveTo(1) dx dy, LineTo(n - 1) then 2(n - 1) deltas, ClosePath
+    ring_tokens = np.where(valid, 2 * ring_len + 3, 0)
+    token_start = np.concatenate([[0], np.cumsum(ring_tokens)])
+    commands = np.empty(token_start[-1], dtype=np.uint64)
+    starts = token_start[:-1][valid]
+    commands[starts] = 1 | 1 << 3
+    commands[starts + 3] = (2 | (ring_len[valid] - 1) << 3).astype(np.uint64)
+    commands[starts + ring_tokens[valid] - 1] = 7 | 1 << 3
+
+    slot = token_start[:-1][point_ring] + np.where(position == 0, 1, 4 + 2 * (position - 1))
+    commands[slot] = _zigzag(dx)
+    commands[slot + 1] = _zigzag(dy)
+
+    feature_tokens = np.bincount(ring_pair, weights=ring_tokens, minlength=len(geometry)).astype(np.int64)
+
+    return commands, np.concatenate([[0], np.cumsum(feature_tokens)])
+
+
+def point_commands(geometry: np.ndarray, tile_x: np.ndarray, tile_y: np.ndarray, size: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    MVT geometry command integers for (multi)points, one feature per entry; see `polygon_commands`.
+    """
+    coords, point_pair = shapely.get_coordinates(geometry, return_index=True)
+    x, y = _quantize(coords, point_pair, tile_x, tile_y, size)
+
+    inside = (x >= -BUFFER) & (x <= EXTENT + BUFFER) & (y >= -BUFFER) & (y <= EXTENT + BUFFER)
+    x, y, point_pair = x[inside], y[inside], point_pair[inside]
+
+    n_points = np.bincount(point_pair, minlength=len(geometry))
+    feature_tokens = np.where(n_points > 0, 1 + 2 * n_points, 0)
+    token_start = np.concatenate([[0], np.cumsum(feature_tokens)])
+
+    first = np.concatenate([[True], point_pair[1:] != point_pair[:-1]]) if len(x) else np.zeros(0, dtype=bool)
+    dx = np.where(first, x, x - np.roll(x, 1))
+    dy = np.where(first, y, y - np.roll(y, 1))
+    position = np.arange(len(x)) - (np.cumsum(n_points) - n_points)[point_pair]
+
+    commands = np.empty(token_start[-1], dtype=np.uint64)
+    has_points = n_points > 0
+    commands[token_start[:-1][has_points]] = (1 | n_points[has_points] << 3).astype(np.uint64)
+    slot = token_start[:-1][point_pair] + 1 + 2 * position
+    commands[slot] = _zigzag(dx)
+    commands[slot + 1] = _zigzag(dy)
+
+    return commands, token_start
+
+
+@dataclass
+class LayerBatch:
+    """
+    The (feature, tile) pairs of one layer within a batch of tiles, with everything needed to encode them.
+    """
+
+    name: str
+    geometry_type: int
+    tile: np.ndarray
+    feature_id: np.ndarray
+    geometry: np.ndarray
+    codes: np.ndarray
+    keys: list[str]
+    values: list[list[bytes]]
+
+
+def encode_tile_batch(zoom: int, tile_keys: np.ndarray, layers: list[LayerBatch]) -> list[tuple[int, bytes]]:
+    """
+    Clip, quantise and encode a batch of tiles at one zoom. Runs in a worker process.
+
+    Args:
+        zoom (int): Zoom level
+        tile_keys (np.ndarray): Tile keys (x * 2**zoom + y) in the batch
+        layers (list[LayerBatch]): Pairs per layer, `tile` indexing into `tile_keys`
+
+    Returns:
+        list[tuple[int, bytes]]: Tile key and gzipped MVT bytes per tile with any features
+    """
+    n = 2**zoom
+    size = tile_size(zoom)
+    pad = size * BUFFER / EXTENT
+    tile_x, tile_y = tile_keys // n, tile_keys % n
+
+    encoded_layers = {}
+    for layer in layers:
+        x, y = tile_x[layer.tile], tile_y[layer.tile]
+        if layer.geometry_type == MVT_POLYGON:
+            minx = x * size - MERCATOR_HALF_WIDTH - pad
+            maxy = MERCATOR_HALF_WIDTH - y * size + pad
+            boxes = shapely.box(minx, maxy - size - 2 * pad, minx + size + 2 * pad, maxy)
+            clipped = shapely.intersection(layer.geometry, boxes)
+            commands, offsets = polygon_commands(clipped, x, y, size)
+        else:
+            commands, offsets = point_commands(layer.geometry, x, y, size)
+
+        geometry_bytes, byte_offsets = _varints(commands)
+        byte_offsets = byte_offsets[offsets]
+
+        for tile in np.unique(layer.tile):
+            pairs = np.flatnonzero((layer.tile == tile) & (offsets[1:] > offsets[:-1]))
+            if not len(pairs):
+                continue
+
+            # the tile's values table holds only the values its features use, in order of first use,
+            # so a tile's bytes depend on its own features alone
+            codes = layer.codes[pairs]
+            present = codes >= 0
+            column = np.broadcast_to(np.arange(codes.shape[1]), codes.shape)
+            value_keys = column.astype(np.int64) << 32 | np.maximum(codes, 0)
+            used, first, inverse = np.unique(value_keys[present], return_index=True, return_inverse=True)
+            rank = np.empty(len(used), dtype=np.int64)
+            rank[np.argsort(first)] = np.arange(len(used))
+            used = used[np.argsort(first)]
+            value_index = np.full(codes.shape, -1, dtype=np.int64)
+            value_index[present] = rank[inverse]
+
+            # (key, value) index pairs of every feature in the tile, encoded at once and sliced per feature
+            tags = np.stack([column, value_index], axis=-1)[present].ravel()
+            tag_bytes, tag_offsets = _varints(tags)
+            tag_offsets = tag_offsets[2 * np.concatenate([[0], np.cumsum(present.sum(axis=1))])].tolist()
+            geometry_offsets = byte_offsets[pairs].tolist()
+            geometry_ends = byte_offsets[pairs + 1].tolist()
+            feature_ids = layer.feature_id[pairs].tolist()
+            geometry_type = _varint(3 << 3) + _varint(layer.geometry_type)
+
+            features = []
+            for row in range(len(pairs)):
+                feature = (
+                    _varint(1 << 3) + _varint(feature_ids[row])
+                    + _field(2, tag_bytes[tag_offsets[row]:tag_offsets[row + 1]])
+                    + geometry_type
+                    + _field(4, geometry_bytes[geometry_offsets[row]:geometry_ends[row]])
+                )
+                features.append(_field(2, feature))
+
+            values = [_field(4, layer.values[key >> 32][key & 0xFFFFFFFF]) for key in used.tolist()]
+            message = (
+                _varint(15 << 3) + _varint(2)
+                + _field(1, layer.name.encode("utf-8"))
+                + b"".join(features)
+                + b"".join(_field(3, key.encode("utf-8")) for key in layer.keys)
+                + b"".join(values)
+                + _varint(5 << 3) + _varint(EXTENT)
+            )
+            encoded_layers.setdefault(int(tile), []).append(_field(3, message))
+
+    return [
+        (int(tile_keys[tile]), gzip.compress(b"".join(messages), mtime=0))
+        for tile, messages in sorted(encoded_layers.items())
+    ]
+
+
+def _property_tables(layer: VectorLayer) -> tuple[np.ndarray, list[str], list[list[bytes]]]:
+    """
+    Each property column factorised once: per-feature value codes (-1 for missing) and encoded values.
+    """
+    codes = np.full((len(layer.ids), len(layer.properties.columns)), -1, dtype=np.int64)
+    values = []
+    for i, column in enumerate(layer.properties.columns):
+        column_codes, uniques = pd.factorize(layer.properties[column])
+        codes[:, i] = column_codes
+        values.append([encode_value(value) for value in uniques])
+
+    return codes, list(layer.properties.columns), values
+
+
+class TileStore:
+    """
+    An MBTiles file, plus the per-feature hashes and tile lists used to work out which tiles a refresh must rewrite.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB,
+                PRIMARY KEY (zoom_level, tile_column, tile_row));
+            CREATE TABLE IF NOT EXISTS feature_hashes (layer TEXT, feature TEXT, hash TEXT, PRIMARY KEY (layer, feature));
+            CREATE TABLE IF NOT EXISTS feature_tiles (layer TEXT, feature TEXT, zoom INTEGER, tile INTEGER);
+        """)
+
+    def metadata(self, name: str) -> str | None:
+        row = self.connection.execute("SELECT value FROM metadata WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def clear(self) -> None:
+        for table in ("tiles", "feature_hashes", "feature_tiles"):
+            self.connection.execute(f"DELETE FROM {table}")
+
+    def hashes(self, layer: str) -> pd.Series:
+        rows = self.connection.execute("SELECT feature, hash FROM feature_hashes WHERE layer = ?", (layer,)).fetchall()
+        return pd.Series(dict(rows), dtype=object)
+
+    def tiles_of(self, layer: str, features: list[str]) -> pd.DataFrame:
+        """
+        Zoom and tile key of every tile the given features were last written to.
+        """
+        frame = pd.read_sql_query("SELECT feature, zoom, tile FROM feature_tiles WHERE layer = ?", self.connection, params=(layer,))
+        return frame[frame["feature"].isin(features)]
+
+    def write_tiles(self, zoom: int, tiles: list[tuple[int, bytes]]) -> None:
+        n = 2**zoom
+        # MBTiles rows count from the bottom (TMS)
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+            [(zoom, key // n, n - 1 - key % n, data) for key, data in tiles],
+        )
+
+    def delete_tiles(self, zoom: int, keys: np.ndarray) -> int:
+        """
+        Delete tiles by key, returning how many existed.
+        """
+        n = 2**zoom
+        return self.connection.executemany(
+            "DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            [(zoom, key // n, n - 1 - key % n) for key in keys.tolist()],
+        ).rowcount
+
+    def save_state(self, layer: str, ids: np.ndarray, hashes: np.ndarray, feature_tiles: pd.DataFrame) -> None:
+        self.connection.execute("DELETE FROM feature_hashes WHERE layer = ?", (layer,))
+        self.connection.execute("DELETE FROM feature_tiles WHERE layer = ?", (layer,))
+        self.connection.executemany("INSERT INTO feature_hashes VALUES (?, ?, ?)", zip([layer] * len(ids), ids.tolist(), hashes.tolist()))
+        self.connection.executemany(
+            "INSERT INTO feature_tiles VALUES (?, ?, ?, ?)",
+            zip([layer] * len(feature_tiles), feature_tiles["feature"], feature_tiles["zoom"].tolist(), feature_tiles["tile"].tolist()),
+        )
+
+    def set_metadata(self, metadata: dict[str, str]) -> None:
+        self.connection.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)", metadata.items())
+
+    def commit(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+
+
+def _field_type(values: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(values):
+        return "Boolean"
+    if pd.api.types.is_numeric_dtype(values):
+        return "Number"
+
+    return "String"
+
+
+def _tilejson_metadata(layers: list[VectorLayer], min_zoom: int, max_zoom: int, params_key: str) -> dict[str, str]:
+    bounds = gpd.GeoSeries(np.concatenate([layer.geometry for layer in layers]), crs=WEB_MERCATOR).to_crs("EPSG:4326").total_bounds
+    vector_layers = [
+        {
+            "id": layer.name,
+            "fields": {column: _field_type(values) for column, values in layer.properties.items()},
+            "minzoom": min_zoom,
+            "maxzoom": max_zoom,
+        }
+        for layer in layers
+    ]
+
+    return {
+        "name": "lfr_stop_search",
+        "format": "pbf",
+        "type": "overlay",
+        "minzoom": str(min_zoom),
+        "maxzoom": str(max_zoom),
+        "bounds": ",".join(f"{value:.6f}" for value in bounds),
+        "center": f"{(bounds[0] + bounds[2]) / 2:.6f},{(bounds[1] + bounds[3]) / 2:.6f},{min_zoom + 2}",
+        "json": json.dumps({"vector_layers": vector_layers}),
+        "params_key": params_key,
+    }
+
+
+@instrumented
+def export_tiles(
+    layers: list[VectorLayer],
+    out_path: Path,
+    min_zoom: int = 8,
+    max_zoom: int = 14,
+    tolerance_px: float = 2.0,
+    cache_dir: Path | None = None,
+    tiles_per_batch: int = 64,
+    workers: int | None = None,
+) -> dict[str, int]:
+    """
+    Write or refresh the tile pyramid, rewriting only tiles over features whose geometry or properties changed.
+
+    A change of layers, properties, zoom range or tolerance rebuilds every tile.
+
+    Args:
+        layers (list[VectorLayer]): Layers to tile
+        out_path (Path): MBTiles file
+        min_zoom (int): Lowest zoom
+        max_zoom (int): Highest zoom; map clients overzoom beyond it
+        tolerance_px (float): Simplification tolerance in tile units (1/4096 of a tile)
+        cache_dir (Path | None): Folder for the per-zoom simplified geometry
+        tiles_per_batch (int): Tiles encoded per task
+        workers (int | None): Number of worker processes, defaults to the CPU count
+
+    Returns:
+        dict[str, int]: Tiles written, deleted and left untouched
+    """
+    params = {
+        "layers": [[layer.name, list(layer.properties.columns)] for layer in layers],
+        "zooms": [min_zoom, max_zoom],
+        "tolerance_px": tolerance_px,
+        "extent": EXTENT,
+        "buffer": BUFFER,
+    }
+    params_key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    store = TileStore(out_path)
+    rebuild = store.metadata("params_key") != params_key
+    if rebuild:
+        store.clear()
+
+    tables = {layer.name: _property_tables(layer) for layer in layers}
+    hashes = {layer.name: layer.feature_hashes() for layer in layers}
+    tile_ids = {layer.name: layer.tile_ids() for layer in layers}
+    changed = {}
+    previous_tiles = {}
+    for layer in layers:
+        stored = store.hashes(layer.name)
+        current = pd.Series(hashes[layer.name], index=layer.ids)
+        # new or edited features, plus removed ones whose old tiles must be rewritten without them
+        edited = current.index[current.to_numpy() != stored.reindex(current.index).to_numpy()]
+        removed = stored.index.difference(current.index)
+        changed[layer.name] = np.isin(layer.ids, edited)
+        previous_tiles[layer.name] = store.tiles_of(layer.name, [*edited, *removed])
+
+    stats = {"written": 0, "deleted": 0, "unchanged": 0}
+    feature_tiles = {layer.name: [] for layer in layers}
+    tasks = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        pairs = {}
+        for layer in layers:
+            geometry = simplify_for_zoom(layer, zoom, tolerance_px, cache_dir)
+            rows, keys = tile_pairs(geometry, zoom)
+            pairs[layer.name] = (geometry, rows, keys)
+            feature_tiles[layer.name].append(pd.DataFrame({"feature": layer.ids[rows], "zoom": zoom, "tile": keys}))
+
+        all_tiles = np.unique(np.concatenate([keys for _, _, keys in pairs.values()]))
+        if rebuild:
+            dirty = all_tiles
+        else:
+            dirty = np.unique(np.concatenate(
+                [keys[changed[name][rows]] for name, (_, rows, keys) in pairs.items()]
+                + [previous[previous["zoom"] == zoom]["tile"].to_numpy(np.int64) for previous in previous_tiles.values()]
+            ))
+
+        stale = np.setdiff1d(dirty, all_tiles)
+        stats["deleted"] += store.delete_tiles(zoom, stale)
+        dirty = np.intersect1d(dirty, all_tiles)
+        stats["unchanged"] += len(all_tiles) - len(dirty)
+
+        for start in range(0, len(dirty), tiles_per_batch):
+            batch_keys = dirty[start:start + tiles_per_batch]
+            batch = []
+            for layer in layers:
+                geometry, rows, keys = pairs[layer.name]
+                in_batch = np.isin(keys, batch_keys)
+                codes, names, values = tables[layer.name]
+                batch.append(LayerBatch(
+                    name=layer.name,
+                    geometry_type=MVT_POLYGON if layer.simplify else MVT_POINT,
+                    tile=np.searchsorted(batch_keys, keys[in_batch]),
+                    feature_id=tile_ids[layer.name][rows[in_batch]],
+                    geometry=geometry[rows[in_batch]],
+                    codes=codes[rows[in_batch]],
+                    keys=names,
+                    values=values,
+                ))
+            tasks.append((zoom, batch_keys, batch))
+
+    annotate(rows_in=sum(len(layer.ids) for layer in layers), tiles=sum(len(keys) for _, keys, _ in tasks))
+
+    with span("encode_tiles", tasks=len(tasks)):
+        if len(tasks) > 1 and workers != 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(encode_tile_batch, *zip(*tasks)))
+        else:
+            results = [encode_tile_batch(*task) for task in tasks]
+
+    for (zoom, batch_keys, _), tiles in zip(tasks, results):
+        store.write_tiles(zoom, tiles)
+        # tiles whose features were all clipped away are removed rather than left stale
+        empty = np.setdiff1d(batch_keys, [key for key, _ in tiles])
+        stats["written"] += len(tiles)
+        stats["deleted"] += store.delete_tiles(zoom, empty)
+
+    for layer in layers:
+        store.save_state(layer.name, layer.ids, hashes[layer.name], pd.concat(feature_tiles[layer.name], ignore_index=True))
+    store.set_metadata(_tilejson_metadata(layers, min_zoom, max_zoom, params_key))
+    store.commit()
+
+    count("tiles.written", stats["written"])
+    count("tiles.deleted", stats["deleted"])
+    count("tiles.unchanged", stats["unchanged"])
+
+    return stats
+
+
+if __name__ == "__main__":
+    in_path_counts = Path("../data/processed/combined_counts.gpkg")
+    in_path_lfr = Path("../data/processed/lfr_deployments.parquet")
+    cache_dir = Path("../data/processed/tile_cache")
+    out_path = Path("../outputs/tiles/lfr_stop_search.mbtiles")
+
+    with recording("vector_tiles"):
+        lsoa_gdf = gpd.read_file(in_path_counts)
+        lfr_gdf = gpd.read_parquet(in_path_lfr)
+
+        layers = [
+            VectorLayer.from_gdf("lsoa", lsoa_gdf, LSOA_PROPERTIES, id_column="LSOA11CD"),
+            VectorLayer.from_gdf("lfr", lfr_gdf, LFR_PROPERTIES, simplify=False),
+        ]
+        stats = export_tiles(layers, out_path, cache_dir=cache_dir)
+
+        print(f"Tiles written: {stats['written']}, deleted: {stats['deleted']}, unchanged: {stats['unchanged']} ({out_path})")
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the scripts are flat modules run from scripts/, not an installed package
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
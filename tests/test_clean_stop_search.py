@@ -0,0 +1,75 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from lsoa_counts import count_lsoa_ids
+from lsoa_index import LsoaIndex
+from synthetic_data import make_lsoas, make_map_points, write_stop_search_csvs
+
+START, END = "2025-01", "2025-03"
+FORCES = ("city-of-london", "metropolitan")
+N_ROWS = 3_001
+
+
+@pytest.fixture(scope="module")
+def ss():
+    # the file name is not a valid module name, so it is loaded by path
+    path = Path(__file__).resolve().parents[1] / "scripts" / "clean_s&s_agg.py"
+    spec = importlib.util.spec_from_file_location("clean_s_and_s_agg", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+@pytest.fixture(scope="module")
+def lsoa_index():
+    index = LsoaIndex(make_lsoas(n_lsoas=80, n_boroughs=5, seed=5).to_crs("EPSG:4326"))
+    index.build_grid(0.002)
+
+    return index
+
+
+@pytest.fixture(scope="module")
+def stop_search_dir(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("stop_search")
+    map_points = make_map_points(make_lsoas(n_lsoas=80, n_boroughs=5, seed=5), 400, seed=6)
+    write_stop_search_csvs(folder, N_ROWS, START, END, map_points, FORCES, seed=7)
+
+    return folder
+
+
+def reference_counts(ss, folder, lsoa_index, by_force):
+    """
+    Counts from loading whole months into memory, as before the streaming path existed.
+    """
+    counts = {}
+    for csv_path in ss.find_stop_search_files(folder, START, END, forces=None):
+        month, force = ss.stop_search_file_parts(csv_path)
+        df = ss.load_stop_search(folder, month, month, columns=["Latitude", "Longitude"], forces=(force,))
+        gdf = ss.convert_to_geo_data(df)
+        key = f"{force}_{month}" if by_force else month
+        file_counts = count_lsoa_ids(lsoa_index.assign_ids(gdf.geometry, mode="exact"), len(lsoa_index.codes))
+        counts[key] = counts[key] + file_counts if key in counts else file_counts
+
+    return counts
+
+
+# files hold 500 or 501 rows, so 7 and 167 row chunks put many boundaries inside a file and leave a short last chunk
+@pytest.mark.parametrize("chunk_size", [7, 167, 1_000_000])
+@pytest.mark.parametrize("by_force", [False, True])
+@pytest.mark.parametrize("mode", ["exact", "grid"])
+def test_stream_matches_in_memory_counts(ss, lsoa_index, stop_search_dir, chunk_size, by_force, mode):
+    expected = reference_counts(ss, stop_search_dir, lsoa_index, by_force)
+
+    streamed = ss.stream_lsoa_counts(
+        stop_search_dir, START, END, lsoa_index, forces=None, chunk_size=chunk_size, mode=mode, by_force=by_force, workers=2,
+    )
+
+    assert sorted(streamed) == sorted(expected)
+    assert len(streamed) == (len(FORCES) * 3 if by_force else 3)
+    for key in expected:
+        np.testing.assert_array_equal(streamed[key], expected[key])
+    assert sum(counts.sum() for counts in streamed.values()) > 0.9 * N_ROWS
@@ -0,0 +1,82 @@
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from density_grid import RasterGrid, write_geotiff
+
+TYPE_FORMATS = {3: "H", 4: "I", 12: "d"}
+SAMPLE_KINDS = {1: "u", 2: "i", 3: "f"}
+
+
+def read_tiff_tags(data: bytes) -> dict[int, tuple]:
+    """
+    Tags of the first IFD of a little-endian TIFF, read straight from the bytes.
+    """
+    assert data[:4] == b"II*\x00"
+    (ifd_offset,) = struct.unpack_from("<I", data, 4)
+    (n_entries,) = struct.unpack_from("<H", data, ifd_offset)
+
+    tags = {}
+    for i in range(n_entries):
+        tag, field_type, n = struct.unpack_from("<HHI", data, ifd_offset + 2 + 12 * i)
+        fmt = f"<{n}{TYPE_FORMATS[field_type]}"
+        offset = ifd_offset + 2 + 12 * i + 8
+        if struct.calcsize(fmt) > 4:
+            (offset,) = struct.unpack_from("<I", data, offset)
+        tags[tag] = struct.unpack_from(fmt, data, offset)
+
+    return tags
+
+
+def read_with_struct(path):
+    data = path.read_bytes()
+    tags = read_tiff_tags(data)
+
+    (nx,), (ny,), (bits,), (compression,), (kind,) = (tags[t] for t in (256, 257, 258, 259, 339))
+    assert compression == 8
+    dtype = np.dtype(f"<{SAMPLE_KINDS[kind]}{bits // 8}")
+    raw = b"".join(zlib.decompress(data[o:o + n]) for o, n in zip(tags[273], tags[279]))
+    array = np.frombuffer(raw, dtype=dtype).reshape(ny, nx)
+
+    scale_x, scale_y, _ = tags[33550]
+    _, _, _, x0, top, _ = tags[33922]
+    geokeys = np.array(tags[34735]).reshape(-1, 4)
+    epsg = int(geokeys[geokeys[:, 0] == 3072, 3][0])
+
+    return array, (x0, scale_x, top, -scale_y), epsg
+
+
+def read_with_rasterio(path):
+    rasterio = pytest.importorskip("rasterio")
+    with rasterio.open(path) as src:
+        t = src.transform
+        return src.read(1), (t.c, t.a, t.f, t.e), src.crs.to_epsg()
+
+
+def read_with_tifffile(path):
+    tifffile = pytest.importorskip("tifffile")
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages[0]
+        scale_x, scale_y, _ = page.tags["ModelPixelScaleTag"].value
+        _, _, _, x0, top, _ = page.tags["ModelTiepointTag"].value
+        epsg = page.geotiff_tags["ProjectedCSTypeGeoKey"]
+        return page.asarray(), (x0, scale_x, top, -scale_y), int(epsg)
+
+
+@pytest.mark.parametrize("reader", [read_with_struct, read_with_rasterio, read_with_tifffile])
+@pytest.mark.parametrize("dtype", [np.float32, np.float64, np.int32, np.uint32])
+def test_write_geotiff_round_trip(tmp_path, reader, dtype):
+    # 37 rows is not a multiple of the 16 rows per strip, so the last strip is short
+    grid = RasterGrid(x0=503_250.0, y0=155_500.0, cell_size=250.0, nx=23, ny=37)
+    array = np.random.default_rng(1).uniform(0, 1_000, (grid.ny, grid.nx)).astype(dtype)
+    path = tmp_path / "layer.tif"
+
+    write_geotiff(path, array, grid)
+    read_array, transform, epsg = reader(path)
+
+    assert read_array.dtype == array.dtype
+    np.testing.assert_array_equal(read_array, array)
+    assert transform == (grid.x0, grid.cell_size, grid.y0 + grid.ny * grid.cell_size, -grid.cell_size)
+    assert epsg == grid.epsg
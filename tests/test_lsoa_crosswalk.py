@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+
+from lsoa_crosswalk import additive_columns
+
+
+def test_additive_columns_keep_counts_and_drop_rates():
+    combined = pd.DataFrame({
+        "LSOA11CD": ["E01000001"],
+        "LSOA11NM": ["City of London 001A"],
+        "stop_search_count_2025": [12],
+        "abs_difference": [-3],
+        "lfr_count": [1],
+        "Index of Multiple Deprivation (IMD) Decile": [4],
+        "USUALRES": [1500],
+        "POPDEN": [112.9],
+    })
+
+    assert additive_columns(combined) == ["stop_search_count_2025", "abs_difference", "lfr_count", "USUALRES"]
+
+
+def test_additive_columns_move_streamed_month_columns():
+    # the streaming mode names columns by month, or by force and month
+    national = pd.DataFrame({"LSOA11CD": ["E01000001"], "2025-01": [3], "metropolitan_2025-02": [5]})
+
+    assert additive_columns(national) == ["2025-01", "metropolitan_2025-02"]
+    assert additive_columns(national, ["2025-01"]) == ["2025-01"]
+
+
+def test_additive_columns_fail_when_nothing_to_move():
+    with pytest.raises(ValueError, match="No numeric count columns"):
+        additive_columns(pd.DataFrame({"LSOA11CD": ["E01000001"], "IMD Decile": [4]}))
+    with pytest.raises(ValueError, match="missing or not numeric"):
+        additive_columns(pd.DataFrame({"LSOA11CD": ["E01000001"], "2025-01": [3]}), ["LSOA11CD"])
@@ -0,0 +1,62 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from lsoa_index import LsoaIndex
+from synthetic_data import make_lsoas
+
+
+@pytest.fixture(scope="module")
+def boundaries():
+    return make_lsoas(n_lsoas=60, n_boroughs=4, seed=3).to_crs("EPSG:4326")
+
+
+def awkward_points(boundaries: gpd.GeoDataFrame, cell_size: float) -> gpd.GeoSeries:
+    rng = np.random.default_rng(0)
+    minx, miny, maxx, maxy = boundaries.total_bounds
+
+    # scattered over and around the LSOAs, so some fall outside every polygon
+    pad = (maxx - minx) * 0.1
+    x = rng.uniform(minx - pad, maxx + pad, 2_000)
+    y = rng.uniform(miny - pad, maxy + pad, 2_000)
+
+    # on grid cell borders and corners
+    gx = minx + cell_size * rng.integers(0, int((maxx - minx) / cell_size), 500)
+    gy = miny + cell_size * rng.integers(0, int((maxy - miny) / cell_size), 500)
+
+    # LSOA vertices lie on shared boundaries, where `within` assigns no LSOA
+    vertices = shapely.get_coordinates(boundaries.geometry.values)[::7]
+
+    xs = np.concatenate([x, gx, gx, rng.uniform(minx, maxx, 500), vertices[:, 0]])
+    ys = np.concatenate([y, rng.uniform(miny, maxy, 500), gy, gy, vertices[:, 1]])
+
+    return gpd.GeoSeries(gpd.points_from_xy(xs, ys), crs="EPSG:4326")
+
+
+@pytest.mark.parametrize("cell_size", [0.002, 0.0005])
+def test_grid_matches_exact(boundaries, cell_size):
+    index = LsoaIndex(boundaries)
+    index.build_grid(cell_size)
+    points = awkward_points(boundaries, cell_size)
+
+    exact = index.assign_ids(points, mode="exact")
+    grid = index.assign_ids(points, mode="grid")
+
+    assert (exact == -1).any() and (exact >= 0).any()
+    np.testing.assert_array_equal(grid, exact)
+
+
+def test_grid_matches_sjoin(boundaries):
+    index = LsoaIndex(boundaries)
+    index.build_grid(0.001)
+
+    assert index.check_grid_equivalence(awkward_points(boundaries, 0.001), sample_size=None) > 0
+
+
+def test_non_point_geometry_uses_exact_path(boundaries):
+    index = LsoaIndex(boundaries)
+    inner = boundaries.geometry.values[0].buffer(-0.0005)
+    geometries = gpd.GeoSeries([inner, shapely.Point(), None], crs="EPSG:4326")
+
+    np.testing.assert_array_equal(index.assign_ids(geometries, "grid"), index.assign_ids(geometries, "exact"))
@@ -0,0 +1,237 @@
+import gzip
+import struct
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from synthetic_data import make_lsoas
+from vector_tiles import (
+    BUFFER,
+    EXTENT,
+    MERCATOR_HALF_WIDTH,
+    MVT_POINT,
+    MVT_POLYGON,
+    LFR_PROPERTIES,
+    LayerBatch,
+    VectorLayer,
+    _property_tables,
+    encode_tile_batch,
+    tile_pairs,
+    tile_size,
+)
+
+
+# a minimal protobuf reader for the MVT schema, since mapbox_vector_tile is not a dependency
+
+def read_varint(buf: bytes, i: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = buf[i]
+        i += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, i
+
+
+def read_fields(buf: bytes):
+    i = 0
+    while i < len(buf):
+        key, i = read_varint(buf, i)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, i = read_varint(buf, i)
+        elif wire_type == 1:
+            (value,) = struct.unpack_from("<d", buf, i)
+            i += 8
+        elif wire_type == 2:
+            n, i = read_varint(buf, i)
+            value, i = buf[i:i + n], i + n
+        else:
+            raise ValueError(f"Unexpected wire type {wire_type}")
+        yield number, value
+
+
+def read_packed(buf: bytes) -> list[int]:
+    values, i = [], 0
+    while i < len(buf):
+        value, i = read_varint(buf, i)
+        values.append(value)
+    return values
+
+
+def unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def read_value(buf: bytes):
+    number, value = next(read_fields(buf))
+    return {1: lambda v: v.decode("utf-8"), 3: float, 6: unzigzag, 7: bool}[number](value)
+
+
+def read_geometry(commands: list[int], geometry_type: int):
+    x = y = 0
+    i = 0
+    points, rings = [], []
+    while i < len(commands):
+        command, n = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == 7:
+            rings.append(points)
+            points = []
+            continue
+        for _ in range(n):
+            x += unzigzag(commands[i])
+            y += unzigzag(commands[i + 1])
+            i += 2
+            points.append((x, y))
+
+    if geometry_type == MVT_POINT:
+        return shapely.multipoints(points)
+
+    # exteriors have positive area by the surveyor's formula in tile coordinates; holes follow their exterior
+    polygons = []
+    for ring in rings:
+        x, y = np.array(ring, dtype=np.float64).T
+        if np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) > 0:
+            polygons.append((ring, []))
+        else:
+            polygons[-1][1].append(ring)
+    return shapely.MultiPolygon([shapely.Polygon(shell, holes) for shell, holes in polygons])
+
+
+def read_tile(data: bytes) -> dict[str, list[dict]]:
+    layers = {}
+    for _, layer in read_fields(gzip.decompress(data)):
+        fields = list(read_fields(layer))
+        name = next(value for number, value in fields if number == 1).decode("utf-8")
+        keys = [value.decode("utf-8") for number, value in fields if number == 3]
+        values = [read_value(value) for number, value in fields if number == 4]
+        assert dict(fields)[5] == EXTENT and dict(fields)[15] == 2
+
+        features = []
+        for number, value in fields:
+            if number != 2:
+                continue
+            feature = dict(read_fields(value))
+            tags = read_packed(feature.get(2, b""))
+            features.append({
+                "id": feature[1],
+                "properties": {keys[tags[k]]: values[tags[k + 1]] for k in range(0, len(tags), 2)},
+                "geometry": read_geometry(read_packed(feature[4]), feature[3]),
+            })
+        layers[name] = features
+
+    return layers
+
+
+def to_tile_units(geometry, key: int, zoom: int):
+    size = tile_size(zoom)
+    x, y = divmod(key, 2**zoom)
+    return shapely.transform(
+        geometry,
+        lambda xy: np.column_stack([
+            (xy[:, 0] + MERCATOR_HALF_WIDTH - x * size) / size * EXTENT,
+            (MERCATOR_HALF_WIDTH - y * size - xy[:, 1]) / size * EXTENT,
+        ]),
+    )
+
+
+def layer_batch(layer: VectorLayer, geometry_type: int, zoom: int) -> tuple[LayerBatch, np.ndarray, np.ndarray]:
+    rows, keys = tile_pairs(layer.geometry, zoom)
+    tile_keys = np.unique(keys)
+    codes, names, values = _property_tables(layer)
+    batch = LayerBatch(
+        name=layer.name,
+        geometry_type=geometry_type,
+        tile=np.searchsorted(tile_keys, keys),
+        feature_id=np.arange(len(layer.ids), dtype=np.uint64)[rows],
+        geometry=layer.geometry[rows],
+        codes=codes[rows],
+        keys=names,
+        values=values,
+    )
+    return batch, rows, keys
+
+
+@pytest.fixture(scope="module")
+def lsoas():
+    lsoas = make_lsoas(n_lsoas=40, n_boroughs=4, seed=11).to_crs("EPSG:3857")
+    geometry = lsoas.geometry.to_numpy().copy()
+
+    # holes, and cuts splitting a polygon in two, centred on a zoom 13 tile so they also sit inside one zoom 11 tile
+    size = tile_size(13)
+    altered = 0
+    for row in range(len(geometry)):
+        inside = shapely.point_on_surface(geometry[row])
+        cx = (np.floor((inside.x + MERCATOR_HALF_WIDTH) / size) + 0.5) * size - MERCATOR_HALF_WIDTH
+        cy = MERCATOR_HALF_WIDTH - (np.floor((MERCATOR_HALF_WIDTH - inside.y) / size) + 0.5) * size
+        hole = shapely.Point(cx, cy).buffer(size / 8)
+        _, miny, _, maxy = geometry[row].bounds
+        cut = shapely.box(cx + size / 4, miny, cx + size / 4 + size / 50, maxy)
+        if geometry[row].contains(hole) and geometry[row].contains(shapely.Point(cx + size / 4, cy)):
+            geometry[row] = geometry[row].difference(hole).difference(cut)
+            altered += 1
+        if altered == 3:
+            break
+
+    assert altered == 3
+    return lsoas.set_geometry(geometry)
+
+
+@pytest.mark.parametrize("zoom", [11, 13])
+def test_polygon_tiles_decode_to_the_clipped_input(lsoas, zoom):
+    layer = VectorLayer.from_gdf("lsoa", lsoas, {"LSOA11CD": "lsoa_code", "USUALRES": "residents"}, id_column="LSOA11CD")
+    batch, rows, keys = layer_batch(layer, MVT_POLYGON, zoom)
+    tiles = dict(encode_tile_batch(zoom, np.unique(keys), [batch]))
+
+    size = tile_size(zoom)
+    pad = size * BUFFER / EXTENT
+    checked, holes, multipart = 0, 0, 0
+    for row, key in zip(rows, keys):
+        x, y = divmod(int(key), 2**zoom)
+        minx, maxy = x * size - MERCATOR_HALF_WIDTH - pad, MERCATOR_HALF_WIDTH - y * size + pad
+        clipped = to_tile_units(shapely.clip_by_rect(layer.geometry[row], minx, maxy - size - 2 * pad, minx + size + 2 * pad, maxy), int(key), zoom)
+
+        decoded = [f for f in read_tile(tiles[int(key)])["lsoa"] if f["id"] == row] if int(key) in tiles else []
+        # rounding to whole tile units moves each edge by under a unit, so the shapes differ by at most a strip along the outline
+        tolerance = clipped.length + 1
+        if not decoded:
+            assert clipped.area < tolerance
+            continue
+
+        (feature,) = decoded
+        assert feature["properties"] == {"lsoa_code": layer.ids[row], "residents": int(layer.properties["residents"][row])}
+        assert feature["geometry"].is_valid
+        assert shapely.symmetric_difference(feature["geometry"], clipped).area < tolerance
+        checked += 1
+        holes += sum(shapely.get_num_interior_rings(part) for part in shapely.get_parts(clipped))
+        multipart += shapely.get_num_geometries(clipped) > 1
+
+    # a lost hole or part would leave far more than the tolerance, and both cases were compared
+    assert checked > len(layer.ids) and holes and multipart
+
+
+def test_point_tiles_decode_to_the_rounded_input():
+    zoom = 12
+    rng = np.random.default_rng(4)
+    deployments = gpd.GeoDataFrame(
+        {"Deployment Location": [f"site {i}" for i in range(60)], "Date": ["01/02/25"] * 60},
+        geometry=gpd.points_from_xy(rng.uniform(503_500, 561_900, 60), rng.uniform(155_800, 200_900, 60)),
+        crs="EPSG:27700",
+    )
+    layer = VectorLayer.from_gdf("lfr", deployments, LFR_PROPERTIES, simplify=False)
+    batch, rows, keys = layer_batch(layer, MVT_POINT, zoom)
+    tiles = {key: read_tile(data)["lfr"] for key, data in encode_tile_batch(zoom, np.unique(keys), [batch])}
+
+    for row, key in zip(rows, keys):
+        expected = np.rint(shapely.get_coordinates(to_tile_units(layer.geometry[row], int(key), zoom)))
+        inside = np.all((expected >= -BUFFER) & (expected <= EXTENT + BUFFER))
+        decoded = [f for f in tiles.get(int(key), []) if f["id"] == row]
+
+        assert len(decoded) == inside
+        if inside:
+            np.testing.assert_array_equal(shapely.get_coordinates(decoded[0]["geometry"]), expected)
+            assert decoded[0]["properties"]["location"] == deployments["Deployment Location"][row]